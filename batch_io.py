@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming I/O helpers for long batch generation runs.
+
+- CheckpointWriter: append-only JSONL output, one line per finished row, flushed
+  as soon as the row completes. Re-opening the same file reports which row ids
+  are already done so a crashed run can resume where it stopped.
+- iter_csv_rows: read a large CSV in fixed-size chunks and yield rows one by
+  one, so memory is bounded by the chunk size rather than the file size.
+- jsonl_to_csv: convert the checkpoint JSONL to the final CSV in two streaming
+  passes (column discovery + row offsets, then write in input order), so memory
+  holds one offset per row rather than the rows.
+- DatasetWriter: buffered JSONL dataset output (one open handle, optional
+  gzip / zstd, fixed-size shards) written to temp files and renamed into place
+  on close, so readers never see a half-written dataset.
+"""
+
+import csv
+import gzip
+import io
+import json
+import os
+import re
+import threading
+from typing import Dict, Any, Iterator, List, Optional, Set, Tuple
+
+import pandas as pd
+
+
+def _json_default(obj):
+    # numpy / pandas scalars coming from DataFrame rows
+    if hasattr(obj, "item"):
+        return obj.item()
+    return str(obj)
+
+
+def iter_jsonl(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Yield records from a JSONL file, skipping blank or half-written lines.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def read_csv_columns(path: str) -> List[str]:
+    """
+    Header of a CSV file without loading any rows.
+    """
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def iter_csv_chunks(path: str, chunksize: int = 256,
+                    usecols: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+    """
+    Yield DataFrame chunks of at most `chunksize` rows. The index keeps counting
+    across chunks, so it stays a global row number.
+    """
+    yield from pd.read_csv(path, chunksize=chunksize, usecols=usecols)
+
+
+def iter_csv_rows(path: str, chunksize: int = 256,
+                  usecols: Optional[List[str]] = None) -> Iterator[Tuple[int, pd.Series]]:
+    """
+    Yield (row_index, row) pairs like DataFrame.iterrows(), one chunk in memory at a time.
+    """
+    for chunk in iter_csv_chunks(path, chunksize=chunksize, usecols=usecols):
+        yield from chunk.iterrows()
+
+
+def _truncate_partial_line(path: str) -> None:
+    """
+    A crash mid-write can leave a last line without its newline; cut it off so
+    the next append starts on a fresh line.
+    """
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        # Scan backwards for the last complete line
+        pos = size - 1
+        block = 4096
+        while pos > 0:
+            start = max(0, pos - block)
+            f.seek(start)
+            chunk = f.read(pos - start)
+            nl = chunk.rfind(b"\n")
+            if nl != -1:
+                f.truncate(start + nl + 1)
+                return
+            pos = start
+        f.truncate(0)
+
+
+class CheckpointWriter:
+    """
+    Thread-safe append-only JSONL writer keyed by a row id field.
+
+    Records whose `error_field` is truthy are written (so the failure is visible)
+    but do not count as completed: a resumed run retries them, and the retry's
+    line supersedes the failed one in jsonl_to_csv(id_field=...).
+
+    Usage:
+        with CheckpointWriter("out.jsonl", id_field="id") as ckpt:
+            if not ckpt.is_done(row_id):
+                ckpt.write({... , "id": row_id, "error": False})
+    """
+
+    def __init__(self, path: str, id_field: str = "id", error_field: str = "error"):
+        self.path = path
+        self.id_field = id_field
+        self.error_field = error_field
+        self.completed_ids: Set[str] = set()
+        self.written = 0
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            _truncate_partial_line(path)
+            for record in iter_jsonl(path):
+                if id_field in record and not record.get(error_field):
+                    self.completed_ids.add(str(record[id_field]))
+        self._f = open(path, "a", encoding="utf-8")
+
+    def is_done(self, row_id) -> bool:
+        return str(row_id) in self.completed_ids
+
+    def write(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, ensure_ascii=False, default=_json_default) + "\n"
+        with self._lock:
+            self._f.write(line)
+            self._f.flush()
+            if not record.get(self.error_field):
+                self.completed_ids.add(str(record.get(self.id_field)))
+            self.written += 1
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._f.closed:
+                self._f.flush()
+                os.fsync(self._f.fileno())
+                self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def jsonl_to_csv(jsonl_path: str, csv_path: str, encoding: str = "utf-8-sig",
+                 id_field: Optional[str] = None, order_field: Optional[str] = None) -> int:
+    """
+    Stream a JSONL file into CSV. Returns the number of rows written.
+
+    id_field:    keep only the last line of every id (a resumed retry replaces the failed row)
+    order_field: write rows sorted by this field (e.g. the input row number) instead of
+                 completion order; the field itself is not written. Lines without it
+                 go last, in file order.
+    Pass 1 keeps one (sort key, byte offset) pair per row, not the rows themselves.
+    """
+    # Pass 1: column union in first-seen order + where every row starts
+    fieldnames: List[str] = []
+    seen = set()
+    rows: Dict[Any, Tuple[Tuple[int, float, int], int]] = {}
+    offset = 0
+    with open(jsonl_path, "rb") as f:
+        for line_no, line in enumerate(f):
+            start, offset = offset, offset + len(line)
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if not isinstance(record, dict):
+                continue
+            for k in record:
+                if k not in seen and k != order_field:
+                    seen.add(k)
+                    fieldnames.append(k)
+            order = record.get(order_field) if order_field else None
+            key = (0, float(order), line_no) if isinstance(order, (int, float)) else (1, 0.0, line_no)
+            row_key = str(record[id_field]) if id_field and id_field in record else ("#line", line_no)
+            rows[row_key] = (key, start)
+    offsets = [start for _, start in sorted(rows.values())]
+
+    # Pass 2: write rows
+    n = 0
+    with open(jsonl_path, "rb") as f_in, open(csv_path, "w", encoding=encoding, newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction="ignore")
+        writer.writeheader()
+        for start in offsets:
+            f_in.seek(start)
+            record = json.loads(f_in.readline())
+            # NaN -> empty cell, matching DataFrame.to_csv
+            writer.writerow({k: ("" if isinstance(v, float) and v != v else v) for k, v in record.items()})
+            n += 1
+    return n
+
+
+# Write buffer of DatasetWriter (bytes, before compression)
+WRITE_BUFFER_SIZE = 1 << 20
+COMPRESSION_SUFFIX = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+
+class DatasetWriter:
+    """
+    Buffered JSONL dataset writer.
+
+    - one file handle per shard, written through a `buffer_size` buffer instead
+      of opening the file for every record;
+    - compression: None, "gzip" or "zstd" (needs the `zstandard` package);
+    - shard_size: start a new file every `shard_size` records
+      (out-00000.jsonl, out-00001.jsonl, ...); None writes a single file at `path`;
+    - every shard is written as "<name>.tmp" and renamed into place only when it
+      is complete; shards of an earlier, larger build past the new count are
+      deleted; on an exception inside `with`, temp files are removed and the
+      previous output is left untouched. close() is idempotent.
+
+    Usage:
+        with DatasetWriter("train.jsonl", compression="gzip", shard_size=100000) as w:
+            w.write({"conversations": [...]})
+        print(w.paths)
+    """
+
+    def __init__(self, path: str, compression: Optional[str] = None,
+                 shard_size: Optional[int] = None, buffer_size: int = WRITE_BUFFER_SIZE):
+        if compression not in COMPRESSION_SUFFIX:
+            raise ValueError(f"Unknown compression {compression}")
+        if shard_size is not None and shard_size <= 0:
+            raise ValueError("shard_size must be positive")
+        self.path = path
+        self.compression = compression
+        self.shard_size = shard_size
+        self.buffer_size = buffer_size
+        self._zstd = None
+        if compression == "zstd":
+            import zstandard
+            self._zstd = zstandard.ZstdCompressor(level=3)
+        self.written = 0
+        self.paths: List[str] = []       # finished shards, in order
+        self._pending: List[str] = []    # shards written to temp files, renamed on close
+        self._f = None
+        self._raw = None
+        self._in_shard = 0
+        self._closed = False
+
+    def _shard_path(self, index: int) -> str:
+        suffix = COMPRESSION_SUFFIX[self.compression]
+        base = self.path
+        if base.endswith(suffix):
+            base = base[:len(base) - len(suffix)]
+        if self.shard_size is not None:
+            stem, ext = os.path.splitext(base)
+            base = f"{stem}-{index:05d}{ext}"
+        return base + suffix
+
+    def _open_shard(self) -> None:
+        final = self._shard_path(len(self._pending))
+        tmp = final + ".tmp"
+        os.makedirs(os.path.dirname(os.path.abspath(final)), exist_ok=True)
+        self._raw = open(tmp, "wb", buffering=self.buffer_size)
+        if self.compression == "gzip":
+            stream = gzip.GzipFile(filename="", mode="wb", fileobj=self._raw, compresslevel=6, mtime=0)
+        elif self.compression == "zstd":
+            stream = self._zstd.stream_writer(self._raw, closefd=False)
+        else:
+            stream = self._raw
+        self._f = stream if stream is self._raw else io.BufferedWriter(stream, buffer_size=self.buffer_size)
+        self._pending.append(final)
+        self._in_shard = 0
+
+    def _close_shard(self) -> None:
+        if self._f is None:
+            return
+        self._f.flush()
+        if self._f is not self._raw:
+            # Finalizes the compressed stream; the raw handle stays open
+            self._f.close()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self._raw.close()
+        self._f = None
+        self._raw = None
+
+    def write(self, record: Dict[str, Any]) -> None:
+        self.write_line((json.dumps(record, ensure_ascii=False, default=_json_default) + "\n").encode("utf-8"))
+
+    def write_line(self, line: bytes) -> None:
+        """
+        Write one already-serialized record (UTF-8 JSON ending with a newline).
+        """
+        if self._f is None or (self.shard_size is not None and self._in_shard >= self.shard_size):
+            self._close_shard()
+            self._open_shard()
+        self._f.write(line)
+        self._in_shard += 1
+        self.written += 1
+
+    def _stale_shards(self) -> List[str]:
+        """
+        Shard files at this path from an earlier build that had more shards.
+        """
+        if self.shard_size is None:
+            return []
+        first = self._shard_path(0)
+        folder, name = os.path.split(os.path.abspath(first))
+        stem, rest = name.split("-00000", 1)
+        pattern = re.compile(re.escape(stem) + r"-(\d{5})" + re.escape(rest) + "$")
+        stale = []
+        for entry in os.listdir(folder):
+            m = pattern.match(entry)
+            if m and int(m.group(1)) >= len(self.paths):
+                stale.append(os.path.join(folder, entry))
+        return sorted(stale)
+
+    def close(self) -> None:
+        """
+        Finish the current shard, rename all shards into place and delete shards
+        of an earlier build past the new count. Calling it again does nothing.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._f is None and not self._pending:
+            # Nothing written: still produce an (empty) output file
+            self._open_shard()
+        self._close_shard()
+        for final in self._pending:
+            os.replace(final + ".tmp", final)
+            self.paths.append(final)
+        self._pending = []
+        for stale in self._stale_shards():
+            os.remove(stale)
+
+    def abort(self) -> None:
+        """
+        Drop everything written so far; existing files at the target paths are kept.
+        """
+        self._closed = True
+        try:
+            self._close_shard()
+        finally:
+            for final in self._pending:
+                if os.path.exists(final + ".tmp"):
+                    os.remove(final + ".tmp")
+            self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
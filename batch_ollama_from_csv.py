@@ -2,23 +2,63 @@
 # -*- coding: utf-8 -*-
 
 import json
-import time
+import os
 import sys
-import requests
 import pandas as pd
-from typing import Dict, Any
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, Any, Optional, Tuple, Union
+
+from ollama_client import (ClientPolicy, EndpointPool, configure_pool, post_json,
+                           print_connection_stats, stream_chat)
+from response_cache import ResponseCache, cache_key
+from batch_io import CheckpointWriter, iter_csv_rows, jsonl_to_csv, read_csv_columns
 
 # ======== FIXED CONFIG ========
 MODEL = "qwen3-8b-5k-quant-8-2:latest"
 URL = "http://157.10.188.151:11434/v1/chat/completions"
+# All servers that serve MODEL; requests are balanced across them
+URLS = [URL]
+BALANCE_STRATEGY = "least_outstanding"     # or "latency"
+HEALTH_CHECK_INTERVAL = 10.0               # seconds between probes of ejected servers
 TEMPERATURE_LEAD = 0.5
 TEMPERATURE_TITLE = 0.7
 TOP_P = 0.9
 MAX_TOKENS = 4096
-# Backoff between requests (seconds) in case the endpoint needs pacing
-SLEEP_BETWEEN_CALLS = 0.2
+# Pacing / resilience (replaces the old fixed sleep between calls):
+RATE_PER_SEC = 10.0                        # token-bucket rate limit shared by all workers
+RATE_BURST = 20
+MAX_RETRIES = 4                            # jittered exponential backoff on 429/5xx/timeouts
+TARGET_LATENCY = 60.0                      # slower responses shrink the adaptive concurrency limit
+# Opt-in SSE streaming: records time-to-first-token, tokens/sec and latency per call
+# and stops a runaway title once it passes TITLE_MAX_WORDS (the prompt asks for < 15)
+STREAM = False
+TITLE_MAX_WORDS = 30
+# Prompt layout:
+#   "classic"       - [STYLE][TASK] system prompt per task, content inside each user prompt
+#   "shared_prefix" - style-only system prompt, CONTENT first in the user turn and the task
+#                     instructions after it, so the lead and title requests share the whole
+#                     article as a common prefix and the server's KV prefix cache can reuse it.
+#                     Opt-in: it differs from the layout the model was fine-tuned on.
+PROMPT_LAYOUT = "classic"
+# Number of articles generated concurrently (1 = fully serial, as before).
+# The lead -> title dependency is kept inside each article.
+CONCURRENCY = 4
+# Sampling seed sent to the server (None = server default); part of the cache key
+SEED = None
+# On-disk response cache: identical (model, prompts, sampling params, seed) reuse the stored response
+USE_RESPONSE_CACHE = True                  # set False to bypass the cache entirely
+RESPONSE_CACHE_PATH = "./.response_cache.sqlite"
+RESPONSE_CACHE_MAX_BYTES = 2 * 1024 ** 3   # LRU eviction above this size
+RESPONSE_CACHE_MAX_AGE_DAYS = 30           # drop entries older than this
 INPUT_CSV = "./test_articles.csv"          # change if needed
 OUTPUT_CSV = "./test_articles_outputs_lead_0.5_title_0.7.csv" # change if needed
+# Append-only checkpoint: each finished row is written here immediately, and rows
+# whose id is already present are skipped on restart. OUTPUT_CSV is built from it.
+OUTPUT_JSONL = OUTPUT_CSV.replace(".csv", ".jsonl")
+ROW_ID_COLUMN = "id"                       # falls back to the row index if missing
+ROW_ORDER_FIELD = "_row"                   # checkpoint-only field: input row number
+# Input is streamed in chunks of this many rows instead of loaded whole
+CHUNK_SIZE = 256
 # ==============================
 
 
@@ -63,8 +103,76 @@ def build_user_prompt_for_title(lead: str, content: str) -> str:
     )
 
 
-def post_chat(url: str, model: str, system_prompt: str, user_prompt: str,
-              temperature: float, top_p: float, max_tokens: int) -> Dict[str, Any]:
+def build_shared_system_prompt(style: str) -> str:
+    return (
+        f"[STYLE={style}]\n"
+        "Bạn là tổng biên tập báo chí dày dạn kinh nghiệm.\n"
+    )
+
+
+def build_shared_user_prompt(task: str, content: str, lead: str = "") -> str:
+    # CONTENT goes first so everything up to the end of the article is identical
+    # for both tasks; only the tail after it differs.
+    head = f"CONTENT:\n{content}\n\n"
+    if task == "title":
+        return head + (
+            f"[TASK={task}]\n"
+            f"LEAD:\n{lead}\n\n"
+            "Nhiệm vụ của bạn là viết một tiêu đề ngắn gọn, hấp dẫn, đúng phong cách báo chí chuyên nghiệp "
+            "và dễ hiểu với độc giả đại chúng, dựa trên phần *lead* và *content* được cung cấp.\n"
+            "Title cần:\n"
+            "- Chỉ in ra tiêu đề, KHÔNG kèm giải thích.\n"
+            "- Ngắn gọn dưới 15 từ, dễ hiểu, rõ ràng.\n"
+            "- Không sử dụng '?', '!', ';', '\"'\n\n"
+            "Hãy viết MỘT tiêu đề duy nhất dựa trên LEAD và CONTENT ở trên.\n"
+        )
+    return head + (
+        f"[TASK={task}]\n"
+        "Nhiệm vụ của bạn là viết một đoạn *lead* ngắn gọn, súc tích và hấp dẫn dựa trên phần *content* "
+        "được cung cấp.\n"
+        "Lead cần:\n"
+        "- Tóm tắt ý chính quan trọng nhất của bài viết.\n"
+        "- Gây tò mò, thu hút độc giả tiếp tục đọc.\n"
+        "- Viết theo phong cách báo chí chuyên nghiệp, dễ hiểu với độc giả đại chúng.\n"
+        "- Độ dài khoảng từ 1 đến 3 câu.\n\n"
+        "Tạo LEAD với độ dài từ 1 đến 3 câu cho bài viết dựa trên CONTENT ở trên.\n"
+    )
+
+
+def build_prompts(task: str, style: str, content: str, lead: str = "",
+                  layout: str = PROMPT_LAYOUT) -> Tuple[str, str]:
+    """
+    (system_prompt, user_prompt) for one request in the chosen layout.
+    """
+    if layout == "shared_prefix":
+        return build_shared_system_prompt(style), build_shared_user_prompt(task, content, lead)
+    if layout != "classic":
+        raise ValueError(f"Unknown prompt layout {layout}")
+    if task == "title":
+        return build_system_prompt(task="title", style=style), build_user_prompt_for_title(lead=lead, content=content)
+    return build_system_prompt(task="lead", style=style), build_user_prompt_for_lead(content=content)
+
+
+def shared_prefix_chars(a: Tuple[str, str], b: Tuple[str, str]) -> int:
+    """
+    Length of the common prefix of two (system, user) prompt pairs as the
+    server sees them (system message first, then user message).
+    """
+    return len(os.path.commonprefix([a[0] + "\n" + a[1], b[0] + "\n" + b[1]]))
+
+
+def post_chat(url: Union[str, EndpointPool], model: str, system_prompt: str, user_prompt: str,
+              temperature: float, top_p: float, max_tokens: int,
+              seed: Optional[int] = None, cache: Optional[ResponseCache] = None,
+              policy: Optional[ClientPolicy] = None, stream: bool = False,
+              max_words: Optional[int] = None) -> Dict[str, Any]:
+    key = None
+    if cache is not None:
+        key = cache_key(model, system_prompt, user_prompt, temperature, top_p, max_tokens, seed)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
     payload = {
         "model": model,
         "messages": [
@@ -75,10 +183,17 @@ def post_chat(url: str, model: str, system_prompt: str, user_prompt: str,
         "top_p": top_p,
         "max_tokens": max_tokens,
     }
-    headers = {"Content-Type": "application/json"}
-    resp = requests.post(url, headers=headers, json=payload, timeout=120)
-    resp.raise_for_status()
-    return resp.json()
+    if seed is not None:
+        payload["seed"] = seed
+    if stream:
+        resp_json = stream_chat(url, payload, timeout=120, policy=policy, max_words=max_words)
+    else:
+        resp_json = post_json(url, payload, timeout=120, policy=policy)
+    # A capped (truncated) generation is not a faithful answer for this key;
+    # timing metrics belong to this call only, so they are not cached
+    if cache is not None and not resp_json.get("metrics", {}).get("early_stop"):
+        cache.put(key, {k: v for k, v in resp_json.items() if k != "metrics"})
+    return resp_json
 
 
 def extract_text(resp_json: Dict[str, Any]) -> str:
@@ -89,10 +204,86 @@ def extract_text(resp_json: Dict[str, Any]) -> str:
         return json.dumps(resp_json, ensure_ascii=False)
 
 
-def main():
-    # Load input CSV
+def _metric_columns(task: str, resp_json: Dict[str, Any]) -> Dict[str, Any]:
+    cols: Dict[str, Any] = {}
+    usage = resp_json.get("usage") or {}
+    if usage.get("prompt_tokens") is not None:
+        cols[f"{task}_prompt_tokens"] = usage["prompt_tokens"]
+    m = resp_json.get("metrics")
+    if not m:
+        return cols
+    return {
+        **cols,
+        f"{task}_ttft_s": m["ttft_s"],
+        f"{task}_tokens_per_s": m["tokens_per_s"],
+        f"{task}_latency_s": m["latency_s"],
+        f"{task}_early_stop": m["early_stop"],
+    }
+
+
+def generate_row(row: pd.Series, cache: Optional[ResponseCache] = None,
+                 policy: Optional[ClientPolicy] = None, stream: bool = STREAM,
+                 url: Union[str, EndpointPool] = URL, layout: str = PROMPT_LAYOUT) -> Dict[str, Any]:
+    """
+    Generate LEAD then TITLE for one article. The title call waits for the lead.
+    Prompt token counts (and, in streaming mode, timing metrics) are added as
+    lead_* / title_* columns, plus the characters both prompts share as a prefix.
+    `url` is a single endpoint or an EndpointPool.
+    """
+    metrics: Dict[str, Any] = {}
+    failed = False
+    style = str(row["type"]) if not pd.isna(row["type"]) else "đời sống"
+    content = str(row["content"]) if not pd.isna(row["content"]) else ""
+
+    # 1) Ask for LEAD
+    sp_lead, up_lead = build_prompts("lead", style, content, layout=layout)
+
+    try:
+        resp_lead = post_chat(url, MODEL, sp_lead, up_lead, TEMPERATURE_LEAD, TOP_P, MAX_TOKENS,
+                              seed=SEED, cache=cache, policy=policy, stream=stream)
+        output_lead = extract_text(resp_lead).strip()
+        metrics.update(_metric_columns("lead", resp_lead))
+    except Exception as e:
+        output_lead = f"[ERROR generating lead: {e}]"
+        failed = True
+
+    # 2) Ask for TITLE using the generated lead + content
+    sp_title, up_title = build_prompts("title", style, content, lead=output_lead, layout=layout)
+    metrics["prompt_shared_prefix_chars"] = shared_prefix_chars((sp_lead, up_lead), (sp_title, up_title))
+
+    try:
+        resp_title = post_chat(url, MODEL, sp_title, up_title, TEMPERATURE_TITLE, TOP_P, MAX_TOKENS,
+                               seed=SEED, cache=cache, policy=policy, stream=stream,
+                               max_words=TITLE_MAX_WORDS)
+        output_title = extract_text(resp_title).strip()
+        metrics.update(_metric_columns("title", resp_title))
+    except Exception as e:
+        output_title = f"[ERROR generating title: {e}]"
+        failed = True
+
+    return {
+        **row.to_dict(),
+        "output_lead": output_lead,
+        "output_title": output_title,
+        **metrics,
+        # Checkpointed but not counted as done: a resumed run retries the row
+        "error": failed,
+    }
+
+
+def _report(done, n_done: int) -> int:
+    # Optional: progress log
+    for i, fut in enumerate(done, start=n_done + 1):
+        result = fut.result()
+        output_title = result["output_title"]
+        print(f"[{i}] style={result['type']} | lead_len={len(result['output_lead'])} | title='{output_title[:60]}{'...' if len(output_title)>60 else ''}'")
+    return len(done)
+
+
+def main(concurrency: int = CONCURRENCY, use_cache: bool = USE_RESPONSE_CACHE, stream: bool = STREAM):
+    # Read only the header up front; rows are streamed chunk by chunk below
     try:
-        df = pd.read_csv(INPUT_CSV)
+        columns = read_csv_columns(INPUT_CSV)
     except Exception as e:
         print(f"❌ Could not read input CSV at {INPUT_CSV}: {e}", file=sys.stderr)
         sys.exit(1)
@@ -101,56 +292,68 @@ def main():
     # Optional: 'lead' or 'title' exist but we will ignore them and regenerate
     required_cols = ["type", "content"]
     for col in required_cols:
-        if col not in df.columns:
+        if col not in columns:
             print(f"❌ Missing required column '{col}' in input CSV.", file=sys.stderr)
             sys.exit(1)
 
-    outputs = []
-
-    for idx, row in df.iterrows():
-        style = str(row["type"]) if not pd.isna(row["type"]) else "đời sống"
-        content = str(row["content"]) if not pd.isna(row["content"]) else ""
-
-        # 1) Ask for LEAD
-        sp_lead = build_system_prompt(task="lead", style=style)
-        up_lead = build_user_prompt_for_lead(content=content)
-
-        try:
-            resp_lead = post_chat(URL, MODEL, sp_lead, up_lead, TEMPERATURE_LEAD, TOP_P, MAX_TOKENS)
-            output_lead = extract_text(resp_lead).strip()
-        except Exception as e:
-            output_lead = f"[ERROR generating lead: {e}]"
-
-        time.sleep(SLEEP_BETWEEN_CALLS)
-
-        # 2) Ask for TITLE using the generated lead + content
-        sp_title = build_system_prompt(task="title", style=style)
-        up_title = build_user_prompt_for_title(lead=output_lead, content=content)
+    # One keep-alive connection per worker thread (per server)
+    configure_pool(pool_connections=max(4, len(URLS)), pool_maxsize=max(1, concurrency))
+    endpoints = EndpointPool(URLS, strategy=BALANCE_STRATEGY)
+    endpoints.start_health_checks(interval=HEALTH_CHECK_INTERVAL)
 
-        try:
-            resp_title = post_chat(URL, MODEL, sp_title, up_title, TEMPERATURE_TITLE, TOP_P, MAX_TOKENS)
-            output_title = extract_text(resp_title).strip()
-        except Exception as e:
-            output_title = f"[ERROR generating title: {e}]"
+    policy = ClientPolicy(rate=RATE_PER_SEC, burst=RATE_BURST, max_retries=MAX_RETRIES,
+                          max_concurrency=max(1, concurrency), target_latency=TARGET_LATENCY)
+    cache = ResponseCache(RESPONSE_CACHE_PATH, max_bytes=RESPONSE_CACHE_MAX_BYTES,
+                          max_age_days=RESPONSE_CACHE_MAX_AGE_DAYS, enabled=use_cache)
+    ckpt = CheckpointWriter(OUTPUT_JSONL, id_field=ROW_ID_COLUMN)
+    if ckpt.completed_ids:
+        print(f"↩️ Resuming: {len(ckpt.completed_ids)} rows already in {OUTPUT_JSONL}")
 
-        outputs.append({
-            **row.to_dict(),
-            "output_lead": output_lead,
-            "output_title": output_title,
-        })
+    failed_ids = []
 
-        # Optional: progress log
-        print(f"[{idx+1}/{len(df)}] style={style} | lead_len={len(output_lead)} | title='{output_title[:60]}{'...' if len(output_title)>60 else ''}'")
+    def run(row: pd.Series) -> Dict[str, Any]:
+        result = generate_row(row, cache if use_cache else None, policy, stream, endpoints, PROMPT_LAYOUT)
+        ckpt.write(result)
+        if result["error"]:
+            failed_ids.append(result[ROW_ID_COLUMN])
+        return result
 
-        time.sleep(SLEEP_BETWEEN_CALLS)
+    # Articles overlap across workers; at most 2x concurrency rows are in flight
+    # (plus one input chunk in memory), and each row is persisted as soon as it finishes
+    max_in_flight = 2 * max(1, concurrency)
+    n_done = 0
+    with cache, ckpt, ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        pending = set()
+        for idx, row in iter_csv_rows(INPUT_CSV, chunksize=CHUNK_SIZE):
+            row_id = row[ROW_ID_COLUMN] if ROW_ID_COLUMN in columns else idx
+            if ckpt.is_done(row_id):
+                continue
+            if ROW_ID_COLUMN not in columns:
+                row[ROW_ID_COLUMN] = row_id
+            # Input position, used to restore input order in the final CSV
+            row[ROW_ORDER_FIELD] = idx
+            if len(pending) >= max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                n_done += _report(done, n_done)
+            pending.add(executor.submit(run, row))
+        done, _ = wait(pending)
+        n_done += _report(done, n_done)
 
-    # Build result DataFrame
-    out_df = pd.DataFrame(outputs)
+    endpoints.stop_health_checks()
 
-    # Save to CSV
-    out_df.to_csv(OUTPUT_CSV, index=False, encoding="utf-8-sig")
-    print(f"✅ Saved outputs to: {OUTPUT_CSV}")
-    return out_df
+    # Build the final CSV from the checkpoint (streamed, back in input order;
+    # a row retried after an error keeps only its latest result)
+    n_rows = jsonl_to_csv(OUTPUT_JSONL, OUTPUT_CSV, id_field=ROW_ID_COLUMN, order_field=ROW_ORDER_FIELD)
+    print(f"✅ Saved {n_rows} outputs to: {OUTPUT_CSV}")
+    if failed_ids:
+        print(f"⚠️ {len(failed_ids)} rows failed and were not marked done; re-run to retry them")
+    print_connection_stats()
+    endpoints.print_stats()
+    print(f"🔁 Retries: {policy.retries} | adaptive concurrency limit: {int(policy.limiter.limit)}")
+    if use_cache:
+        print(f"🗄️ Response cache: {cache.hits} hits, {cache.misses} misses ({RESPONSE_CACHE_PATH})")
+    # Same return value as before streaming: the output table (read back from the final CSV)
+    return pd.read_csv(OUTPUT_CSV, encoding="utf-8-sig")
 
 
 if __name__ == "__main__":
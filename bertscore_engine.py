@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Per-row BERTScore with one encoder load and an on-disk reference embedding cache.
+
+`bert_score.score()` reloads the model on every call and evaluate_titles_leads.py
+only kept the corpus mean. BertScoreEngine instead:
+- loads the encoder once (via bert_score.BERTScorer) and reuses it for titles and leads;
+- encodes each distinct sentence once, sorted by length so batches carry little padding;
+- caches reference-side token embeddings on disk, keyed by model, layer and text, so
+  scoring new outputs against the same test set only encodes the hypotheses;
+- returns per-row P / R / F1 with bert_score's greedy matching, special-token
+  weighting and baseline rescaling. An empty (or whitespace-only) reference or
+  hypothesis scores a raw 0 on P, R and F1, as bert_score's zero-mask rule does;
+  it is never sent to the encoder.
+
+Usage:
+    engine = BertScoreEngine(lang="vi", rescale_with_baseline=True, cache_dir=".bertscore_cache")
+    P, R, F1 = engine.score(refs, hyps)
+"""
+
+import hashlib
+import os
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Rows scored per block; bounds how many embeddings are held in memory at once
+BLOCK_SIZE = 2048
+
+
+def _is_empty(text: str) -> bool:
+    # bert_score strips before encoding, so whitespace-only text is [CLS] [SEP] only
+    return not text.strip()
+
+
+class BertScoreEngine:
+    def __init__(self, lang: str = "en", model_type: Optional[str] = None,
+                 num_layers: Optional[int] = None, rescale_with_baseline: bool = True,
+                 device: Optional[str] = None, batch_size: int = 64,
+                 cache_dir: Optional[str] = ".bertscore_cache", baseline_path: Optional[str] = None):
+        import torch
+        from bert_score import BERTScorer
+
+        if device is None:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.device = device
+        self.batch_size = batch_size
+        self.rescale_with_baseline = rescale_with_baseline
+        self.scorer = BERTScorer(
+            model_type=model_type, num_layers=num_layers, lang=lang,
+            rescale_with_baseline=rescale_with_baseline, baseline_path=baseline_path,
+            device=device, batch_size=batch_size,
+        )
+        self.model = self.scorer._model
+        self.tokenizer = self.scorer._tokenizer
+        # Same weighting as bert_score with idf=False: 1 per token, 0 for [CLS] / [SEP]
+        self.idf_dict = defaultdict(lambda: 1.0)
+        self.idf_dict[self.tokenizer.sep_token_id] = 0
+        self.idf_dict[self.tokenizer.cls_token_id] = 0
+
+        self.cache_dir = None
+        if cache_dir:
+            key = f"{self.scorer.model_type}_L{self.scorer.num_layers}".replace("/", "__")
+            self.cache_dir = os.path.join(cache_dir, key)
+            os.makedirs(self.cache_dir, exist_ok=True)
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    # ---- encoding ----
+    def _encode(self, texts: Sequence[str]) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """
+        Encode distinct texts, longest first, into {text: (unit-norm token embeddings, weights)}.
+        Empty texts map to zero-length arrays without a model call.
+        """
+        from bert_score.utils import get_bert_embedding
+
+        out: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        for text in set(texts):
+            if _is_empty(text):
+                out[text] = (np.zeros((0, 0), dtype=np.float32), np.zeros(0, dtype=np.float32))
+        # Length-sorted (as bert_score does) so each batch pads to a similar length
+        uniq = sorted((t for t in set(texts) if t not in out), key=lambda t: len(t.split(" ")), reverse=True)
+        for i in range(0, len(uniq), self.batch_size):
+            batch = uniq[i:i + self.batch_size]
+            emb, mask, idf = get_bert_embedding(
+                batch, self.model, self.tokenizer, self.idf_dict,
+                batch_size=len(batch), device=self.device,
+            )
+            emb = emb.float().cpu().numpy()
+            mask = mask.cpu().numpy().astype(bool)
+            idf = idf.float().cpu().numpy()
+            for j, text in enumerate(batch):
+                e = emb[j][mask[j]]
+                e = e / np.maximum(np.linalg.norm(e, axis=-1, keepdims=True), 1e-12)
+                out[text] = (e.astype(np.float32), idf[j][mask[j]].astype(np.float32))
+        return out
+
+    def _cache_path(self, text: str) -> str:
+        h = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, h[:2], h + ".npz")
+
+    def _encode_cached(self, texts: Sequence[str]) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        if self.cache_dir is None:
+            return self._encode(texts)
+        out: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        missing: List[str] = []
+        for text in set(texts):
+            if _is_empty(text):
+                missing.append(text)
+                continue
+            path = self._cache_path(text)
+            if os.path.exists(path):
+                with np.load(path) as z:
+                    out[text] = (z["emb"], z["idf"])
+                self.cache_hits += 1
+            else:
+                missing.append(text)
+        self.cache_misses += sum(1 for t in missing if not _is_empty(t))
+        if missing:
+            fresh = self._encode(missing)
+            for text, (e, w) in fresh.items():
+                if _is_empty(text):
+                    continue
+                path = self._cache_path(text)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp = path + ".tmp.npz"
+                np.savez(tmp, emb=e, idf=w)
+                os.replace(tmp, path)
+            out.update(fresh)
+        return out
+
+    # ---- scoring ----
+    @staticmethod
+    def _greedy(ref: Tuple[np.ndarray, np.ndarray], hyp: Tuple[np.ndarray, np.ndarray]) -> Tuple[float, float, float]:
+        ref_e, ref_w = ref
+        hyp_e, hyp_w = hyp
+        # Empty, or only [CLS] + [SEP] left: bert_score's zero mask scores such pairs as 0
+        if len(ref_e) <= 2 or len(hyp_e) <= 2 or ref_w.sum() == 0 or hyp_w.sum() == 0:
+            return 0.0, 0.0, 0.0
+        sim = hyp_e @ ref_e.T
+        p = float((sim.max(axis=1) * hyp_w).sum() / hyp_w.sum())
+        r = float((sim.max(axis=0) * ref_w).sum() / ref_w.sum())
+        f = 2 * p * r / (p + r) if p + r != 0 else 0.0
+        return p, r, f
+
+    def score(self, refs: Sequence[str], hyps: Sequence[str],
+              cache_refs: bool = True) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Per-row (P, R, F1) arrays. References go through the disk cache
+        (if enabled); hypotheses are always encoded fresh.
+        """
+        if len(refs) != len(hyps):
+            raise ValueError(f"refs ({len(refs)}) and hyps ({len(hyps)}) differ in length")
+        n = len(refs)
+        P = np.zeros(n, dtype=np.float64)
+        R = np.zeros(n, dtype=np.float64)
+        F = np.zeros(n, dtype=np.float64)
+        for start in range(0, n, BLOCK_SIZE):
+            block_refs = refs[start:start + BLOCK_SIZE]
+            block_hyps = hyps[start:start + BLOCK_SIZE]
+            ref_emb = self._encode_cached(block_refs) if cache_refs else self._encode(block_refs)
+            hyp_emb = self._encode(block_hyps)
+            for k, (ref, hyp) in enumerate(zip(block_refs, block_hyps)):
+                P[start + k], R[start + k], F[start + k] = self._greedy(ref_emb[ref], hyp_emb[hyp])
+
+        if self.rescale_with_baseline:
+            base = np.asarray(self.scorer.baseline_vals.cpu().numpy(), dtype=np.float64)
+            P = (P - base[0]) / (1 - base[0])
+            R = (R - base[1]) / (1 - base[1])
+            F = (F - base[2]) / (1 - base[2])
+        return P, R, F
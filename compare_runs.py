@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Compare several evaluation runs (metrics_report_*.csv) in one pass.
+
+Runs are aligned by article `id` (only ids present in every run are kept), then for
+every run and metric we report the mean, the paired difference to a baseline run with
+a bootstrap confidence interval and p-value (bootstrap distribution centred on the
+null), the same per style (`type`), and a leaderboard. Runs are named after their
+file; reports with the same file name get their parent directories prepended.
+
+The bootstrap is vectorized: resamples are drawn as a (B x n) count matrix shared by
+every run and metric of a group (paired resampling), and all bootstrap means come from
+one matrix product per block of resamples.
+
+Usage:
+  python compare_runs.py evaluate_score/metrics_report_*.csv \
+      --baseline evaluate_score/metrics_report_0.5.csv --bootstrap 5000 --out comparison.csv
+"""
+
+import argparse
+import os
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+METRICS = [
+    "title_rouge2_f1", "title_rougeL_f1", "title_bertscore_f1",
+    "lead_rouge2_f1", "lead_rougeL_f1", "lead_bertscore_f1",
+]
+# Resamples per matrix product; bounds the (block x n) weight matrix
+BOOTSTRAP_BLOCK = 500
+
+
+def run_name(path: str) -> str:
+    name = os.path.splitext(os.path.basename(path))[0]
+    return name[len("metrics_report_"):] if name.startswith("metrics_report_") else name
+
+
+def run_names(paths: List[str]) -> List[str]:
+    """
+    run_name of every path, prefixed with as many parent directories as needed
+    to tell runs with the same file name apart (then numbered if still equal).
+    """
+    parts = [os.path.normpath(os.path.abspath(p)).split(os.sep)[:-1] for p in paths]
+    names = [run_name(p) for p in paths]
+    depth = 0
+    while len(set(names)) < len(names) and depth < max(len(x) for x in parts):
+        depth += 1
+        clash = {n for n in names if names.count(n) > 1}
+        names = [("/".join(x[-depth:] + [run_name(p)]) if n in clash else n)
+                 for n, x, p in zip(names, parts, paths)]
+    seen: Dict[str, int] = {}
+    out = []
+    for n in names:
+        seen[n] = seen.get(n, 0) + 1
+        out.append(n if seen[n] == 1 else f"{n}#{seen[n]}")
+    return out
+
+
+def load_runs(paths: List[str], id_col: str = "id") -> Tuple[List[str], np.ndarray, pd.Series, List[str]]:
+    """
+    Load and align runs by id.
+    Returns (run names, values array [runs, metrics, n], per-row `type`, metric names).
+    """
+    frames = []
+    for p in paths:
+        df = pd.read_csv(p)
+        if id_col not in df.columns:
+            raise ValueError(f"{p}: missing id column '{id_col}'")
+        frames.append(df.drop_duplicates(subset=id_col).set_index(id_col))
+    metrics = [m for m in METRICS if all(m in f.columns for f in frames)]
+    if not metrics:
+        raise ValueError("No metric column is shared by all runs")
+    common = frames[0].index
+    for f in frames[1:]:
+        common = common.intersection(f.index)
+    common = common.sort_values()
+    values = np.stack([f.loc[common, metrics].to_numpy(dtype=np.float64).T for f in frames])
+    types = frames[0].loc[common, "type"] if "type" in frames[0].columns else pd.Series("all", index=common)
+    return run_names(paths), values, types.astype(str).reset_index(drop=True), metrics
+
+
+def bootstrap_means(x: np.ndarray, n_boot: int, seed: int = 0) -> np.ndarray:
+    """
+    Bootstrap means of every row of `x` [k, n] with shared (paired) resamples.
+    Returns [k, n_boot].
+    """
+    k, n = x.shape
+    rng = np.random.default_rng(seed)
+    out = np.empty((k, n_boot), dtype=np.float64)
+    for start in range(0, n_boot, BOOTSTRAP_BLOCK):
+        b = min(BOOTSTRAP_BLOCK, n_boot - start)
+        # Per-resample counts of each row drawn (resampling n rows with replacement)
+        idx = rng.integers(0, n, size=(b, n)) + (np.arange(b) * n)[:, None]
+        weights = np.bincount(idx.ravel(), minlength=b * n).reshape(b, n).astype(np.float64)
+        out[:, start:start + b] = x @ weights.T / n
+    return out
+
+
+def compare(names: List[str], values: np.ndarray, metrics: List[str], baseline: int,
+            n_boot: int, alpha: float, seed: int, group: str = "all") -> pd.DataFrame:
+    """
+    Paired comparison of every run against `baseline` on rows of `values` [runs, metrics, n].
+    """
+    n_runs, n_metrics, n = values.shape
+    diffs = (values - values[baseline][None]).reshape(n_runs * n_metrics, n)
+    boot = bootstrap_means(diffs, n_boot, seed=seed)
+    lo, hi = np.percentile(boot, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=1)
+    # Two-sided p-value for "mean difference == 0": the bootstrap distribution is
+    # shifted to the null (centred on 0) and compared with the observed difference
+    observed = diffs.mean(axis=1)
+    extreme = (np.abs(boot - observed[:, None]) >= np.abs(observed)[:, None]).sum(axis=1)
+    p = (extreme + 1) / (n_boot + 1)
+    means = values.mean(axis=2)
+    rows = []
+    for r in range(n_runs):
+        for m in range(n_metrics):
+            i = r * n_metrics + m
+            is_base = r == baseline
+            rows.append({
+                "group": group,
+                "run": names[r],
+                "metric": metrics[m],
+                "n": n,
+                "mean": means[r, m],
+                "delta_vs_baseline": diffs[i].mean(),
+                "ci_low": 0.0 if is_base else lo[i],
+                "ci_high": 0.0 if is_base else hi[i],
+                "p_value": 1.0 if is_base else p[i],
+            })
+    return pd.DataFrame(rows)
+
+
+def leaderboard(report: pd.DataFrame, rank_by: str) -> pd.DataFrame:
+    table = report[report["group"] == "all"].pivot(index="run", columns="metric", values="mean")
+    table["mean_all"] = table.mean(axis=1)
+    key = "mean_all" if rank_by == "mean" else rank_by
+    return table.sort_values(key, ascending=False)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("reports", nargs="+", help="metrics_report_*.csv files (one per run)")
+    parser.add_argument("--baseline", default=None, help="Baseline report path (default: first report)")
+    parser.add_argument("--bootstrap", type=int, default=2000, help="Bootstrap resamples")
+    parser.add_argument("--alpha", type=float, default=0.05, help="1 - confidence level")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--id-col", default="id")
+    parser.add_argument("--rank-by", default="mean", help="Leaderboard key: 'mean' or a metric column")
+    parser.add_argument("--out", default="comparison_report.csv", help="Where to save the comparison table")
+    args = parser.parse_args()
+
+    paths = list(dict.fromkeys(args.reports))
+    if args.baseline is not None and args.baseline not in paths:
+        paths.insert(0, args.baseline)
+    baseline = paths.index(args.baseline) if args.baseline is not None else 0
+
+    names, values, types, metrics = load_runs(paths, id_col=args.id_col)
+    print(f"Aligned {values.shape[2]} articles across {len(names)} runs; baseline = {names[baseline]}")
+
+    reports = [compare(names, values, metrics, baseline, args.bootstrap, args.alpha, args.seed)]
+    for style in sorted(types.unique()):
+        mask = (types == style).to_numpy()
+        reports.append(compare(names, values[:, :, mask], metrics, baseline,
+                               args.bootstrap, args.alpha, args.seed, group=style))
+    report = pd.concat(reports, ignore_index=True)
+
+    print("\n=== Leaderboard ===")
+    print(leaderboard(report, args.rank_by).to_string(float_format=lambda v: f"{v:.4f}"))
+
+    print(f"\n=== Paired bootstrap vs {names[baseline]} ({int(100 * (1 - args.alpha))}% CI) ===")
+    shown = report[report["run"] != names[baseline]]
+    print(shown.to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+
+    report.to_csv(args.out, index=False)
+    print(f"\nSaved comparison table to: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
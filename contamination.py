@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Train/test contamination index.
+
+Built once over the training jsonl (ShareGPT "conversations" written by
+preprocess_data.py), then queried with test_articles.csv or any candidate set:
+- article content: MinHash/LSH over word shingles (near_dedup), flagged when the
+  estimated Jaccard with a training article is >= --threshold or the normalized
+  text is identical;
+- references: exact (normalized) match of the test title / lead with a training
+  assistant answer, so a leaked reference is caught even if the content differs.
+
+A query costs one MinHash signature plus a few bucket lookups (a few milliseconds
+per article).
+
+Usage:
+  python contamination.py --train train_data_16_10_2025.jsonl --test test_articles.csv \
+      --index .contamination_index.npz --out contamination_report.csv
+"""
+
+import argparse
+import json
+import os
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from near_dedup import MinHashLSH, content_hash
+
+# Lower than the dedup threshold: partial overlap with training data already matters here
+CONTAMINATION_THRESHOLD = 0.5
+# 32 bands x 4 rows: ~87% chance to surface a pair at Jaccard 0.5
+CONTAMINATION_BANDS = 32
+INDEX_PATH = "./.contamination_index.npz"
+
+
+def _iter_records(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                obj = json.loads(line)
+                # Some intermediate files hold double-encoded lines
+                if isinstance(obj, str):
+                    obj = json.loads(obj)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(obj, dict):
+                yield obj
+
+
+def split_sample(record: Dict[str, Any]) -> Tuple[str, str]:
+    """
+    (article content, assistant answer) of one training sample.
+    The content is the CONTENT: block of the user turn, or the whole user turn.
+    """
+    turns = record.get("conversations") or record.get("messages") or []
+    user = next((t.get("content", "") for t in turns if t.get("role") == "user"), "")
+    answer = next((t.get("content", "") for t in reversed(turns) if t.get("role") == "assistant"), "")
+    marker = "CONTENT:\n"
+    content = user[user.index(marker) + len(marker):] if marker in user else user
+    return content.strip(), answer.strip()
+
+
+class ContaminationIndex:
+    def __init__(self, threshold: float = CONTAMINATION_THRESHOLD, bands: int = CONTAMINATION_BANDS):
+        self.lsh = MinHashLSH(bands=bands, threshold=threshold)
+        self.answers: Dict[str, int] = {}    # normalized answer hash -> training line
+
+    def build(self, jsonl_path: str, workers: int = 0) -> "ContaminationIndex":
+        """
+        Index every distinct training article (title and lead samples share one content).
+        """
+        ids: List[str] = []
+        contents: List[str] = []
+        seen = set()
+        for line_no, record in enumerate(_iter_records(jsonl_path)):
+            content, answer = split_sample(record)
+            if answer:
+                self.answers.setdefault(content_hash(answer), line_no)
+            h = content_hash(content)
+            if content and h not in seen:
+                seen.add(h)
+                ids.append(str(line_no))
+                contents.append(content)
+        sigs = self.lsh.signatures(contents, workers=workers)
+        for doc_id, content, sig in zip(ids, contents, sigs):
+            self.lsh.add(doc_id, sig, content_hash(content))
+        return self
+
+    def query(self, contents: List[str], titles: Optional[List[str]] = None,
+              leads: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        One row per candidate: best matching training line, its similarity,
+        reference matches and the final `contaminated` flag.
+        """
+        sigs = self.lsh.signatures(contents, workers=1)
+        rows = []
+        for i, content in enumerate(contents):
+            match, sim = None, 0.0
+            pos = self.lsh.exact.get(content_hash(content)) if content.strip() else None
+            if pos is not None:
+                match, sim = self.lsh.ids[pos], 1.0
+            else:
+                hits = self.lsh.query(sigs[i])
+                if hits:
+                    match, sim = self.lsh.ids[hits[0][0]], hits[0][1]
+            title_hit = bool(titles) and bool(titles[i].strip()) and content_hash(titles[i]) in self.answers
+            lead_hit = bool(leads) and bool(leads[i].strip()) and content_hash(leads[i]) in self.answers
+            rows.append({
+                "contamination_sim": round(sim, 4),
+                "contamination_match": match,
+                "title_in_train": title_hit,
+                "lead_in_train": lead_hit,
+                "contaminated": match is not None or title_hit or lead_hit,
+            })
+        return pd.DataFrame(rows)
+
+    def query_frame(self, df: pd.DataFrame) -> pd.DataFrame:
+        def col(name):
+            return df[name].fillna("").astype(str).tolist() if name in df.columns else None
+        if "content" not in df.columns:
+            raise ValueError("Candidate set needs a 'content' column")
+        return self.query(col("content"), col("title"), col("lead"))
+
+    def save(self, path: str) -> None:
+        self.lsh.save(path)
+        items = sorted(self.answers.items(), key=lambda t: t[1])
+        tmp = path + ".answers.tmp.npz"
+        np.savez(tmp, keys=np.array([k for k, _ in items], dtype=str),
+                 lines=np.array([v for _, v in items], dtype=np.int64))
+        os.replace(tmp, path + ".answers.npz")
+
+    @classmethod
+    def load(cls, path: str) -> "ContaminationIndex":
+        index = cls()
+        index.lsh = MinHashLSH.load(path)
+        with np.load(path + ".answers.npz") as z:
+            index.answers = dict(zip(z["keys"].tolist(), z["lines"].tolist()))
+        return index
+
+
+def load_or_build(index_path: str, train_path: Optional[str] = None,
+                  threshold: float = CONTAMINATION_THRESHOLD) -> ContaminationIndex:
+    """
+    Load the index, (re)building it from `train_path` when missing or older than the training file.
+    """
+    fresh = os.path.exists(index_path) and os.path.exists(index_path + ".answers.npz")
+    if fresh and train_path and os.path.getmtime(train_path) > os.path.getmtime(index_path):
+        fresh = False
+    if fresh:
+        index = ContaminationIndex.load(index_path)
+        index.lsh.threshold = threshold
+        return index
+    if not train_path:
+        raise FileNotFoundError(f"No contamination index at {index_path} and no training jsonl to build it")
+    print(f"Building contamination index from {train_path} ...")
+    index = ContaminationIndex(threshold=threshold).build(train_path)
+    index.save(index_path)
+    print(f"Indexed {len(index.lsh)} training articles -> {index_path}")
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--train", default=None, help="Training jsonl (needed to build or refresh the index)")
+    parser.add_argument("--test", default="test_articles.csv", help="Candidate CSV with content (and title / lead)")
+    parser.add_argument("--index", default=INDEX_PATH, help="Where the index is stored")
+    parser.add_argument("--threshold", type=float, default=CONTAMINATION_THRESHOLD,
+                        help="Estimated Jaccard on content to flag a row")
+    parser.add_argument("--out", default="contamination_report.csv", help="Per-row report")
+    args = parser.parse_args()
+
+    index = load_or_build(args.index, args.train, threshold=args.threshold)
+    df = pd.read_csv(args.test)
+    t0 = time.perf_counter()
+    flags = index.query_frame(df)
+    dt = time.perf_counter() - t0
+
+    keep = [c for c in ("id", "type", "title") if c in df.columns]
+    report = pd.concat([df[keep].reset_index(drop=True), flags], axis=1)
+    report.to_csv(args.out, index=False)
+    n_bad = int(report["contaminated"].sum())
+    print(f"{n_bad}/{len(report)} candidate rows overlap the training data "
+          f"({1000 * dt / max(len(report), 1):.2f} ms/article)")
+    print(f"Saved contamination report to: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
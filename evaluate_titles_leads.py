@@ -14,6 +14,17 @@ Usage:
       --out /path/to/metrics.csv --lang en --lower --stem --rescale
 
 Notes:
+- ROUGE is computed column-wise by rouge_batch.batch_rouge (same numbers as rouge-score,
+  tokenized once per corpus, multi-process on large files). --rouge-tokenizer vi keeps
+  Vietnamese diacritics instead of rouge-score's ASCII-only tokens.
+- BERTScore is per row (bertscore_engine.BertScoreEngine): the encoder is loaded once for
+  titles and leads, and reference embeddings are cached under --bertscore-cache.
+- --incremental keeps every per-row metric in a store (--store) keyed by
+  hash(reference, hypothesis, metric config); only unseen rows are scored and the
+  summary JSON is rebuilt from the stored values.
+- --contamination-index flags rows whose article (or reference title / lead) also
+  appears in the training data (contamination.py); the summary then also reports
+  clean_* averages over the uncontaminated rows.
 - Requires packages: rouge-score, bert-score, torch (for BERTScore).
 - If packages are missing, you can pass --auto-install to attempt pip installs.
 """
@@ -24,6 +35,11 @@ import subprocess
 import pandas as pd
 import numpy as np
 
+from rouge_batch import batch_rouge, check_parity
+from bertscore_engine import BertScoreEngine
+from metric_store import MetricStore
+from contamination import CONTAMINATION_THRESHOLD, load_or_build
+
 def maybe_auto_install(pkgs, auto_install=False):
     if not auto_install:
         return
@@ -51,23 +67,18 @@ def safe_text(x):
         return ""
     return str(x)
 
-def compute_rouge(rouge_scorer, ref, hyp, use_stemmer=True, lower=True):
+def compute_rouge(refs, hyps, use_stemmer=True, lower=True, tokenizer="rouge", workers=0):
+    # Column-wise ROUGE-2 / ROUGE-L F1 (one tokenizer pass per corpus)
     if lower:
-        ref, hyp = ref.lower(), hyp.lower()
-    scorer = rouge_scorer.RougeScorer(["rouge2","rougeL"], use_stemmer=use_stemmer)
-    scores = scorer.score(ref, hyp)
-    # Return F1 for both
-    r2_f = float(scores["rouge2"].fmeasure)
-    rl_f = float(scores["rougeL"].fmeasure)
-    return r2_f, rl_f
-
-def compute_bertscore(bert_score, refs, hyps, lang="en", rescale_with_baseline=True, device=None):
-    # bert_score expects lists
-    import torch
-    if device is None:
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-    P, R, F1 = bert_score(cands=hyps, refs=refs, lang=lang, rescale_with_baseline=rescale_with_baseline, device=device)
-    return float(F1.mean().item())
+        refs = [r.lower() for r in refs]
+        hyps = [h.lower() for h in hyps]
+    r2_f, rl_f = batch_rouge(refs, hyps, use_stemmer=use_stemmer, tokenizer=tokenizer, workers=workers)
+    return r2_f.tolist(), rl_f.tolist()
+
+def compute_bertscore(engine, refs, hyps):
+    # Per-row BERTScore F1 with the shared engine (reference embeddings come from the cache)
+    _, _, F1 = engine.score(refs, hyps)
+    return F1.tolist()
 
 def main():
     parser = argparse.ArgumentParser()
@@ -77,11 +88,32 @@ def main():
     parser.add_argument("--lower", action="store_true", help="Lowercase before ROUGE")
     parser.add_argument("--stem", action="store_true", help="Use Porter stemmer in ROUGE")
     parser.add_argument("--no-rescale", dest="rescale", action="store_false", help="Disable BERTScore baseline rescaling")
+    parser.add_argument("--rouge-tokenizer", default="rouge", choices=["rouge", "vi"],
+                        help="'rouge' = rouge-score's ASCII tokenizer (default), 'vi' = Unicode word tokens")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="ROUGE worker processes (0 = automatic, multi-process only for large files)")
+    parser.add_argument("--check-rouge", type=int, default=0,
+                        help="Verify the first N rows against rouge-score before scoring")
+    parser.add_argument("--model-type", default=None, help="BERTScore encoder (default: bert_score's choice for --lang)")
+    parser.add_argument("--num-layers", type=int, default=None, help="BERTScore layer (required for models bert_score does not know)")
+    parser.add_argument("--batch-size", type=int, default=64, help="BERTScore encoding batch size")
+    parser.add_argument("--bertscore-cache", default=".bertscore_cache",
+                        help="Directory for cached reference embeddings ('' disables the cache)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only score rows missing from the metric store; reuse the rest")
+    parser.add_argument("--store", default=".metric_store.sqlite", help="Metric store used by --incremental")
+    parser.add_argument("--contamination-index", default=None,
+                        help="Contamination index (contamination.py); flags rows that overlap the training data")
+    parser.add_argument("--train-jsonl", default=None,
+                        help="Training jsonl used to build / refresh --contamination-index")
+    parser.add_argument("--contamination-threshold", type=float, default=CONTAMINATION_THRESHOLD,
+                        help="Estimated content Jaccard above which a row counts as contaminated")
     parser.add_argument("--auto-install", action="store_true", help="Attempt to pip install missing packages automatically")
     args = parser.parse_args()
 
     # Load libs (with optional auto-install)
-    rouge_scorer, bert_score = load_metrics_tools(auto_install=args.auto_install)
+    # (rouge_batch / bertscore_engine import them lazily; this only ensures they are installed)
+    load_metrics_tools(auto_install=args.auto_install)
 
     df = pd.read_csv(args.csv)
     required = ["title","lead","output_title","output_lead"]
@@ -89,46 +121,64 @@ def main():
         if col not in df.columns:
             raise ValueError(f"Missing required column: {col}")
 
-    # Prepare containers
-    title_r2_f, title_rl_f, title_bs_f = [], [], []
-    lead_r2_f,  lead_rl_f,  lead_bs_f  = [], [], []
-
-    # Compute per-row metrics
-    for _, row in df.iterrows():
-        ref_title = safe_text(row["title"])
-        hyp_title = safe_text(row["output_title"])
-        ref_lead  = safe_text(row["lead"])
-        hyp_lead  = safe_text(row["output_lead"])
-
-        # ROUGE for title
-        t_r2, t_rl = compute_rouge(rouge_scorer, ref_title, hyp_title, use_stemmer=args.stem, lower=args.lower)
-        title_r2_f.append(t_r2); title_rl_f.append(t_rl)
+    contaminated = None
+    if args.contamination_index:
+        if "content" not in df.columns:
+            raise ValueError("--contamination-index needs a 'content' column")
+        index = load_or_build(args.contamination_index, args.train_jsonl, threshold=args.contamination_threshold)
+        flags = index.query_frame(df)
+        contaminated = flags["contaminated"].to_numpy()
+        print(f"[WARN] {int(contaminated.sum())}/{len(df)} rows overlap the training data "
+              f"(contaminated=True in {args.out})" if contaminated.any()
+              else f"[INFO] Contamination check: no overlap with the training data")
 
-        # ROUGE for lead
-        l_r2, l_rl = compute_rouge(rouge_scorer, ref_lead, hyp_lead, use_stemmer=args.stem, lower=args.lower)
-        lead_r2_f.append(l_r2); lead_rl_f.append(l_rl)
-
-    # BERTScore (batch for efficiency)
     titles_refs = [safe_text(x) for x in df["title"].tolist()]
     titles_hyps = [safe_text(x) for x in df["output_title"].tolist()]
     leads_refs  = [safe_text(x) for x in df["lead"].tolist()]
     leads_hyps  = [safe_text(x) for x in df["output_lead"].tolist()]
 
-    # Compute BERTScore F1 for titles and leads separately
-    title_bs = compute_bertscore(bert_score, titles_refs, titles_hyps, lang=args.lang, rescale_with_baseline=args.rescale)
-    lead_bs  = compute_bertscore(bert_score, leads_refs, leads_hyps,   lang=args.lang, rescale_with_baseline=args.rescale)
-
-    # Distribute the averaged BERTScore back to each row (or compute per-row BERTScore if desired)
-    # If you'd like per-row BERTScore, uncomment the block below.
-    # from bert_score import score as bert_score_fn
-    # _, _, title_f1s = bert_score_fn(cands=titles_hyps, refs=titles_refs, lang=args.lang, rescale_with_baseline=args.rescale)
-    # _, _, lead_f1s  = bert_score_fn(cands=leads_hyps,  refs=leads_refs,  lang=args.lang, rescale_with_baseline=args.rescale)
-    # title_bs_list = [float(x) for x in title_f1s]
-    # lead_bs_list  = [float(x) for x in lead_f1s]
-
-    # For simplicity, attach the global BERTScore to each row; comment these two lines if using per-row BERTScore
-    title_bs_list = [title_bs] * len(df)
-    lead_bs_list  = [lead_bs]  * len(df)
+    if args.check_rouge:
+        parity = dict(use_stemmer=args.stem, tokenizer=args.rouge_tokenizer, lower=args.lower,
+                      limit=args.check_rouge)
+        n_bad = check_parity(titles_refs, titles_hyps, **parity) + check_parity(leads_refs, leads_hyps, **parity)
+        print(f"[INFO] ROUGE parity check vs rouge-score: {n_bad} mismatching rows")
+
+    # ROUGE per row, computed over whole columns
+    def rouge_fn(refs, hyps):
+        return compute_rouge(refs, hyps, use_stemmer=args.stem, lower=args.lower,
+                             tokenizer=args.rouge_tokenizer, workers=args.workers)
+
+    # Per-row BERTScore F1; the encoder is loaded once for both columns (and only if needed)
+    engine = None
+    def bertscore_fn(refs, hyps):
+        nonlocal engine
+        if engine is None:
+            engine = BertScoreEngine(lang=args.lang, model_type=args.model_type, num_layers=args.num_layers,
+                                     rescale_with_baseline=args.rescale, batch_size=args.batch_size,
+                                     cache_dir=args.bertscore_cache or None)
+        return (compute_bertscore(engine, refs, hyps),)
+
+    if args.incremental:
+        store = MetricStore(args.store)
+        rouge_cfg = {"metric": "rouge", "tokenizer": args.rouge_tokenizer, "stem": args.stem, "lower": args.lower}
+        # model_type=None means bert_score's default for --lang, so the language is part of the config
+        bs_cfg = {"metric": "bertscore", "lang": args.lang, "model_type": args.model_type,
+                  "num_layers": args.num_layers, "rescale": args.rescale}
+        (title_r2_f, title_rl_f), n1 = store.compute_missing(rouge_cfg, titles_refs, titles_hyps, rouge_fn, n_fields=2)
+        (lead_r2_f, lead_rl_f), n2 = store.compute_missing(rouge_cfg, leads_refs, leads_hyps, rouge_fn, n_fields=2)
+        (title_bs_list,), n3 = store.compute_missing(bs_cfg, titles_refs, titles_hyps, bertscore_fn)
+        (lead_bs_list,), n4 = store.compute_missing(bs_cfg, leads_refs, leads_hyps, bertscore_fn)
+        store.close()
+        print(f"[INFO] Incremental: scored {n1 + n2} new ROUGE and {n3 + n4} new BERTScore pairs "
+              f"({4 * len(df) - (n1 + n2 + n3 + n4)} reused from {args.store})")
+    else:
+        title_r2_f, title_rl_f = rouge_fn(titles_refs, titles_hyps)
+        lead_r2_f, lead_rl_f = rouge_fn(leads_refs, leads_hyps)
+        (title_bs_list,) = bertscore_fn(titles_refs, titles_hyps)
+        (lead_bs_list,) = bertscore_fn(leads_refs, leads_hyps)
+
+    if engine is not None and engine.cache_dir:
+        print(f"[INFO] Reference embedding cache: {engine.cache_hits} hits, {engine.cache_misses} misses")
 
     out = df.copy()
     out["title_rouge2_f1"] = title_r2_f
@@ -139,16 +189,27 @@ def main():
     out["lead_rougeL_f1"] = lead_rl_f
     out["lead_bertscore_f1"] = lead_bs_list
 
+    if contaminated is not None:
+        out["contaminated"] = contaminated
+        out["contamination_sim"] = flags["contamination_sim"].to_numpy()
+
     # Macro averages
     summary = {
         "title_rouge2_f1": float(np.mean(title_r2_f)) if len(title_r2_f) else 0.0,
         "title_rougeL_f1": float(np.mean(title_rl_f)) if len(title_rl_f) else 0.0,
-        "title_bertscore_f1": float(title_bs),
+        "title_bertscore_f1": float(np.mean(title_bs_list)) if len(title_bs_list) else 0.0,
         "lead_rouge2_f1": float(np.mean(lead_r2_f)) if len(lead_r2_f) else 0.0,
         "lead_rougeL_f1": float(np.mean(lead_rl_f)) if len(lead_rl_f) else 0.0,
-        "lead_bertscore_f1": float(lead_bs),
+        "lead_bertscore_f1": float(np.mean(lead_bs_list)) if len(lead_bs_list) else 0.0,
         "rows": int(len(df))
     }
+    if contaminated is not None:
+        clean = ~contaminated
+        for name in ["title_rouge2_f1", "title_rougeL_f1", "title_bertscore_f1",
+                     "lead_rouge2_f1", "lead_rougeL_f1", "lead_bertscore_f1"]:
+            vals = out[name].to_numpy()[clean]
+            summary[f"clean_{name}"] = float(np.mean(vals)) if len(vals) else 0.0
+        summary["contaminated_rows"] = int(contaminated.sum())
 
     out.to_csv(args.out, index=False)
     print("=== Macro Averages ===")
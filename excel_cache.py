@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Columnar cache for the category xlsx sources.
+
+Parsing xlsx with openpyxl is slow and the category sheets never change between
+dataset builds. read_excel_cached() converts each sheet once into an uncompressed
+Arrow IPC (Feather v2) file and later runs memory-map that file, reading only the
+requested columns.
+
+The cache entry of a source is valid while its size and mtime are unchanged; if
+only the mtime moved (copy, touch, checkout), the content hash decides, so an
+identical file is never parsed again.
+
+Usage:
+    df = read_excel_cached("./du lich.xlsx", columns=["title", "lead", "content"])
+"""
+
+import hashlib
+import json
+import os
+from typing import List, Optional
+
+import pandas as pd
+
+EXCEL_CACHE_DIR = "./.excel_cache"
+# Bump when the conversion below changes, so old cache files are rebuilt
+CACHE_VERSION = 1
+
+
+def file_sha256(path: str, block: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(block), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _to_arrow_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Object columns (mixed str / number / NaN from Excel) become nullable strings,
+    each value rendered with str() as the readers did before; numeric columns are kept.
+    """
+    out = df.copy()
+    out.columns = [str(c) for c in out.columns]
+    for col in out.columns:
+        if out[col].dtype == object:
+            out[col] = out[col].map(lambda v: str(v) if pd.notna(v) else None).astype("string")
+    return out
+
+
+class ExcelCache:
+    """
+    One manifest (JSON) plus one Arrow IPC file per source workbook in `cache_dir`.
+    """
+
+    def __init__(self, cache_dir: str = EXCEL_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+    def _paths(self, source: str):
+        # Entry name from the absolute source path, so equal basenames in different folders do not clash
+        key = hashlib.sha256(os.path.abspath(source).encode("utf-8")).hexdigest()[:16]
+        stem = os.path.splitext(os.path.basename(source))[0].replace(" ", "_")
+        base = os.path.join(self.cache_dir, f"{stem}-{key}")
+        return base + ".json", base + ".arrow"
+
+    def _valid_entry(self, source: str, manifest_path: str, arrow_path: str) -> bool:
+        if not (os.path.exists(manifest_path) and os.path.exists(arrow_path)):
+            return False
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != CACHE_VERSION:
+            return False
+        st = os.stat(source)
+        if manifest["size"] != st.st_size:
+            return False
+        if manifest["mtime_ns"] == st.st_mtime_ns:
+            return True
+        # Touched but maybe not modified: compare content
+        if manifest["sha256"] != file_sha256(source):
+            return False
+        manifest["mtime_ns"] = st.st_mtime_ns
+        self._write_manifest(manifest_path, manifest)
+        return True
+
+    @staticmethod
+    def _write_manifest(path: str, manifest) -> None:
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+
+    def build(self, source: str) -> str:
+        """
+        Parse the workbook and (re)write its Arrow cache. Returns the Arrow file path.
+        """
+        import pyarrow as pa
+        from pyarrow import feather
+
+        manifest_path, arrow_path = self._paths(source)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        st = os.stat(source)
+        sha = file_sha256(source)
+        table = pa.Table.from_pandas(_to_arrow_frame(pd.read_excel(source)), preserve_index=False)
+        tmp = arrow_path + ".tmp"
+        # Uncompressed so the file can be memory-mapped without decoding
+        feather.write_feather(table, tmp, compression="uncompressed")
+        os.replace(tmp, arrow_path)
+        self._write_manifest(manifest_path, {
+            "version": CACHE_VERSION,
+            "source": os.path.abspath(source),
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "sha256": sha,
+            "rows": table.num_rows,
+            "columns": table.column_names,
+        })
+        return arrow_path
+
+    def read(self, source: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        from pyarrow import feather
+
+        manifest_path, arrow_path = self._paths(source)
+        if self._valid_entry(source, manifest_path, arrow_path):
+            self.hits += 1
+        else:
+            self.misses += 1
+            self.build(source)
+        table = feather.read_table(arrow_path, columns=columns, memory_map=True)
+        return table.to_pandas()
+
+
+def read_excel_cached(path: str, columns: Optional[List[str]] = None,
+                      cache_dir: Optional[str] = EXCEL_CACHE_DIR) -> pd.DataFrame:
+    """
+    pd.read_excel(path)[columns] through the Arrow cache.
+    Falls back to pd.read_excel when caching is disabled (cache_dir=None) or pyarrow is missing.
+    """
+    if cache_dir:
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            print("⚠️ pyarrow not installed; reading xlsx without cache")
+        else:
+            return ExcelCache(cache_dir).read(path, columns=columns)
+    df = pd.read_excel(path)
+    return df[columns] if columns is not None else df
@@ -13,6 +13,7 @@ import argparse, json, os, math
 from dataclasses import dataclass
 from typing import Dict, List
 
+import numpy as np
 import torch
 from datasets import load_dataset
 from transformers import (
@@ -22,6 +23,11 @@ from transformers import (
 )
 from trl import SFTTrainer, SFTConfig
 from peft import LoraConfig
+from token_length_cache import LENGTH_CACHE_PATH, LengthIndex, TokenLengthCache, tokenizer_id
+from tokenize_norm import batch_token_lengths
+from sft_packing import (LengthGroupedSampler, PackedCollator, PackedDataset, build_packed_examples,
+                         pack_sequences, padding_stats, print_padding_stats)
+from sft_token_store import SFT_CACHE_DIR, load_or_build as load_token_store, source_id
 #from unsloth import FastLanguageModel  # Unsloth magic
 
 # ------------- Args -------------
@@ -33,7 +39,12 @@ def parse_args():
     ap.add_argument("--train_jsonl", type=str, required=True,
                     help="Path to JSONL with fields: instruction,input,output")
     ap.add_argument("--output_dir", type=str, default="./qwen_lora_out")
-    ap.add_argument("--max_seq_len", type=int, default=2048)
+    ap.add_argument("--max_seq_len", type=int, default=2048,
+                    help="0 = pick from the corpus token lengths (see --seq_len_coverage)")
+    ap.add_argument("--seq_len_coverage", type=float, default=0.99,
+                    help="With --max_seq_len 0: fraction of samples that must fit untruncated")
+    ap.add_argument("--length_cache", type=str, default=LENGTH_CACHE_PATH,
+                    help="Token-length sidecar shared with tokenize_norm.py")
     ap.add_argument("--batch_size", type=int, default=2)
     ap.add_argument("--grad_accum", type=int, default=8)
     ap.add_argument("--lr", type=float, default=2e-4)
@@ -49,6 +60,11 @@ def parse_args():
     ap.add_argument("--logging_steps", type=int, default=10)
     ap.add_argument("--eval_fraction", type=float, default=0.02)
     ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--token_cache", type=str, default="",
+                    help=f"Pre-tokenized memmap store dir, e.g. {SFT_CACHE_DIR}: trains on assistant tokens only and "
+                         "drops samples whose answer max_seq_len cuts off; '' (default) = tokenize text in the trainer")
+    ap.add_argument("--packing", type=str, default="none", choices=["none", "bucket", "pack"],
+                    help="bucket = group batches by token length; pack = concatenate samples into max_seq_len rows")
     return ap.parse_args()
 
 # ------------- Prompting -------------
@@ -93,11 +109,49 @@ def format_example(ex, tokenizer: AutoTokenizer) -> Dict[str, List[int]]:
     )
     return {"text": text}
 
+def length_index(texts: List[str], tokenizer, cache_path: str) -> LengthIndex:
+    # Token lengths of the formatted samples; only unseen texts are tokenized
+    with TokenLengthCache(cache_path, tokenizer_id(tokenizer)) as cache:
+        lengths = cache.lengths(texts, lambda missing: batch_token_lengths(tokenizer, missing))
+    return LengthIndex(lengths)
+
+def pack_dataset(ds, tokenizer, max_len: int):
+    # Tokenize the rendered chat texts and pack them into rows of at most max_len tokens
+    from datasets import Dataset
+    texts = ds["text"]
+    input_ids = []
+    for i in range(0, len(texts), 1024):
+        input_ids.extend(tokenizer(texts[i:i + 1024], add_special_tokens=False,
+                                   return_attention_mask=False)["input_ids"])
+    bins = pack_sequences([len(x) for x in input_ids], max_len)
+    return Dataset.from_list(build_packed_examples(input_ids, None, bins, max_len))
+
+class StoreSFTTrainer(SFTTrainer):
+    """SFTTrainer with an explicit train sampler (lengths from the token store, not the rows)."""
+
+    def __init__(self, *args, train_sampler=None, **kwargs):
+        self.train_sampler = train_sampler
+        super().__init__(*args, **kwargs)
+
+    def _get_train_sampler(self, *args, **kwargs):
+        if self.train_sampler is not None:
+            return self.train_sampler
+        return super()._get_train_sampler(*args, **kwargs)
+
 # ------------- Main -------------
 def main():
     args = parse_args()
     os.makedirs(args.output_dir, exist_ok=True)
 
+    if args.max_seq_len <= 0:
+        # Decide the context length before the model is loaded with it
+        probe_tok = AutoTokenizer.from_pretrained(args.model_id)
+        probe = load_dataset("json", data_files={"train": args.train_jsonl})["train"]
+        index = length_index([format_example(ex, probe_tok)["text"] for ex in probe], probe_tok, args.length_cache)
+        args.max_seq_len = index.suggest_max_seq_len(args.seq_len_coverage)
+        print(f"max_seq_len={args.max_seq_len} covers {args.seq_len_coverage:.0%} of {len(index)} samples "
+              f"(p50={index.percentile(50):.0f}, max={index.summary()['max']})")
+
     # Load model & tokenizer via Unsloth (4-bit QLoRA friendly)
     model, tokenizer = FastLanguageModel.from_pretrained(
         model_name=args.model_id,
@@ -130,16 +184,68 @@ def main():
     )
     # Load dataset
     # Your JSONL must have fields: instruction, input, output
-    raw = load_dataset("json", data_files={"train": args.train_jsonl})
-    if args.eval_fraction and args.eval_fraction > 0:
-        raw = raw["train"].train_test_split(test_size=args.eval_fraction, seed=args.seed)
-        ds_train, ds_eval = raw["train"], raw["test"]
+    if args.token_cache:
+        # Rendered and tokenized once per (tokenizer, template, data); memory-mapped afterwards
+        store = load_token_store(args.train_jsonl, tokenizer, lambda ex: format_example(ex, tokenizer)["text"],
+                                 cache_dir=args.token_cache, max_seq_len=args.max_seq_len,
+                                 render_id=source_id(build_chat, format_example))
+        trainable = np.flatnonzero(store.assistant_counts > 0)
+        if len(trainable) < len(store):
+            print(f"Dropping {len(store) - len(trainable)} samples whose answer is cut off by max_seq_len={args.max_seq_len}")
+            store = store.select(trainable)
+        ds_train, ds_eval = store.split(args.eval_fraction, seed=args.seed)
+        index = LengthIndex(ds_train.lengths)
+        # Stored rows are already cut to max_seq_len; count overflow on the lengths before the cut
+        n_long = int((ds_train.raw_lengths > args.max_seq_len).sum())
     else:
-        ds_train, ds_eval = raw["train"], None
+        raw = load_dataset("json", data_files={"train": args.train_jsonl})
+        if args.eval_fraction and args.eval_fraction > 0:
+            raw = raw["train"].train_test_split(test_size=args.eval_fraction, seed=args.seed)
+            ds_train, ds_eval = raw["train"], raw["test"]
+        else:
+            ds_train, ds_eval = raw["train"], None
+
+        ds_train = ds_train.map(lambda ex: format_example(ex, tokenizer), remove_columns=ds_train.column_names)
+        if ds_eval:
+            ds_eval = ds_eval.map(lambda ex: format_example(ex, tokenizer), remove_columns=ds_eval.column_names)
+        index = length_index(ds_train["text"], tokenizer, args.length_cache)
+        n_long = len(index) - index.count_between(0, args.max_seq_len)
+
+    print(f"Train token lengths: p50={index.percentile(50):.0f} p95={index.percentile(95):.0f} "
+          f"max={index.summary()['max']}; {n_long}/{len(index)} samples exceed max_seq_len={args.max_seq_len}")
+    print(f"Padding per strategy (batch_size={args.batch_size}, max_seq_len={args.max_seq_len}):")
+    print_padding_stats(padding_stats(index.lengths, args.batch_size, args.max_seq_len, seed=args.seed))
 
-    ds_train = ds_train.map(lambda ex: format_example(ex, tokenizer), remove_columns=ds_train.column_names)
-    if ds_eval:
-        ds_eval = ds_eval.map(lambda ex: format_example(ex, tokenizer), remove_columns=ds_eval.column_names)
+    data_collator = None
+    train_sampler = None
+    extra_config = {}
+    if args.token_cache:
+        # Rows already carry input_ids / labels; pad them without re-tokenizing
+        data_collator = PackedCollator.for_model(model, tokenizer.pad_token_id, pad_to_multiple_of=8)
+        extra_config = {"dataset_kwargs": {"skip_prepare_dataset": True}, "remove_unused_columns": False}
+    if args.packing == "bucket":
+        if args.token_cache:
+            # Same megabatch grouping as group_by_length, from the stored lengths
+            # (HF's sampler would read every memmap row to measure them)
+            train_sampler = LengthGroupedSampler(ds_train.lengths, args.batch_size, seed=args.seed)
+        else:
+            # HF's LengthGroupedSampler reads the per-sample token length from this column
+            ds_train = ds_train.add_column("length", index.lengths.tolist())
+            extra_config = {"group_by_length": True, "length_column_name": "length"}
+    elif args.packing == "pack":
+        if args.token_cache:
+            ds_train = PackedDataset(ds_train, pack_sequences(ds_train.lengths, args.max_seq_len), args.max_seq_len)
+            if ds_eval:
+                ds_eval = PackedDataset(ds_eval, pack_sequences(ds_eval.lengths, args.max_seq_len), args.max_seq_len)
+        else:
+            ds_train = pack_dataset(ds_train, tokenizer, args.max_seq_len)
+            if ds_eval:
+                ds_eval = pack_dataset(ds_eval, tokenizer, args.max_seq_len)
+        # Sample boundaries travel in position_ids (flash-attention varlen path);
+        # eager / sdpa models get a block-diagonal 4D mask instead
+        data_collator = PackedCollator.for_model(model, tokenizer.pad_token_id, pad_to_multiple_of=8)
+        extra_config = {"dataset_kwargs": {"skip_prepare_dataset": True}, "remove_unused_columns": False}
+        print(f"Packed {len(index)} samples into {len(ds_train)} rows of <= {args.max_seq_len} tokens")
 
     # Collator: standard LM collator (labels = input_ids)
     collator = DataCollatorForLanguageModeling(tokenizer, mlm=False)
@@ -178,11 +284,13 @@ def main():
     # )
 
     # TRL SFT Trainer
-    trainer = SFTTrainer(
+    trainer = StoreSFTTrainer(
         model=model,
         processing_class=tokenizer,
         train_dataset=ds_train,
         eval_dataset=ds_eval,
+        data_collator=data_collator,
+        train_sampler=train_sampler,
         args = SFTConfig(
             dataset_text_field = "text",
             per_device_train_batch_size = args.batch_size,
@@ -202,6 +310,7 @@ def main():
             report_to = "wandb", # Use this for WandB etc
             #logging_steps=10,
             run_name="qwen3-8b-16-10-sft",
+            **extra_config,
         ),
     )
 
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+SQLite store of per-row metric values for incremental evaluation.
+
+Each entry is keyed by hash(metric config, reference, hypothesis), so a row whose
+texts and metric settings were already scored in any earlier run is looked up
+instead of recomputed. Only missing entries are scored.
+
+Usage:
+    store = MetricStore(".metric_store.sqlite")
+    cfg = {"metric": "rouge", "tokenizer": "rouge", "stem": False, "lower": False}
+    (r2, rl), n_new = store.compute_missing(cfg, refs, hyps, fn, n_fields=2)   # fn -> (r2_list, rl_list)
+"""
+
+import hashlib
+import json
+import sqlite3
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+
+
+def config_id(config: Dict[str, Any]) -> str:
+    return json.dumps(config, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+
+
+def metric_key(config: Dict[str, Any], ref: str, hyp: str) -> str:
+    h = hashlib.sha256()
+    for part in (config_id(config), ref, hyp):
+        data = part.encode("utf-8")
+        # Length-prefix each part so ("ab", "c") and ("a", "bc") never collide
+        h.update(len(data).to_bytes(8, "little"))
+        h.update(data)
+    return h.hexdigest()
+
+
+class MetricStore:
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS metrics ("
+            " key TEXT PRIMARY KEY,"
+            " config TEXT NOT NULL,"
+            " value TEXT NOT NULL)"
+        )
+        self.conn.commit()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, List[float]]:
+        keys = list(dict.fromkeys(keys))
+        found: Dict[str, List[float]] = {}
+        # Stay under SQLite's bound-parameter limit
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            q = f"SELECT key, value FROM metrics WHERE key IN ({','.join('?' * len(batch))})"
+            for key, value in self.conn.execute(q, batch):
+                found[key] = json.loads(value)
+        return found
+
+    def put_many(self, config: Dict[str, Any], items: Iterable[Tuple[str, List[float]]]) -> None:
+        cid = config_id(config)
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO metrics (key, config, value) VALUES (?, ?, ?)",
+            ((key, cid, json.dumps(value)) for key, value in items),
+        )
+        self.conn.commit()
+
+    def compute_missing(self, config: Dict[str, Any], refs: Sequence[str], hyps: Sequence[str],
+                        fn: Callable[[List[str], List[str]], Sequence[Sequence[float]]],
+                        n_fields: int = 1) -> Tuple[List[List[float]], int]:
+        """
+        Values for every (ref, hyp) row under `config`, computing only pairs not in the store.
+
+        `fn(refs, hyps)` returns `n_fields` lists, one per metric field (e.g. (rouge2_list, rougeL_list)).
+        Returns (per-field value lists aligned with the input rows, number of newly computed pairs).
+        """
+        keys = [metric_key(config, r, h) for r, h in zip(refs, hyps)]
+        found = self.get_many(keys)
+
+        missing: Dict[str, Tuple[str, str]] = {}
+        for key, r, h in zip(keys, refs, hyps):
+            if key not in found and key not in missing:
+                missing[key] = (r, h)
+        if missing:
+            m_refs = [r for r, _ in missing.values()]
+            m_hyps = [h for _, h in missing.values()]
+            fields = fn(m_refs, m_hyps)
+            fresh = {key: [float(f[i]) for f in fields] for i, key in enumerate(missing)}
+            self.put_many(config, fresh.items())
+            found.update(fresh)
+
+        columns = [[found[key][j] for key in keys] for j in range(n_fields)]
+        return columns, len(missing)
+
+    def close(self) -> None:
+        self.conn.close()
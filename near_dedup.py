@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Exact and near-duplicate detection for article content (MinHash + LSH).
+
+- content is normalized (lowercase Unicode word tokens) and cut into word k-gram
+  shingles, hashed to 32-bit ints with NumPy;
+- each article gets a MinHash signature (NUM_PERM universal hashes), computed in
+  worker processes for large batches;
+- signatures are split into BANDS bands; articles sharing any band bucket are
+  candidates, kept as near-duplicates when the estimated Jaccard similarity is
+  >= threshold. Exact duplicates are caught first by a hash of the normalized text;
+- MinHashLSH keeps only unique articles and can be saved / loaded; ids should be
+  stable across exports (content hash / source article id), so an article seen
+  by an earlier build is recognised as itself rather than as a duplicate.
+
+The persisted index is bounded with Deduplicator.compact(max_docs): entries
+matched in the current run are always kept, older unmatched ones are evicted first.
+
+Usage:
+    index = MinHashLSH.load(".dedup_index.npz") if os.path.exists(".dedup_index.npz") else MinHashLSH()
+    dedup = Deduplicator(index)
+    hashes = [content_hash(c) for c in contents]
+    keep = dedup.dedup(hashes, contents, meta=[{"title": t} for t in titles], exact=hashes)
+    dedup.write_report("dedup_report.csv")
+    dedup.compact(max_docs=500_000).save(".dedup_index.npz")
+"""
+
+import csv
+import hashlib
+import os
+import re
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+NUM_PERM = 128
+BANDS = 16              # NUM_PERM / BANDS rows per band; ~0.7 similarity at 50% detection
+SHINGLE_SIZE = 5        # words per shingle
+THRESHOLD = 0.8         # estimated Jaccard to call two articles near-duplicates
+SEED = 1
+# Batches with more documents than this are hashed in worker processes
+PARALLEL_MIN_DOCS = 20000
+
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+_SHIFT = np.uint64(32)
+_SHINGLE_MULT = np.uint64(0x9E3779B97F4A7C15)
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+# Per-process token -> crc32 memo (news vocabulary is small); reset when it grows past this
+_TOKEN_HASH_MAX = 1 << 20
+_token_hash: Dict[str, int] = {}
+
+
+def normalize(text: str) -> List[str]:
+    return _WORD_RE.findall(text.lower())
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(" ".join(normalize(text)).encode("utf-8")).hexdigest()
+
+
+def shingle_hashes(tokens: Sequence[str], k: int = SHINGLE_SIZE) -> np.ndarray:
+    """
+    Distinct 32-bit hashes of the word k-grams of `tokens` (the whole text if shorter than k).
+    """
+    if not tokens:
+        return np.zeros(0, dtype=np.uint64)
+    if len(_token_hash) > _TOKEN_HASH_MAX:
+        _token_hash.clear()
+    ids = []
+    for t in tokens:
+        v = _token_hash.get(t)
+        if v is None:
+            v = _token_hash[t] = zlib.crc32(t.encode("utf-8"))
+        ids.append(v)
+    tok = np.array(ids, dtype=np.uint64)
+    k = min(k, len(tok))
+    n = len(tok) - k + 1
+    # Polynomial combination of the k token hashes (wraps mod 2**64), folded to 32 bits
+    h = np.zeros(n, dtype=np.uint64)
+    for j in range(k):
+        h = h * _SHINGLE_MULT + tok[j:j + n]
+    h = (h ^ (h >> _SHIFT)) & _MAX_HASH
+    return np.unique(h)
+
+
+def permutations(num_perm: int = NUM_PERM, seed: int = SEED) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Multiply-shift hash parameters: h(x) = (a * x + b mod 2**64) >> 32, with odd a.
+    """
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, 1 << 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+    b = rng.randint(0, 1 << 63, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def minhash(hashes: np.ndarray, perm: Tuple[np.ndarray, np.ndarray]) -> np.ndarray:
+    a, b = perm
+    if len(hashes) == 0:
+        return np.full(len(a), 0xFFFFFFFF, dtype=np.uint32)
+    # uint64 arithmetic wraps mod 2**64; no modulo needed
+    phv = (hashes[:, None] * a[None, :] + b[None, :]) >> _SHIFT
+    return phv.min(axis=0).astype(np.uint32)
+
+
+def _signature_chunk(args) -> np.ndarray:
+    texts, num_perm, k, seed = args
+    perm = permutations(num_perm, seed)
+    out = np.empty((len(texts), num_perm), dtype=np.uint32)
+    for i, text in enumerate(texts):
+        out[i] = minhash(shingle_hashes(normalize(text), k), perm)
+    return out
+
+
+def minhash_signatures(texts: Sequence[str], num_perm: int = NUM_PERM, k: int = SHINGLE_SIZE,
+                       seed: int = SEED, workers: int = 0) -> np.ndarray:
+    """
+    [len(texts), num_perm] uint32 signatures.
+    workers: 0 = automatic (multi-process only above PARALLEL_MIN_DOCS), 1 = single process.
+    """
+    n = len(texts)
+    if workers == 0:
+        workers = (os.cpu_count() or 1) if n >= PARALLEL_MIN_DOCS else 1
+    if workers <= 1 or n < 2:
+        return _signature_chunk((list(texts), num_perm, k, seed))
+    step = -(-n // (workers * 4))
+    chunks = [(list(texts[i:i + step]), num_perm, k, seed) for i in range(0, n, step)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return np.concatenate(list(pool.map(_signature_chunk, chunks)))
+
+
+class MinHashLSH:
+    """
+    Banded LSH index over MinHash signatures, plus an exact-hash lookup.
+    """
+
+    def __init__(self, num_perm: int = NUM_PERM, bands: int = BANDS,
+                 shingle_size: int = SHINGLE_SIZE, threshold: float = THRESHOLD, seed: int = SEED):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.threshold = threshold
+        self.seed = seed
+        self.ids: List[str] = []
+        self.exact: Dict[str, int] = {}      # content hash -> position
+        self._sigs: List[np.ndarray] = []
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(bands)]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def signatures(self, texts: Sequence[str], workers: int = 0) -> np.ndarray:
+        return minhash_signatures(texts, self.num_perm, self.shingle_size, self.seed, workers=workers)
+
+    def _band_keys(self, sig: np.ndarray) -> List[bytes]:
+        return [sig[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def add(self, doc_id: str, sig: np.ndarray, exact: Optional[str] = None) -> int:
+        pos = len(self.ids)
+        self.ids.append(str(doc_id))
+        self._sigs.append(np.asarray(sig, dtype=np.uint32))
+        if exact is not None:
+            self.exact.setdefault(exact, pos)
+        for band, key in zip(self._buckets, self._band_keys(sig)):
+            band.setdefault(key, []).append(pos)
+        return pos
+
+    def query(self, sig: np.ndarray, threshold: Optional[float] = None) -> List[Tuple[int, float]]:
+        """
+        Indexed positions whose estimated Jaccard with `sig` is >= threshold, most similar first.
+        """
+        threshold = self.threshold if threshold is None else threshold
+        cand = set()
+        for band, key in zip(self._buckets, self._band_keys(sig)):
+            cand.update(band.get(key, ()))
+        if not cand:
+            return []
+        cand = sorted(cand)
+        sims = (np.stack([self._sigs[i] for i in cand]) == sig[None, :]).mean(axis=1)
+        hits = [(c, float(s)) for c, s in zip(cand, sims) if s >= threshold]
+        return sorted(hits, key=lambda t: -t[1])
+
+    def save(self, path: str) -> None:
+        sigs = np.stack(self._sigs) if self._sigs else np.zeros((0, self.num_perm), dtype=np.uint32)
+        exact = sorted(self.exact.items(), key=lambda t: t[1])
+        tmp = path + ".tmp.npz"
+        np.savez(
+            tmp,
+            params=np.array([self.num_perm, self.bands, self.shingle_size, self.seed], dtype=np.int64),
+            threshold=np.array(self.threshold),
+            ids=np.array(self.ids, dtype=str),
+            signatures=sigs,
+            exact_keys=np.array([k for k, _ in exact], dtype=str),
+            exact_pos=np.array([p for _, p in exact], dtype=np.int64),
+        )
+        os.replace(tmp, path)
+
+    def subset(self, positions: Sequence[int]) -> "MinHashLSH":
+        """
+        New index with the entries at `positions` (in that order).
+        """
+        index = MinHashLSH(num_perm=self.num_perm, bands=self.bands, shingle_size=self.shingle_size,
+                           threshold=self.threshold, seed=self.seed)
+        new_pos = {}
+        for p in positions:
+            new_pos[p] = index.add(self.ids[p], self._sigs[p])
+        index.exact = {k: new_pos[p] for k, p in self.exact.items() if p in new_pos}
+        return index
+
+    @classmethod
+    def load(cls, path: str) -> "MinHashLSH":
+        with np.load(path) as z:
+            num_perm, bands, shingle_size, seed = (int(v) for v in z["params"])
+            index = cls(num_perm=num_perm, bands=bands, shingle_size=shingle_size,
+                        threshold=float(z["threshold"]), seed=seed)
+            # Buckets are rebuilt from the signatures (one pass)
+            for doc_id, sig in zip(z["ids"].tolist(), z["signatures"]):
+                index.add(doc_id, sig)
+            index.exact = dict(zip(z["exact_keys"].tolist(), z["exact_pos"].tolist()))
+        return index
+
+
+class Deduplicator:
+    """
+    Keeps the first article of every exact / near-duplicate cluster and records the rest.
+
+    Documents should be keyed by a stable id (e.g. content_hash of the text, or the
+    source's article id), not by a row position. The dataset is rebuilt from every
+    export on each run, so an article is only dropped as a duplicate of one kept in
+    this run. Entries persisted by earlier runs are claimed by the first article of
+    this run that matches them (itself, under the same id, or a newer near-duplicate
+    version), and later matches of a claimed entry are dropped.
+    """
+
+    def __init__(self, index: Optional[MinHashLSH] = None, workers: int = 0):
+        self.index = index if index is not None else MinHashLSH()
+        self.workers = workers
+        self.dropped: List[Dict[str, Any]] = []
+        self._pos_by_id = {doc_id: i for i, doc_id in enumerate(self.index.ids)}
+        self._owner: Dict[int, str] = {}     # index position -> id of the article kept for it in this run
+
+    def check(self, doc_id: str, sig: np.ndarray, exact: str) -> Optional[Tuple[str, float, str]]:
+        """
+        (kept id, similarity, "exact" | "near") if the article duplicates one kept in
+        this run, otherwise None: the article is kept and claims its index entries.
+        """
+        doc_id = str(doc_id)
+        own = self._pos_by_id.get(doc_id)
+        if own is not None and own in self._owner:
+            return self._owner[own], 1.0, "exact"
+        matches: List[Tuple[int, float, str]] = []
+        pos = self.index.exact.get(exact)
+        if pos is not None:
+            matches.append((pos, 1.0, "exact"))
+        matches.extend((p, sim, "near") for p, sim in self.index.query(sig))
+        for pos, sim, reason in matches:
+            if pos in self._owner:
+                return self._owner[pos], sim, reason
+        if own is None:
+            own = self._pos_by_id[doc_id] = self.index.add(doc_id, sig, exact)
+        self._owner[own] = doc_id
+        for pos, _, _ in matches:
+            self._owner.setdefault(pos, doc_id)
+        return None
+
+    def dedup(self, ids: Sequence[str], texts: Sequence[str],
+              meta: Optional[Sequence[Dict[str, Any]]] = None,
+              exact: Optional[Sequence[str]] = None) -> List[bool]:
+        """
+        Keep mask aligned with `texts`; dropped rows are added to the report.
+        exact: content_hash of every text, when the caller already has them
+        (e.g. because they are also the ids); computed here otherwise.
+        """
+        sigs = self.index.signatures(texts, workers=self.workers)
+        if exact is None:
+            exact = [content_hash(t) for t in texts]
+        keep = []
+        for i, doc_id in enumerate(ids):
+            dup = self.check(doc_id, sigs[i], exact[i])
+            keep.append(dup is None)
+            if dup is not None:
+                kept_id, sim, reason = dup
+                row = {"cluster": kept_id, "dropped_id": str(doc_id), "reason": reason, "similarity": round(sim, 4)}
+                if meta is not None:
+                    row.update(meta[i])
+                self.dropped.append(row)
+        return keep
+
+    def compact(self, max_docs: Optional[int] = None) -> MinHashLSH:
+        """
+        Index to persist, holding at most `max_docs` entries (None = no limit).
+        Entries matched in this run are always kept; the remaining room goes to
+        the most recently added of the others. Returns the index unchanged when
+        it is within the limit.
+        """
+        n = len(self.index)
+        if max_docs is None or n <= max_docs:
+            return self.index
+        seen = set(self._owner)
+        room = max(0, max_docs - len(seen))
+        unseen = [p for p in range(n) if p not in seen]
+        keep = seen.union(unseen[len(unseen) - room:] if room else [])
+        return self.index.subset(sorted(keep))
+
+    def write_report(self, path: str) -> int:
+        """
+        CSV of dropped articles grouped by the article kept for their cluster.
+        Returns the number of clusters.
+        """
+        rows = sorted(self.dropped, key=lambda r: (r["cluster"], -r["similarity"]))
+        fieldnames: List[str] = []
+        for r in rows:
+            fieldnames.extend(k for k in r if k not in fieldnames)
+        with open(path, "w", encoding="utf-8-sig", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames or ["cluster", "dropped_id", "reason", "similarity"])
+            writer.writeheader()
+            writer.writerows(rows)
+        return len({r["cluster"] for r in rows})
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Single-pass normalisation of the SFT training jsonl.
+
+Replaces the old two-step chain: tokenize_norm.py read the whole file with
+ast.literal_eval and wrote every kept line back as a JSON *string*
+(double-encoded), then fix_jsonl.py re-read that file and json.loads'ed each
+line twice. Here every line is streamed once:
+
+  parse     orjson (json if orjson is missing); double-encoded lines and
+            Python-repr lines from older exports are decoded too
+  validate  "conversations" is a list of {role, content} string turns (what the
+            old chain needed not to crash); --require-answer also drops
+            records without a non-empty assistant answer (off by default,
+            the old chain kept them)
+  length    token length of the "role: content" rendering, read from the
+            token-length sidecar or tokenized in batches (TokenLengthEngine)
+  write     kept records as one JSON object per line, through DatasetWriter
+            (temp file + rename, optional gzip / zstd and shards)
+
+Memory is bounded by --chunk-lines, plus 4 bytes per valid sample for the
+length report.
+
+Usage:
+  python normalize_jsonl.py --input train_data_16_10_2025.jsonl \
+      --output train_data_16_10_2025_fixed.jsonl --min-len 200 --max-len 4096
+"""
+
+import argparse
+import ast
+import json
+import time
+from array import array
+from collections import Counter
+from typing import Any, Dict, Iterator, List, Optional
+
+from batch_io import DatasetWriter
+from token_length_cache import LENGTH_CACHE_PATH, LengthIndex, TokenLengthCache, tokenizer_id
+
+try:
+    import orjson
+except ImportError:    # stdlib fallback, same output
+    orjson = None
+
+INPUT_JSONL = "./train_data_16_10_2025.jsonl"
+OUTPUT_JSONL = "./train_data_16_10_2025_fixed.jsonl"
+# Lines parsed / tokenized / written per step
+CHUNK_LINES = 8192
+
+
+def loads(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def dumps_line(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def parse_line(line: bytes) -> Optional[Dict[str, Any]]:
+    """
+    One record from a jsonl line: plain JSON, JSON-encoded JSON (old _norm files)
+    or a Python dict repr. None when the line cannot be decoded to a dict.
+    """
+    try:
+        obj = loads(line)
+        if isinstance(obj, str):
+            obj = loads(obj)
+    except ValueError:
+        try:
+            obj = ast.literal_eval(line.decode("utf-8"))
+        except (ValueError, SyntaxError, UnicodeDecodeError):
+            return None
+    return obj if isinstance(obj, dict) else None
+
+
+def validate(record: Dict[str, Any], require_answer: bool = False) -> Optional[str]:
+    """
+    Why the record is unusable for SFT, or None if it is fine.
+    """
+    turns = record.get("conversations")
+    if not isinstance(turns, list) or not turns:
+        return "no conversations"
+    for turn in turns:
+        if not isinstance(turn, dict) or not isinstance(turn.get("role"), str) \
+                or not isinstance(turn.get("content"), str):
+            return "bad turn"
+    if require_answer and not any(t["role"] == "assistant" and t["content"].strip() for t in turns):
+        return "no assistant answer"
+    return None
+
+
+def sample_text(record: Dict[str, Any]) -> str:
+    """Text whose token length is filtered on (same rendering as before)."""
+    return "".join(t["role"] + ": " + t["content"] + "\n" for t in record["conversations"])
+
+
+def iter_line_chunks(path: str, chunk_lines: int = CHUNK_LINES) -> Iterator[List[bytes]]:
+    chunk: List[bytes] = []
+    with open(path, "rb") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            chunk.append(line)
+            if len(chunk) >= chunk_lines:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_records(path: str, chunk_lines: int = CHUNK_LINES,
+                 require_answer: bool = False) -> Iterator[Dict[str, Any]]:
+    """Valid records of a jsonl, streamed."""
+    for chunk in iter_line_chunks(path, chunk_lines):
+        for line in chunk:
+            record = parse_line(line)
+            if record is not None and validate(record, require_answer) is None:
+                yield record
+
+
+def normalize_jsonl(input_path: str, output_path: str, engine, min_len: int, max_len: int,
+                    cache_path: Optional[str] = LENGTH_CACHE_PATH, chunk_lines: int = CHUNK_LINES,
+                    compression: Optional[str] = None, shard_size: Optional[int] = None,
+                    require_answer: bool = False) -> Dict[str, Any]:
+    """
+    Parse, validate, length-filter and write `input_path` to `output_path` in one pass.
+    engine: a tokenize_norm.TokenLengthEngine. cache_path: token-length sidecar (None = no cache).
+    Returns line / drop counts and the LengthIndex of the valid samples.
+    """
+    dropped: Counter = Counter()
+    lengths = array("i")
+    n_lines = 0
+
+    def count(texts):
+        # Chunks are already batch-sized; the fast tokenizer parallelizes each batch encode itself
+        return engine.lengths(texts, mode="single")
+
+    cache = TokenLengthCache(cache_path, tokenizer_id(engine.tokenizer)) if cache_path else None
+    try:
+        with DatasetWriter(output_path, compression=compression, shard_size=shard_size) as writer:
+            for chunk in iter_line_chunks(input_path, chunk_lines):
+                n_lines += len(chunk)
+                records = []
+                for line in chunk:
+                    record = parse_line(line)
+                    reason = "unparseable" if record is None else validate(record, require_answer)
+                    if reason:
+                        dropped[reason] += 1
+                    else:
+                        records.append(record)
+                if not records:
+                    continue
+                texts = [sample_text(r) for r in records]
+                chunk_lengths = cache.lengths(texts, count) if cache else count(texts)
+                lengths.extend(chunk_lengths.tolist())
+                for record, n in zip(records, chunk_lengths):
+                    if n < min_len:
+                        dropped["too short"] += 1
+                    elif n > max_len:
+                        dropped["too long"] += 1
+                    else:
+                        writer.write_line(dumps_line(record))
+    finally:
+        if cache:
+            print(f"Token-length cache: {cache.hits} hits, {cache.misses} tokenized ({cache_path})")
+            cache.close()
+    return {"lines": n_lines, "kept": writer.written, "dropped": dict(dropped),
+            "paths": writer.paths, "index": LengthIndex(lengths)}
+
+
+def print_report(result: Dict[str, Any], min_len: int, max_len: int, hist: bool = False) -> None:
+    index = result["index"]
+    if len(index):
+        stats = index.summary()
+        print(f"Total Tokens: {stats['total']}")
+        print(f"Average token length: {int(stats['mean'])}")
+        print(f"Max token length: {stats['max']}")
+        print(f"Min token length: {stats['min']}")
+        print(f"p50/p90/p95/p99: {stats['p50']:.0f} / {stats['p90']:.0f} / {stats['p95']:.0f} / {stats['p99']:.0f}")
+        if hist:
+            index.print_histogram()
+    print(f"Keeping {result['kept']}/{result['lines']} samples with {min_len} <= tokens <= {max_len}")
+    for reason, n in sorted(result["dropped"].items(), key=lambda t: -t[1]):
+        print(f"  dropped {n:>8}  {reason}")
+
+
+def main():
+    from tokenize_norm import DEFAULT_QWEN_MODEL, TokenLengthEngine
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", default=INPUT_JSONL, help="Training jsonl from preprocess_data.py")
+    parser.add_argument("--output", default=OUTPUT_JSONL, help="Normalised jsonl for finetuning")
+    parser.add_argument("--model", default=DEFAULT_QWEN_MODEL, help="Tokenizer to count tokens with")
+    parser.add_argument("--min-len", type=int, default=200, help="Keep samples with at least this many tokens")
+    parser.add_argument("--max-len", type=int, default=4096, help="Keep samples with at most this many tokens")
+    parser.add_argument("--length-cache", default=LENGTH_CACHE_PATH,
+                        help="Token-length sidecar ('' re-tokenizes everything)")
+    parser.add_argument("--chunk-lines", type=int, default=CHUNK_LINES, help="Lines per streaming step")
+    parser.add_argument("--compression", default=None, choices=["gzip", "zstd"], help="Compress the output")
+    parser.add_argument("--require-answer", action="store_true",
+                        help="Drop records without a non-empty assistant answer")
+    parser.add_argument("--hist", action="store_true", help="Print a token-length histogram")
+    args = parser.parse_args()
+
+    engine = TokenLengthEngine(args.model)
+    t0 = time.perf_counter()
+    result = normalize_jsonl(args.input, args.output, engine, args.min_len, args.max_len,
+                             cache_path=args.length_cache or None, chunk_lines=args.chunk_lines,
+                             compression=args.compression, require_answer=args.require_answer)
+    dt = time.perf_counter() - t0
+    print_report(result, args.min_len, args.max_len, hist=args.hist)
+    print(f"{result['lines'] / max(dt, 1e-9):.0f} lines/s ({'orjson' if orjson is not None else 'json'})")
+    print(f"✅ Normalised dataset written to {', '.join(result['paths'])}")
+
+
+if __name__ == "__main__":
+    main()
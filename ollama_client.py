@@ -0,0 +1,654 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared HTTP client layer for the Ollama / OpenAI-compatible endpoints.
+
+Every script talks to the inference server through one pooled `requests.Session`
+so TCP connections are kept alive and reused instead of re-opened per request.
+
+Requests can also go through a `ClientPolicy`, which replaces fixed sleeps and
+flat retries with:
+- a token-bucket rate limiter (requests/second with a burst allowance),
+- exponential backoff with full jitter on 429 / 5xx / timeouts / connection errors,
+- a circuit breaker with an adaptive concurrency limit (AIMD on observed latency).
+
+Usage:
+    from ollama_client import get_session, connection_stats, ClientPolicy, post_json
+
+    resp = get_session().post(url, json=payload, timeout=120)
+    print(connection_stats())
+
+    policy = ClientPolicy(rate=8.0, burst=16, max_concurrency=8)
+    data = post_json(url, payload, timeout=120, policy=policy)
+
+    # Server-sent events, with time-to-first-token / tokens-per-second metrics
+    data = stream_chat(url, payload, timeout=120, policy=policy, max_words=30)
+    print(data["metrics"])
+
+    # Several servers behind one client-side balancer (pass it wherever a url goes)
+    pool = EndpointPool([url_a, url_b], strategy="least_outstanding")
+    pool.start_health_checks(interval=10)
+    data = post_json(pool, payload, timeout=120, policy=policy)
+"""
+
+import json
+import random
+import threading
+import time
+from typing import Callable, Dict, Any, List, Optional, Union
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# ======== POOL CONFIG ========
+# Number of distinct hosts whose connection pools are cached
+POOL_CONNECTIONS = 4
+# Max keep-alive connections kept open per host (per-host limit)
+POOL_MAXSIZE = 16
+# If True, callers wait for a free connection instead of opening extra
+# throw-away connections once POOL_MAXSIZE is reached
+POOL_BLOCK = True
+# ==============================
+
+# ======== POLICY DEFAULTS ========
+RATE_PER_SEC = 10.0          # token-bucket refill rate (None = unlimited)
+RATE_BURST = 20              # token-bucket capacity
+MAX_RETRIES = 4              # retries after the first attempt
+BACKOFF_BASE = 0.5           # seconds; delay ~ U(0, min(cap, base * 2**attempt))
+BACKOFF_CAP = 30.0
+TARGET_LATENCY = 30.0        # seconds; slower responses shrink the concurrency limit
+BREAKER_FAILURES = 5         # consecutive failures that open the circuit
+BREAKER_COOLDOWN = 30.0      # seconds the circuit stays open before a probe
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# =================================
+
+# ======== BALANCER DEFAULTS ========
+EJECT_AFTER_FAILURES = 3     # consecutive failures before a backend is ejected
+EJECT_SECONDS = 30.0         # minimum time an ejected backend sits out
+HEALTH_PATH = "/v1/models"   # probed on the backend's host to re-admit it
+HEALTH_TIMEOUT = 5.0
+LATENCY_EWMA_ALPHA = 0.3
+# ===================================
+
+_session: requests.Session | None = None
+_session_lock = threading.Lock()
+
+
+def build_session(pool_connections: int = POOL_CONNECTIONS,
+                  pool_maxsize: int = POOL_MAXSIZE,
+                  pool_block: bool = POOL_BLOCK) -> requests.Session:
+    """
+    Build a new keep-alive session with a tuned connection pool.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        pool_block=pool_block,
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"Connection": "keep-alive"})
+    return session
+
+
+def get_session() -> requests.Session:
+    """
+    Return the process-wide shared session, creating it on first use.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = build_session()
+    return _session
+
+
+def configure_pool(pool_connections: int = POOL_CONNECTIONS,
+                   pool_maxsize: int = POOL_MAXSIZE,
+                   pool_block: bool = POOL_BLOCK) -> requests.Session:
+    """
+    Replace the shared session with one using different pool limits.
+    Call this before starting worker threads (e.g. to match CONCURRENCY).
+    """
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = build_session(pool_connections, pool_maxsize, pool_block)
+    return _session
+
+
+def connection_stats(session: requests.Session | None = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Per-host connection reuse statistics from the underlying urllib3 pools.
+
+    Returns {"host:port": {"requests": N, "connections": M, "reused": N - M, "reuse_ratio": ...}}
+    """
+    session = session or _session
+    stats: Dict[str, Dict[str, Any]] = {}
+    if session is None:
+        return stats
+    seen = set()
+    for adapter in session.adapters.values():
+        if id(adapter) in seen:
+            continue
+        seen.add(id(adapter))
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            n_req = pool.num_requests
+            n_conn = pool.num_connections
+            stats[f"{pool.host}:{pool.port}"] = {
+                "requests": n_req,
+                "connections": n_conn,
+                "reused": max(0, n_req - n_conn),
+                "reuse_ratio": (max(0, n_req - n_conn) / n_req) if n_req else 0.0,
+            }
+    return stats
+
+
+def print_connection_stats(session: requests.Session | None = None) -> None:
+    for host, s in connection_stats(session).items():
+        print(f"🔌 {host}: {s['requests']} requests over {s['connections']} connections "
+              f"(reused {s['reused']}, {s['reuse_ratio']:.0%})")
+
+
+# ------------- Client policy -------------
+class TokenBucket:
+    """
+    Blocking token-bucket rate limiter shared by all worker threads.
+    """
+
+    def __init__(self, rate: Optional[float] = RATE_PER_SEC, burst: int = RATE_BURST):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class AdaptiveLimiter:
+    """
+    Circuit breaker + adaptive concurrency limit.
+
+    - The in-flight limit grows by one after each fast success (latency below
+      TARGET_LATENCY) and halves on a slow response, a retryable error or 429.
+    - After `failures` consecutive failures the circuit opens: new calls wait
+      until `cooldown` has passed, then a single probe is let through
+      (half-open). A successful probe closes the circuit again.
+    """
+
+    def __init__(self, max_concurrency: int = 8, min_concurrency: int = 1,
+                 target_latency: float = TARGET_LATENCY,
+                 failures: int = BREAKER_FAILURES, cooldown: float = BREAKER_COOLDOWN):
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.limit = float(self.max_concurrency)
+        self.target_latency = target_latency
+        self.failure_threshold = failures
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+        self._cond = threading.Condition()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def acquire(self, timeout: Optional[float] = None) -> None:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                state = self.state
+                if state == "closed" and self.in_flight < int(self.limit):
+                    break
+                if state == "half-open" and not self.probing and self.in_flight == 0:
+                    self.probing = True
+                    break
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise CircuitOpenError(f"circuit {state}, limit={int(self.limit)}")
+                wait = 0.5 if state != "closed" else None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    wait = remaining if wait is None else min(wait, remaining)
+                self._cond.wait(wait)
+            self.in_flight += 1
+
+    def release(self, latency: Optional[float], ok: bool) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            if ok:
+                self.consecutive_failures = 0
+                if self.opened_at is not None:
+                    self.opened_at = None
+                    self.probing = False
+                    self.limit = float(self.min_concurrency)
+                elif latency is not None and latency > self.target_latency:
+                    self.limit = max(self.min_concurrency, self.limit / 2)
+                else:
+                    self.limit = min(self.max_concurrency, self.limit + 1)
+            else:
+                self.consecutive_failures += 1
+                self.limit = max(self.min_concurrency, self.limit / 2)
+                if self.probing or self.consecutive_failures >= self.failure_threshold:
+                    self.opened_at = time.monotonic()
+                    self.probing = False
+            self._cond.notify_all()
+
+
+def release_on_close(resp: requests.Response, release: Callable[[], None]) -> None:
+    """
+    Run `release` once, when a streamed response is closed (its body consumed or
+    abandoned), so slots held for the request cover the whole generation.
+    """
+    close = resp.close
+    lock = threading.Lock()
+    pending = [True]
+
+    def close_and_release():
+        try:
+            close()
+        finally:
+            with lock:
+                run, pending[0] = pending[0], False
+            if run:
+                release()
+
+    resp.close = close_and_release
+
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE, cap: float = BACKOFF_CAP) -> float:
+    """
+    Exponential backoff with full jitter.
+    """
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def _retry_after(resp: Optional[requests.Response]) -> Optional[float]:
+    if resp is None:
+        return None
+    value = resp.headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class ClientPolicy:
+    """
+    Bundles the rate limiter, retry/backoff settings and adaptive limiter.
+    One instance is shared by every worker of a batch run.
+    """
+
+    def __init__(self, rate: Optional[float] = RATE_PER_SEC, burst: int = RATE_BURST,
+                 max_retries: int = MAX_RETRIES, backoff_base: float = BACKOFF_BASE,
+                 backoff_cap: float = BACKOFF_CAP, max_concurrency: int = 8,
+                 target_latency: float = TARGET_LATENCY,
+                 breaker_failures: int = BREAKER_FAILURES, breaker_cooldown: float = BREAKER_COOLDOWN):
+        self.bucket = TokenBucket(rate, burst)
+        self.limiter = AdaptiveLimiter(max_concurrency=max_concurrency, target_latency=target_latency,
+                                       failures=breaker_failures, cooldown=breaker_cooldown)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.retries = 0
+
+    def call(self, fn, stream: bool = False):
+        """
+        Run `fn()` (which performs one HTTP call and returns a Response) under the
+        policy. Retries retryable failures; re-raises the last error otherwise.
+        stream=True: the limiter slot is held, and the latency measured, until the
+        caller closes the response, not just until its headers arrive.
+        """
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            self.limiter.acquire()
+            start = time.monotonic()
+            resp = None
+            try:
+                resp = fn()
+                if resp.status_code in RETRY_STATUS:
+                    resp.raise_for_status()
+            except (requests.Timeout, requests.ConnectionError, requests.HTTPError) as e:
+                if resp is not None:
+                    # Frees the pooled connection (and a balancer slot held until close)
+                    resp.close()
+                self.limiter.release(time.monotonic() - start, ok=False)
+                status = getattr(getattr(e, "response", None), "status_code", None)
+                retryable = status is None or status in RETRY_STATUS
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                delay = _retry_after(resp) or backoff_delay(attempt, self.backoff_base, self.backoff_cap)
+                attempt += 1
+                self.retries += 1
+                time.sleep(delay)
+                continue
+            except Exception:
+                self.limiter.release(time.monotonic() - start, ok=False)
+                raise
+            if stream:
+                release_on_close(resp, lambda: self.limiter.release(time.monotonic() - start, ok=True))
+            else:
+                self.limiter.release(time.monotonic() - start, ok=True)
+            return resp
+
+
+def _sender(url: Union[str, "EndpointPool"], **kwargs) -> Callable[[], requests.Response]:
+    """
+    One-attempt POST: straight to `url`, or through the balancer so that every
+    retry can land on a different backend.
+    """
+    if isinstance(url, EndpointPool):
+        return lambda: url.post(**kwargs)
+    return lambda: get_session().post(url, **kwargs)
+
+
+def post_json(url: Union[str, "EndpointPool"], payload: Dict[str, Any], timeout: float = 120,
+              policy: Optional[ClientPolicy] = None,
+              headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """
+    POST a JSON payload through the shared session (and policy, if given) and
+    return the decoded JSON body. Non-retryable HTTP errors raise immediately.
+    `url` may be an EndpointPool to spread requests over several servers.
+    """
+    headers = headers or {"Content-Type": "application/json"}
+    send = _sender(url, headers=headers, json=payload, timeout=timeout)
+
+    resp = policy.call(send) if policy is not None else send()
+    resp.raise_for_status()
+    return resp.json()
+
+
+# ------------- Streaming (SSE) -------------
+def stream_chat(url: Union[str, "EndpointPool"], payload: Dict[str, Any], timeout: float = 120,
+                policy: Optional[ClientPolicy] = None,
+                max_words: Optional[int] = None, max_chars: Optional[int] = None,
+                stop_when: Optional[Callable[[str], bool]] = None) -> Dict[str, Any]:
+    """
+    Send a chat completion with `stream: true` and consume the SSE chunks.
+
+    Generation is cut short (and the connection closed, which frees the server
+    slot) as soon as the accumulated text exceeds `max_words` / `max_chars` or
+    `stop_when(text)` returns True; the text is then trimmed to the cap.
+
+    Returns a response shaped like the non-streaming API
+    ({"choices": [{"message": {"content": ...}, "finish_reason": ...}]}) plus
+    "metrics": {"ttft_s", "latency_s", "completion_tokens", "tokens_per_s", "early_stop"}.
+    """
+    payload = {**payload, "stream": True, "stream_options": {"include_usage": True}}
+    headers = {"Content-Type": "application/json", "Accept": "text/event-stream"}
+
+    send = _sender(url, headers=headers, json=payload, timeout=timeout, stream=True)
+
+    start = time.monotonic()
+    resp = policy.call(send, stream=True) if policy is not None else send()
+
+    parts = []
+    n_chunks = 0
+    usage = None
+    finish_reason = None
+    first_token_at = None
+    early_stop = False
+    # Closing the response also releases the balancer / limiter slots held for the stream
+    try:
+        resp.raise_for_status()
+        for raw in resp.iter_lines():
+            if not raw or not raw.startswith(b"data:"):
+                continue
+            data = raw[5:].strip()
+            if data == b"[DONE]":
+                break
+            event = json.loads(data.decode("utf-8"))
+            if event.get("usage"):
+                usage = event["usage"]
+            for choice in event.get("choices") or []:
+                delta = (choice.get("delta") or {}).get("content")
+                if delta:
+                    if first_token_at is None:
+                        first_token_at = time.monotonic()
+                    parts.append(delta)
+                    n_chunks += 1
+                if choice.get("finish_reason"):
+                    finish_reason = choice["finish_reason"]
+            if parts and (max_words or max_chars or stop_when):
+                text = "".join(parts)
+                if ((max_words and len(text.split()) > max_words)
+                        or (max_chars and len(text) > max_chars)
+                        or (stop_when and stop_when(text))):
+                    early_stop = True
+                    break
+    finally:
+        resp.close()
+
+    end = time.monotonic()
+    text = "".join(parts)
+    if early_stop:
+        finish_reason = "length_cap"
+        if max_words and len(text.split()) > max_words:
+            text = " ".join(text.split()[:max_words])
+        if max_chars and len(text) > max_chars:
+            text = text[:max_chars]
+
+    completion_tokens = (usage or {}).get("completion_tokens") or n_chunks
+    gen_time = end - first_token_at if first_token_at is not None else 0.0
+    metrics = {
+        "ttft_s": (first_token_at - start) if first_token_at is not None else None,
+        "latency_s": end - start,
+        "completion_tokens": completion_tokens,
+        "tokens_per_s": (completion_tokens / gen_time) if gen_time > 0 else None,
+        "early_stop": early_stop,
+    }
+    out = {
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                     "finish_reason": finish_reason}],
+        "metrics": metrics,
+    }
+    if usage:
+        out["usage"] = usage
+    return out
+
+
+# ------------- Multi-endpoint balancing -------------
+class Backend:
+    """
+    Book-keeping for one inference server inside an EndpointPool.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        parts = urlsplit(url)
+        self.base_url = f"{parts.scheme}://{parts.netloc}"
+        self.outstanding = 0
+        self.ewma_latency: Optional[float] = None
+        self.consecutive_failures = 0
+        self.ejected_until: Optional[float] = None
+        self.requests = 0
+        self.failures = 0
+        self.ejections = 0
+
+    @property
+    def ejected(self) -> bool:
+        return self.ejected_until is not None
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "outstanding": self.outstanding,
+            "ewma_latency_s": self.ewma_latency,
+            "requests": self.requests,
+            "failures": self.failures,
+            "ejections": self.ejections,
+            "ejected": self.ejected,
+        }
+
+
+class EndpointPool:
+    """
+    Client-side load balancer over several OpenAI-compatible endpoints.
+
+    Strategies:
+    - "least_outstanding": fewest in-flight requests, ties broken by lower latency
+    - "latency":           lowest expected wait, (outstanding + 1) * EWMA latency
+
+    A backend with `eject_after` consecutive failures (connection errors,
+    timeouts, 429/5xx) is ejected. It is re-admitted when a health probe
+    (GET base_url + health_path) succeeds, or, without a health-check thread,
+    on probation once `eject_seconds` have passed. If every backend is ejected
+    the one due back soonest is used rather than failing outright.
+    """
+
+    def __init__(self, urls: List[str], strategy: str = "least_outstanding",
+                 eject_after: int = EJECT_AFTER_FAILURES, eject_seconds: float = EJECT_SECONDS,
+                 health_path: str = HEALTH_PATH, health_timeout: float = HEALTH_TIMEOUT):
+        if not urls:
+            raise ValueError("EndpointPool needs at least one URL")
+        if strategy not in ("least_outstanding", "latency"):
+            raise ValueError(f"Unknown strategy {strategy}")
+        self.backends = [Backend(u) for u in urls]
+        self.strategy = strategy
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.health_path = health_path
+        self.health_timeout = health_timeout
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._health_thread: Optional[threading.Thread] = None
+
+    # ---- routing ----
+    def _score(self, b: Backend):
+        latency = b.ewma_latency if b.ewma_latency is not None else 0.0
+        if self.strategy == "latency":
+            return ((b.outstanding + 1) * latency, b.outstanding)
+        return (b.outstanding, latency)
+
+    def acquire(self) -> Backend:
+        with self._lock:
+            now = time.monotonic()
+            candidates = [b for b in self.backends
+                          if b.ejected_until is None or (not self._health_running() and now >= b.ejected_until)]
+            if not candidates:
+                candidates = [min(self.backends, key=lambda b: b.ejected_until)]
+            backend = min(candidates, key=self._score)
+            backend.outstanding += 1
+            backend.requests += 1
+            return backend
+
+    def release(self, backend: Backend, latency: Optional[float], ok: bool) -> None:
+        with self._lock:
+            backend.outstanding -= 1
+            if ok:
+                backend.consecutive_failures = 0
+                backend.ejected_until = None
+                if latency is not None:
+                    backend.ewma_latency = latency if backend.ewma_latency is None else (
+                        LATENCY_EWMA_ALPHA * latency + (1 - LATENCY_EWMA_ALPHA) * backend.ewma_latency)
+            else:
+                backend.failures += 1
+                backend.consecutive_failures += 1
+                if backend.consecutive_failures >= self.eject_after:
+                    if backend.ejected_until is None:
+                        backend.ejections += 1
+                    backend.ejected_until = time.monotonic() + self.eject_seconds
+
+    def post(self, **kwargs) -> requests.Response:
+        """
+        One POST to the best backend; the backend's URL replaces the `url` argument.
+        With stream=True the backend stays outstanding until the response is closed.
+        """
+        backend = self.acquire()
+        start = time.monotonic()
+        try:
+            resp = get_session().post(backend.url, **kwargs)
+        except requests.RequestException:
+            self.release(backend, None, ok=False)
+            raise
+        ok = resp.status_code not in RETRY_STATUS
+        if kwargs.get("stream"):
+            release_on_close(resp, lambda: self.release(backend, time.monotonic() - start, ok=ok))
+        else:
+            self.release(backend, time.monotonic() - start, ok=ok)
+        return resp
+
+    # ---- health checks ----
+    def _health_running(self) -> bool:
+        return self._health_thread is not None and self._health_thread.is_alive()
+
+    def probe(self, backend: Backend) -> bool:
+        try:
+            resp = get_session().get(backend.base_url + self.health_path, timeout=self.health_timeout)
+            return resp.status_code == 200
+        except requests.RequestException:
+            return False
+
+    def health_check(self) -> None:
+        """
+        Probe ejected backends whose sit-out period is over and re-admit the healthy ones.
+        """
+        now = time.monotonic()
+        with self._lock:
+            due = [b for b in self.backends if b.ejected_until is not None and now >= b.ejected_until]
+        for b in due:
+            healthy = self.probe(b)
+            with self._lock:
+                if healthy:
+                    b.ejected_until = None
+                    b.consecutive_failures = 0
+                else:
+                    b.ejected_until = time.monotonic() + self.eject_seconds
+
+    def start_health_checks(self, interval: float = 10.0) -> None:
+        if self._health_running():
+            return
+        self._stop.clear()
+
+        def loop():
+            while not self._stop.wait(interval):
+                self.health_check()
+
+        self._health_thread = threading.Thread(target=loop, name="endpoint-health", daemon=True)
+        self._health_thread.start()
+
+    def stop_health_checks(self) -> None:
+        self._stop.set()
+        if self._health_thread is not None:
+            self._health_thread.join()
+            self._health_thread = None
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [b.as_dict() for b in self.backends]
+
+    def print_stats(self) -> None:
+        for b in self.stats():
+            latency = f"{b['ewma_latency_s']:.2f}s" if b["ewma_latency_s"] is not None else "n/a"
+            print(f"🖥️ {b['url']}: {b['requests']} requests, {b['failures']} failures, "
+                  f"{b['ejections']} ejections, ewma latency {latency}{' (ejected)' if b['ejected'] else ''}")
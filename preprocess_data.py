@@ -1,8 +1,44 @@
-import pandas as pd
 from bs4 import BeautifulSoup
-import json
+from concurrent.futures import ProcessPoolExecutor
+import argparse
 import os
 import pdb
+import random
+import time
+
+from batch_io import DatasetWriter
+from excel_cache import EXCEL_CACHE_DIR, read_excel_cached
+from near_dedup import Deduplicator, MinHashLSH, content_hash
+
+# ---- Input ----
+USE_EXCEL_CACHE = True       # convert each xlsx once to Arrow and memory-map it on later runs
+SOURCE_COLUMNS = ["title", "lead", "content"]
+
+# ---- Output ----
+OUT_JSONL = "./train_data_16_10_2025.jsonl"
+OUT_COMPRESSION = None       # None | "gzip" | "zstd"
+OUT_SHARD_SIZE = None        # records per shard file; None = one file
+
+# ---- Dedup ----
+DEDUP = False                # drop exact / near-duplicate articles (MinHash + LSH over cleaned content); --dedup
+DEDUP_THRESHOLD = 0.8        # estimated Jaccard over 5-word shingles
+DEDUP_INDEX_PATH = "./.dedup_index.npz"   # kept across runs so new exports are checked against old ones
+DEDUP_INDEX_MAX = 500_000    # articles kept in the persisted index (those seen in the run always stay)
+DEDUP_REPORT = "./dedup_report.csv"
+
+# ---- HTML cleaning ----
+CLEAN_BACKEND = "bs4"        # "bs4" (reference, html.parser) | "lxml" | "selectolax"
+CLEAN_WORKERS = 0            # 0 = auto (all cores above PARALLEL_MIN_ROWS), 1 = single process
+CLEAN_CHUNKSIZE = 64         # articles per task sent to a worker process
+PARALLEL_MIN_ROWS = 2000
+PARITY_CHECK_ROWS = 200      # random rows compared against the bs4 cleaner before using a faster backend
+
+DROP_TAGS = ["script", "style", "figure", "div"]
+
+
+def _join_lines(text):
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    return "\n".join(lines)
 
 
 def clean_content(html_content):
@@ -10,15 +46,129 @@ def clean_content(html_content):
     Clean all the html form from content.
     """
     soup = BeautifulSoup(html_content, "html.parser")
-    for tag in soup(["script", "style", "figure", "div"]):
+    for tag in soup(DROP_TAGS):
         tag.decompose()
     # pdb.set_trace()
     text = soup.get_text(separator="\n")
     
-    lines = [line.strip() for line in text.splitlines() if line.strip()]
-    clean_text = "\n".join(lines)
-    
-    return clean_text
+    return _join_lines(text)
+
+
+def _lxml_texts(el):
+    """Text nodes under `el` in document order, one piece per node (as bs4 strings)."""
+    # Comments / processing instructions have a non-str tag; <template> content is not text in bs4
+    if isinstance(el.tag, str) and el.tag not in DROP_TAGS and el.tag != "template":
+        if el.text:
+            yield el.text
+        for child in el:
+            yield from _lxml_texts(child)
+            if child.tail:
+                yield child.tail
+
+
+def clean_content_lxml(html_content):
+    """
+    clean_content parsed with lxml (libxml2). Text nodes are collected one by one
+    so dropped tags still separate the text around them. Known differences from
+    bs4: CDATA sections (dropped by libxml2, kept as text by html.parser) and
+    misnested markup (e.g. a block inside <p>), which libxml2 repairs and
+    html.parser keeps as written.
+    """
+    import lxml.etree
+    import lxml.html
+
+    try:
+        root = lxml.html.document_fromstring(html_content)
+    except lxml.etree.ParserError:    # empty / whitespace-only document
+        return ""
+    return _join_lines("\n".join(_lxml_texts(root)))
+
+
+def clean_content_selectolax(html_content):
+    """
+    clean_content parsed with selectolax (lexbor). The content is parsed in body
+    context, so <title> / <noscript> text stays in place instead of being moved
+    to <head>. Known differences from bs4: CDATA sections (parsed as comments)
+    and misnested markup, which the HTML5 parser repairs (e.g. text directly in
+    <table> is moved before it).
+    """
+    from selectolax.lexbor import LexborHTMLParser
+
+    tree = LexborHTMLParser("<body>" + html_content)
+    for tag in DROP_TAGS:
+        for node in tree.css(tag):
+            node.decompose()
+    root = tree.root
+    if root is None:
+        return ""
+    return _join_lines(root.text(separator="\n"))
+
+
+CLEANERS = {
+    "bs4": clean_content,
+    "lxml": clean_content_lxml,
+    "selectolax": clean_content_selectolax,
+}
+
+
+def _clean_chunk(args):
+    contents, backend = args
+    cleaner = CLEANERS[backend]
+    return [cleaner(c) for c in contents]
+
+
+def clean_contents(contents, backend=CLEAN_BACKEND, workers=CLEAN_WORKERS, chunksize=CLEAN_CHUNKSIZE):
+    """
+    Clean a list of html contents, in worker processes for large inputs.
+    Output order matches the input.
+    """
+    if backend not in CLEANERS:
+        raise ValueError(f"Unknown clean backend {backend}")
+    n = len(contents)
+    if workers == 0:
+        workers = (os.cpu_count() or 1) if n >= PARALLEL_MIN_ROWS else 1
+    if workers <= 1 or n <= chunksize:
+        return _clean_chunk((contents, backend))
+
+    chunks = [(contents[i:i + chunksize], backend) for i in range(0, n, chunksize)]
+    out = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for cleaned in pool.map(_clean_chunk, chunks):
+            out.extend(cleaned)
+    return out
+
+
+def check_clean_parity(contents, backend, limit=PARITY_CHECK_ROWS, seed=0):
+    """
+    Compare `backend` against clean_content on `limit` contents drawn at random
+    (not the first rows, which all come from the same export).
+    Returns the number of mismatching rows.
+    """
+    cleaner = CLEANERS[backend]
+    sample = random.Random(seed).sample(range(len(contents)), min(limit, len(contents)))
+    return sum(1 for i in sample if cleaner(contents[i]) != clean_content(contents[i]))
+
+
+def resolve_backend(contents, backend):
+    """
+    Use `backend` only if it is installed and matches clean_content on a sample;
+    otherwise fall back to the bs4 cleaner.
+    """
+    if backend == "bs4":
+        return backend
+    try:
+        bad = check_clean_parity(contents, backend)
+    except ImportError as e:
+        print(f"⚠️ Clean backend '{backend}' unavailable ({e}); using bs4")
+        return "bs4"
+    if bad:
+        print(f"⚠️ Clean backend '{backend}' differs from bs4 on {bad}/{min(len(contents), PARITY_CHECK_ROWS)} rows; using bs4")
+        return "bs4"
+    return backend
+
+
+def _rate(n, seconds, unit="rows"):
+    return f"{n} {unit} in {seconds:.2f}s ({n / max(seconds, 1e-9):.1f} {unit}/s)"
 
 def lead_title_prompt(lead, content):
     """
@@ -151,62 +301,113 @@ def general_instruction_prompt(instruction, output):
     return sharegpt_payload
     
     
-def append_jsonl(path, obj):
-    with open(path, "a", encoding="utf-8") as f:
-        f.write(json.dumps(obj, ensure_ascii=False) + "\n")
+def handle_categories(data_path, style, writer, dedup=None, backend=CLEAN_BACKEND, workers=CLEAN_WORKERS):
+    t0 = time.perf_counter()
+    df = read_excel_cached(data_path, columns=SOURCE_COLUMNS,
+                           cache_dir=EXCEL_CACHE_DIR if USE_EXCEL_CACHE else None)
+    t_read = time.perf_counter() - t0
 
-def handle_categories(data_path, style):
-    df = pd.read_excel(data_path)
+    leads = df["lead"].fillna("").astype(str).tolist()
+    contents = df["content"].fillna("").astype(str).tolist()
+    titles = df["title"].fillna("").astype(str).tolist()
 
-    n_ok, n_skip = 0, 0
-    for _, row in df.iterrows():
-        lead_val = str(row["lead"]) if pd.notna(row["lead"]) else ""
-        content_val = str(row["content"]) if pd.notna(row["content"]) else ""
-        title_val = str(row["title"]) if pd.notna(row["title"]) else ""
+    keep = [i for i, c in enumerate(contents) if c.strip()]
+    n_skip = len(contents) - len(keep)
+    to_clean = [contents[i] for i in keep]
 
-        if not content_val.strip():
-            n_skip += 1
-            continue
+    t0 = time.perf_counter()
+    backend = resolve_backend(to_clean, backend)
+    cleaned = clean_contents(to_clean, backend=backend, workers=workers)
+    t_clean = time.perf_counter() - t0
+    n_bytes = sum(len(c.encode("utf-8")) for c in to_clean)
 
-        content_clean = clean_content(content_val)
+    n_dup = 0
+    if dedup is not None:
+        t0 = time.perf_counter()
+        source = os.path.basename(data_path)
+        # Keyed by content, not row position: ids must stay stable across exports
+        hashes = [content_hash(c) for c in cleaned]
+        keep_mask = dedup.dedup(
+            hashes, cleaned,
+            meta=[{"source": source, "row": i, "style": style, "title": titles[i].strip()} for i in keep],
+            exact=hashes,
+        )
+        n_dup = keep_mask.count(False)
+        keep = [i for i, k in zip(keep, keep_mask) if k]
+        cleaned = [c for c, k in zip(cleaned, keep_mask) if k]
+        t_dedup = time.perf_counter() - t0
 
+    t0 = time.perf_counter()
+    n_ok = 0
+    for i, content_clean in zip(keep, cleaned):
         payload = multitask_instruction_prompt(
-            lead=lead_val.strip(),
+            lead=leads[i].strip(),
             content=content_clean,
-            title=title_val.strip(),
+            title=titles[i].strip(),
             style=style
         )
 
         # dump the whole multitask payload (title + lead) in one line
-        append_jsonl(out_jsonl, payload["title"])
-        append_jsonl(out_jsonl, payload["lead"])
+        writer.write(payload["title"])
+        writer.write(payload["lead"])
         n_ok += 1
-    print(f"Done. Wrote {n_ok} samples to {out_jsonl}. Skipped {n_skip} empty content rows.")
+    t_write = time.perf_counter() - t0
+
+    print(f"Done. Wrote {n_ok} samples from {data_path}. Skipped {n_skip} empty content rows, {n_dup} duplicates.")
+    print(f"  read : {_rate(len(df), t_read)}")
+    print(f"  clean: {_rate(len(to_clean), t_clean)}, {n_bytes / 1e6 / max(t_clean, 1e-9):.1f} MB/s [{backend}]")
+    if dedup is not None:
+        print(f"  dedup: {_rate(len(to_clean), t_dedup)}")
+    print(f"  write: {_rate(n_ok, t_write)}")
 
 if __name__ == "__main__":
-    out_jsonl = "./train_data_16_10_2025.jsonl"
-    if os.path.exists(out_jsonl):
-        os.remove(out_jsonl)
-    
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dedup", action="store_true", default=DEDUP,
+                        help="Drop exact / near-duplicate articles (changes which articles are kept)")
+    parser.add_argument("--dedup-index", default=DEDUP_INDEX_PATH, help="Persisted index ('' = this run only)")
+    parser.add_argument("--reset-dedup-index", action="store_true", help="Ignore the persisted index and start over")
+    parser.add_argument("--dedup-index-max", type=int, default=DEDUP_INDEX_MAX,
+                        help="Articles kept in the persisted index")
+    args = parser.parse_args()
 
-    # prepare lead/title prompt
+    dedup = None
+    if args.dedup:
+        if args.dedup_index and os.path.exists(args.dedup_index) and not args.reset_dedup_index:
+            index = MinHashLSH.load(args.dedup_index)
+            index.threshold = DEDUP_THRESHOLD
+        else:
+            index = MinHashLSH(threshold=DEDUP_THRESHOLD)
+        dedup = Deduplicator(index)
 
-    handle_categories("./doi song.xlsx", "đời sống")
-    handle_categories("./du lich.xlsx", "du lịch")
-    handle_categories("./KHCN.xlsx", "khoa học công nghệ")
-    
-    
-    
-    # prepare general instruction prompt
-    # with open("./ecommerce_alpaca_pretty.json", "r", encoding="utf8") as f:
-    #     ecommerce_data = json.load(f)
-    # count_instructions = 0
-    # for sample in ecommerce_data:
-    #     if "đoạn văn" in sample["instruction"].strip().lower():
-    #         sharegpt_sample = general_instruction_prompt(instruction=sample["instruction"], output=sample["output"])
-    #         # print(sharegpt_sample["title"]["messages"])
-    #         # print(sharegpt_sample["title"]["messages"])
-    #         # print("-----"*10)
-    #         append_jsonl(out_jsonl, sharegpt_sample)
-    #         count_instructions += 1
-    # print(f"Total general instructions: {count_instructions}")
\ No newline at end of file
+    # Shards are written to temp files and renamed into place once the whole build succeeds
+    with DatasetWriter(OUT_JSONL, compression=OUT_COMPRESSION, shard_size=OUT_SHARD_SIZE) as writer:
+
+        # prepare lead/title prompt
+
+        handle_categories("./doi song.xlsx", "đời sống", writer, dedup)
+        handle_categories("./du lich.xlsx", "du lịch", writer, dedup)
+        handle_categories("./KHCN.xlsx", "khoa học công nghệ", writer, dedup)
+        
+        
+        
+        # prepare general instruction prompt
+        # with open("./ecommerce_alpaca_pretty.json", "r", encoding="utf8") as f:
+        #     ecommerce_data = json.load(f)
+        # count_instructions = 0
+        # for sample in ecommerce_data:
+        #     if "đoạn văn" in sample["instruction"].strip().lower():
+        #         sharegpt_sample = general_instruction_prompt(instruction=sample["instruction"], output=sample["output"])
+        #         # print(sharegpt_sample["title"]["messages"])
+        #         # print(sharegpt_sample["title"]["messages"])
+        #         # print("-----"*10)
+        #         writer.write(sharegpt_sample)
+        #         count_instructions += 1
+        # print(f"Total general instructions: {count_instructions}")
+    print(f"Saved {writer.written} records to {', '.join(writer.paths)}")
+    if dedup is not None:
+        n_clusters = dedup.write_report(DEDUP_REPORT)
+        print(f"Dropped {len(dedup.dropped)} duplicates in {n_clusters} clusters -> {DEDUP_REPORT}")
+        if args.dedup_index:
+            index = dedup.compact(args.dedup_index_max)
+            index.save(args.dedup_index)
+            print(f"Dedup index: {len(index)} articles in {args.dedup_index}")
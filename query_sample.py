@@ -1,19 +1,26 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import requests
-import pandas as pd
-import time
+from batch_io import iter_csv_chunks
+from ollama_client import ClientPolicy, EndpointPool, post_json, print_connection_stats
 
 # === FIXED PARAMETERS ===
 INPUT_CSV = "/mnt/data/test_articles.csv"
 OUTPUT_CSV = "/mnt/data/out_articles_result.csv"
+# Rows read (and written) per chunk; memory is bounded by this, not the file size
+CHUNK_SIZE = 256
 
 ENDPOINT = "http://157.10.188.151:11434/v1/chat/completions"
+# Every server that serves MODEL; requests go to the one with the fewest in flight
+ENDPOINTS = [ENDPOINT]
 MODEL = "qwen3-8b-5k-quant-8-2:latest"
 TEMPERATURE = 0.7
 TOP_P = 0.9
 
+# Rate limit + jittered exponential backoff on 429/5xx/timeouts (replaces flat 3x sleep(2))
+POLICY = ClientPolicy(rate=5.0, burst=5, max_retries=3, max_concurrency=1)
+BALANCER = EndpointPool(ENDPOINTS, strategy="least_outstanding")
+
 # === PROMPT HELPERS ===
 def build_system_prompt(style: str, task: str) -> str:
     if task == "lead":
@@ -46,44 +53,47 @@ def chat_request(task: str, style: str, content: str, lead: str = None):
         "top_p": TOP_P
     }
 
-    for i in range(3):
-        try:
-            r = requests.post(ENDPOINT, json=payload, timeout=60)
-            r.raise_for_status()
-            data = r.json()
-            if "choices" in data and data["choices"]:
-                return data["choices"][0]["message"]["content"].strip()
-        except Exception as e:
-            print(f"⚠️ Retry {i+1}/3 due to: {e}")
-            time.sleep(2)
+    try:
+        data = post_json(BALANCER, payload, timeout=60, policy=POLICY)
+        if "choices" in data and data["choices"]:
+            return data["choices"][0]["message"]["content"].strip()
+    except Exception as e:
+        print(f"⚠️ Request failed after retries: {e}")
     return ""
 
 # === MAIN PROCESS ===
 def main():
-    df = pd.read_csv(INPUT_CSV)
-    if "type" not in df.columns:
-        df["type"] = "đời sống"
-
-    df["output_lead"] = ""
-    df["output_title"] = ""
-
-    for i, row in df.iterrows():
-        content = str(row["content"])
-        style = str(row["type"])
-        print(f"\n🟢 Processing row {i+1}/{len(df)} | style={style}")
-
-        # Generate lead
-        lead = chat_request("lead", style, content)
-        df.at[i, "output_lead"] = lead
-        print(" → Lead:", lead)
-
-        # Generate title
-        title = chat_request("title", style, content, lead)
-        df.at[i, "output_title"] = title
-        print(" → Title:", title)
-
-    df.to_csv(OUTPUT_CSV, index=False, encoding="utf-8-sig")
-    print(f"\n✅ Done. Saved to {OUTPUT_CSV}")
+    n_rows = 0
+    for chunk_no, df in enumerate(iter_csv_chunks(INPUT_CSV, chunksize=CHUNK_SIZE)):
+        if "type" not in df.columns:
+            df["type"] = "đời sống"
+
+        df["output_lead"] = ""
+        df["output_title"] = ""
+
+        for i, row in df.iterrows():
+            content = str(row["content"])
+            style = str(row["type"])
+            print(f"\n🟢 Processing row {i+1} | style={style}")
+
+            # Generate lead
+            lead = chat_request("lead", style, content)
+            df.at[i, "output_lead"] = lead
+            print(" → Lead:", lead)
+
+            # Generate title
+            title = chat_request("title", style, content, lead)
+            df.at[i, "output_title"] = title
+            print(" → Title:", title)
+
+        # Append each finished chunk; header only with the first one
+        df.to_csv(OUTPUT_CSV, index=False, encoding="utf-8-sig" if chunk_no == 0 else "utf-8",
+                  mode="w" if chunk_no == 0 else "a", header=chunk_no == 0)
+        n_rows += len(df)
+
+    print(f"\n✅ Done. Saved {n_rows} rows to {OUTPUT_CSV}")
+    print_connection_stats()
+    BALANCER.print_stats()
 
 if __name__ == "__main__":
     main()
@@ -1,14 +1,42 @@
 #!/usr/bin/env python3
+"""
+Build test_articles.csv from VNExpress articles.
+
+Articles are fetched concurrently over one keep-alive session (bounded pool, one
+connection per worker) with rate limiting and jittered backoff on 429 / 5xx /
+timeouts (ollama_client.ClientPolicy). Raw get_full responses are kept in an
+on-disk cache keyed by article_id, so rebuilding or extending the test set only
+fetches ids that were never seen.
+
+Usage:
+  python query_vne_sample.py --workers 16 --out test_articles.csv
+  python query_vne_sample.py --ids ids.json          # {"đời sống": ["4946014", ...], ...}
+  python query_vne_sample.py --base-url http://127.0.0.1:8000/ar/get_full   # local mock
+"""
+import argparse
+import json
+import os
 import requests
 import urllib.parse
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
 from tqdm import tqdm
-def get_article_data(article_id: int):
-    """
-    Fetch full article data from VNExpress GW API using the given article_id.
-    """
-    base_url = "https://gw.vnexpress.net/ar/get_full"
-    
+
+from ollama_client import ClientPolicy, build_session
+from response_cache import ResponseCache
+
+BASE_URL = os.getenv("VNE_API_BASE", "https://gw.vnexpress.net/ar/get_full")
+WORKERS = 16
+TIMEOUT = 10
+# Requests/second towards the GW API (token bucket), retries after the first attempt
+RATE_PER_SEC = 20.0
+MAX_RETRIES = 4
+ARTICLE_CACHE_PATH = "./.vne_cache.sqlite"
+
+
+def article_url(article_id: int, base_url: str = BASE_URL) -> str:
     # Define query parameters
     params = {
         "article_id": article_id,
@@ -27,11 +55,26 @@ def get_article_data(article_id: int):
     }
 
     # Compose final URL
-    url = f"{base_url}?article_id={article_id}&data_select={params['data_select']}&exclude_id={params['exclude_id']}&thumb_size={params['thumb_size']}&thumb_quality={params['thumb_quality']}&thumb_dpr={params['thumb_dpr']}&thumb_fit={params['thumb_fit']}"
+    return f"{base_url}?article_id={article_id}&data_select={params['data_select']}&exclude_id={params['exclude_id']}&thumb_size={params['thumb_size']}&thumb_quality={params['thumb_quality']}&thumb_dpr={params['thumb_dpr']}&thumb_fit={params['thumb_fit']}"
+
+
+def get_article_data(article_id: int, session: Optional[requests.Session] = None,
+                     policy: Optional[ClientPolicy] = None, base_url: str = BASE_URL,
+                     timeout: float = TIMEOUT):
+    """
+    Fetch full article data from VNExpress GW API using the given article_id.
+    """
+    url = article_url(article_id, base_url)
+    session = session or requests
+    send = lambda: session.get(url, timeout=timeout)
+
+    # Send request (retried with backoff when a policy is given)
+    try:
+        response = policy.call(send) if policy is not None else send()
+    except requests.RequestException as e:
+        print(f"Error: article {article_id}: {e}")
+        return None
 
-    # Send request
-    response = requests.get(url, timeout=10)
-    
     if response.status_code == 200:
         try:
             data = response.json()
@@ -43,6 +86,57 @@ def get_article_data(article_id: int):
         print(f"Error: HTTP {response.status_code}")
         return None
 
+
+class ArticleFetcher:
+    """
+    Concurrent get_full client with an article_id-keyed response cache.
+    Only responses carrying article data are cached, so failures are retried next run.
+    """
+
+    def __init__(self, workers: int = WORKERS, base_url: str = BASE_URL,
+                 cache_path: Optional[str] = ARTICLE_CACHE_PATH,
+                 rate: Optional[float] = RATE_PER_SEC, max_retries: int = MAX_RETRIES,
+                 timeout: float = TIMEOUT):
+        self.workers = max(1, workers)
+        self.base_url = base_url
+        self.timeout = timeout
+        # One keep-alive connection per worker; workers wait for a free one beyond that
+        self.session = build_session(pool_maxsize=self.workers, pool_block=True)
+        self.policy = ClientPolicy(rate=rate, burst=self.workers, max_retries=max_retries,
+                                   max_concurrency=self.workers)
+        self.cache = ResponseCache(cache_path or ":memory:", enabled=bool(cache_path))
+        self.fetched = 0
+        self.failed = 0
+
+    def get(self, article_id) -> Optional[Dict[str, Any]]:
+        key = str(article_id)
+        data = self.cache.get(key)
+        if data is not None:
+            return data
+        data = get_article_data(int(article_id), self.session, self.policy, self.base_url, self.timeout)
+        if data and "data" in data:
+            self.cache.put(key, data)
+            self.fetched += 1
+            return data
+        self.failed += 1
+        return None
+
+    def get_many(self, article_ids: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """Responses aligned with `article_ids` (None where the article could not be fetched)."""
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(tqdm(executor.map(self.get, article_ids), total=len(article_ids)))
+
+    def close(self) -> None:
+        self.cache.close()
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
 def strip_html_tags_regex(html_string):
     clean = re.compile('<.*?>')
     return re.sub(clean, '', html_string)
@@ -54,19 +148,46 @@ id_list_by_type = {
     "khcn": ["4934387", "4934403", "4935226", "4935205", "4934918", "4933963", "4934003", "4933925", "4932604", "4934068"],
 }
 
-def construct_test_file():
-    with open("test_articles.csv", "w", encoding="utf-8") as f:
+def construct_test_file(ids_by_type: Dict[str, List[str]] = id_list_by_type, out_path: str = "test_articles.csv",
+                        fetcher: Optional[ArticleFetcher] = None):
+    jobs = [(type_name, article_id) for type_name, id_list in ids_by_type.items() for article_id in id_list]
+    if fetcher is None:
+        # Own fetcher: close its session and cache even if fetching fails
+        with ArticleFetcher() as own:
+            results = own.get_many([article_id for _, article_id in jobs])
+    else:
+        results = fetcher.get_many([article_id for _, article_id in jobs])
+    with open(out_path, "w", encoding="utf-8") as f:
         f.write("no,type,id,title,lead,content\n")
         no = 1
-        for type_name, id_list in id_list_by_type.items():
-            for article_id in tqdm(id_list):
-                data = get_article_data(int(article_id))
-                if data and 'data' in data:
-                    title = data['data'].get('title', '').replace('"', '""')
-                    lead = data['data'].get('lead', '').replace('"', '""')
-                    content = repr(strip_html_tags_regex(data['data'].get('content', '')).replace('"', '""'))
-                    f.write(f'{no},{type_name},{article_id},"{title}","{lead}","{content}"\n')
-                    no += 1
+        for (type_name, article_id), data in zip(jobs, results):
+            if data and 'data' in data:
+                title = data['data'].get('title', '').replace('"', '""')
+                lead = data['data'].get('lead', '').replace('"', '""')
+                content = repr(strip_html_tags_regex(data['data'].get('content', '')).replace('"', '""'))
+                f.write(f'{no},{type_name},{article_id},"{title}","{lead}","{content}"\n')
+                no += 1
+    return no - 1
 
 if __name__ == "__main__":
-    construct_test_file()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ids", default=None, help='JSON file {"type": ["article_id", ...]} (default: id_list_by_type)')
+    parser.add_argument("--out", default="test_articles.csv", help="Output CSV")
+    parser.add_argument("--base-url", default=BASE_URL, help="get_full endpoint (point at a local mock for tests)")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Concurrent requests / pooled connections")
+    parser.add_argument("--rate", type=float, default=RATE_PER_SEC, help="Requests per second (0 = unlimited)")
+    parser.add_argument("--cache", default=ARTICLE_CACHE_PATH, help="Article cache ('' disables it)")
+    args = parser.parse_args()
+
+    ids_by_type = id_list_by_type
+    if args.ids:
+        with open(args.ids, "r", encoding="utf-8") as f:
+            ids_by_type = json.load(f)
+
+    t0 = time.perf_counter()
+    with ArticleFetcher(workers=args.workers, base_url=args.base_url, cache_path=args.cache or None,
+                        rate=args.rate or None) as fetcher:
+        n_rows = construct_test_file(ids_by_type, args.out, fetcher)
+        print(f"🗄️ Article cache: {fetcher.cache.hits} hits, {fetcher.fetched} fetched, {fetcher.failed} failed"
+              f" | 🔁 retries: {fetcher.policy.retries}")
+    print(f"✅ Saved {n_rows} articles to {args.out} in {time.perf_counter() - t0:.1f}s")
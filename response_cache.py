@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Content-addressed on-disk cache for chat completion responses.
+
+Responses are stored in a single SQLite file, keyed by a SHA-256 of every
+parameter that affects generation (model, prompts, sampling params, seed).
+Re-running a batch with an unchanged lead config therefore reuses the cached
+leads and only the changed calls (e.g. titles at a new temperature) hit the GPU.
+
+Usage:
+    cache = ResponseCache("./.response_cache.sqlite", max_bytes=2 * 1024**3, max_age_days=30)
+    key = cache_key(model, system_prompt, user_prompt, temperature, top_p, max_tokens, seed)
+    resp = cache.get(key)
+    if resp is None:
+        resp = post_chat(...)
+        cache.put(key, resp)
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, Any, Optional
+
+# Size eviction frees down to this fraction of max_bytes, so a full cache is not
+# walked again on every put
+EVICT_LOW_WATER = 0.9
+
+
+def cache_key(model: str, system_prompt: str, user_prompt: str,
+              temperature: float, top_p: float, max_tokens: int,
+              seed: Optional[int] = None) -> str:
+    """
+    Stable hash of everything that determines a generation.
+    """
+    blob = json.dumps(
+        [model, system_prompt, user_prompt, float(temperature), float(top_p), int(max_tokens), seed],
+        ensure_ascii=False, separators=(",", ":"),
+    )
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Thread-safe SQLite response store with size- and age-based eviction.
+
+    - max_bytes:    evict least-recently-used entries once stored payloads exceed this size
+                    (checked on every put, on open and on close)
+    - max_age_days: entries created longer ago than this are misses (and deleted) on get,
+                    and are purged on open and close
+    - enabled:      False turns every get() into a miss and every put() into a no-op (bypass)
+    """
+
+    def __init__(self, path: str, max_bytes: Optional[int] = None,
+                 max_age_days: Optional[float] = None, enabled: bool = True):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._total = 0    # stored payload bytes
+        if enabled:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " payload BLOB NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " created REAL NOT NULL,"
+                " accessed REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON responses(accessed)")
+            self._conn.commit()
+            self.evict()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            row = self._conn.execute("SELECT payload, size, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self._expired(row[2]):
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                self._total -= row[1]
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+
+    def put(self, key: str, response: Dict[str, Any]) -> None:
+        if not self.enabled:
+            return
+        payload = zlib.compress(json.dumps(response, ensure_ascii=False).encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, payload, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, payload, len(payload), now, now),
+            )
+            self._conn.commit()
+            self._total += len(payload) - (old[0] if old else 0)
+            over = self.max_bytes is not None and self._total > self.max_bytes
+        if over:
+            self.evict(target_bytes=int(self.max_bytes * EVICT_LOW_WATER))
+
+    def _expired(self, created: float) -> bool:
+        return self.max_age_days is not None and created < time.time() - self.max_age_days * 86400
+
+    def evict(self, target_bytes: Optional[int] = None) -> int:
+        """
+        Apply age and size limits; when over max_bytes, least recently used
+        entries are removed down to `target_bytes` (default max_bytes).
+        Returns the number of entries removed.
+        """
+        if not self.enabled:
+            return 0
+        removed = 0
+        with self._lock:
+            if self.max_age_days is not None:
+                cutoff = time.time() - self.max_age_days * 86400
+                removed += self._conn.execute("DELETE FROM responses WHERE created < ?", (cutoff,)).rowcount
+            if self.max_bytes is not None:
+                total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+                if total > self.max_bytes:
+                    # Walk entries from least recently used until we are under the limit
+                    excess = total - (self.max_bytes if target_bytes is None else target_bytes)
+                    victims = []
+                    for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed ASC"):
+                        if excess <= 0:
+                            break
+                        victims.append((key,))
+                        excess -= size
+                    self._conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+                    removed += len(victims)
+            self._conn.commit()
+            self._total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        return removed
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self.evict()
+            with self._lock:
+                self._conn.close()
+                self._conn = None
+            self.enabled = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
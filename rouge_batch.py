@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Batch ROUGE-2 / ROUGE-L (F1) over whole columns.
+
+Produces the same numbers as `rouge_score.RougeScorer(["rouge2", "rougeL"]).score(ref, hyp)`
+but much faster on large files:
+- every distinct text is tokenized once, with one tokenizer instance per process,
+  and mapped to integer token ids;
+- ROUGE-2 intersects bigram-id count arrays (NumPy) instead of Python Counters;
+- ROUGE-L uses a bit-parallel LCS (one big-integer pass per hypothesis token)
+  instead of the O(n*m) Python DP table;
+- large corpora are split across worker processes.
+
+Tokenizers:
+- "rouge": rouge-score's DefaultTokenizer (lowercase, keep [a-z0-9] only; optional
+  Porter stemmer). This is what evaluate_titles_leads.py reported so far.
+- "vi":    lowercase Unicode word tokens, so Vietnamese syllables keep their
+  diacritics instead of being split at every accented letter.
+
+Usage:
+    from rouge_batch import batch_rouge
+    r2_f, rl_f = batch_rouge(refs, hyps, use_stemmer=False)
+"""
+
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+# Corpora with more pairs than this are scored in worker processes
+PARALLEL_MIN_PAIRS = 20000
+
+_VI_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+# Same pattern as rouge_score.tokenize.NON_ALPHANUM_RE
+_NON_ALPHANUM_RE = re.compile(r"[^a-z0-9]+")
+
+
+def _make_tokenize(tokenizer: str, use_stemmer: bool):
+    if tokenizer == "rouge":
+        if not use_stemmer:
+            # Equivalent to rouge-score's tokenizer without a stemmer: after the
+            # substitution every non-empty piece is already a valid token
+            return lambda text: _NON_ALPHANUM_RE.sub(" ", text.lower()).split()
+        from rouge_score import tokenizers
+        return tokenizers.DefaultTokenizer(use_stemmer=use_stemmer).tokenize
+    if tokenizer == "vi":
+        return lambda text: _VI_TOKEN_RE.findall(text.lower())
+    raise ValueError(f"Unknown ROUGE tokenizer {tokenizer}")
+
+
+def _encode_corpus(texts: Sequence[str], tokenize) -> Tuple[List[np.ndarray], int]:
+    """
+    Tokenize each distinct text once and map tokens to dense int ids.
+    Returns (id arrays aligned with `texts`, vocabulary size).
+    """
+    vocab: Dict[str, int] = {}
+    cache: Dict[str, np.ndarray] = {}
+    out = []
+    for text in texts:
+        ids = cache.get(text)
+        if ids is None:
+            ids = np.array([vocab.setdefault(tok, len(vocab)) for tok in tokenize(text)], dtype=np.int64)
+            cache[text] = ids
+        out.append(ids)
+    return out, len(vocab)
+
+
+def _f1(overlap: float, hyp_total: int, ref_total: int) -> float:
+    precision = overlap / max(hyp_total, 1)
+    recall = overlap / max(ref_total, 1)
+    if precision + recall == 0:
+        return 0.0
+    return 2 * precision * recall / (precision + recall)
+
+
+def rouge2_f1(ref: np.ndarray, hyp: np.ndarray, vocab_size: int) -> float:
+    """
+    ROUGE-2 F1 from bigram-id count arrays (clipped counts, as in rouge-score).
+    """
+    if len(ref) < 2 or len(hyp) < 2:
+        return 0.0
+    ref_bi, ref_cnt = np.unique(ref[:-1] * vocab_size + ref[1:], return_counts=True)
+    hyp_bi, hyp_cnt = np.unique(hyp[:-1] * vocab_size + hyp[1:], return_counts=True)
+    _, ri, hi = np.intersect1d(ref_bi, hyp_bi, assume_unique=True, return_indices=True)
+    overlap = int(np.minimum(ref_cnt[ri], hyp_cnt[hi]).sum())
+    return _f1(overlap, len(hyp) - 1, len(ref) - 1)
+
+
+def lcs_length(ref: np.ndarray, hyp: np.ndarray) -> int:
+    """
+    Bit-parallel LCS length (Hyyrö 2004): one bit per reference position,
+    updated with a few big-integer operations per hypothesis token.
+    """
+    m = len(ref)
+    if m == 0 or len(hyp) == 0:
+        return 0
+    match: Dict[int, int] = {}
+    for i, tok in enumerate(ref.tolist()):
+        match[tok] = match.get(tok, 0) | (1 << i)
+    mask = (1 << m) - 1
+    v = mask
+    for tok in hyp.tolist():
+        u = v & match.get(tok, 0)
+        v = ((v + u) | (v - u)) & mask
+    return m - bin(v).count("1")
+
+
+def rougeL_f1(ref: np.ndarray, hyp: np.ndarray) -> float:
+    if len(ref) == 0 or len(hyp) == 0:
+        return 0.0
+    return _f1(lcs_length(ref, hyp), len(hyp), len(ref))
+
+
+def _score_chunk(args) -> Tuple[List[float], List[float]]:
+    refs, hyps, tokenizer, use_stemmer = args
+    tokenize = _make_tokenize(tokenizer, use_stemmer)
+    # One shared vocabulary so reference and hypothesis ids are comparable
+    ids, vocab_size = _encode_corpus(list(refs) + list(hyps), tokenize)
+    ref_ids, hyp_ids = ids[:len(refs)], ids[len(refs):]
+    r2 = [rouge2_f1(r, h, max(vocab_size, 1)) for r, h in zip(ref_ids, hyp_ids)]
+    rl = [rougeL_f1(r, h) for r, h in zip(ref_ids, hyp_ids)]
+    return r2, rl
+
+
+def batch_rouge(refs: Sequence[str], hyps: Sequence[str], use_stemmer: bool = False,
+                tokenizer: str = "rouge", workers: int = 0,
+                parallel_min_pairs: int = PARALLEL_MIN_PAIRS) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Per-row ROUGE-2 F1 and ROUGE-L F1 for aligned reference / hypothesis lists.
+
+    workers: 0 = automatic (multi-process only above `parallel_min_pairs`), 1 = single process.
+    """
+    if len(refs) != len(hyps):
+        raise ValueError(f"refs ({len(refs)}) and hyps ({len(hyps)}) differ in length")
+    n = len(refs)
+    if workers == 0:
+        workers = (os.cpu_count() or 1) if n >= parallel_min_pairs else 1
+    if workers <= 1 or n < 2:
+        r2, rl = _score_chunk((refs, hyps, tokenizer, use_stemmer))
+        return np.asarray(r2, dtype=np.float64), np.asarray(rl, dtype=np.float64)
+
+    step = -(-n // (workers * 4))
+    chunks = [(refs[i:i + step], hyps[i:i + step], tokenizer, use_stemmer) for i in range(0, n, step)]
+    r2_all: List[float] = []
+    rl_all: List[float] = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for r2, rl in pool.map(_score_chunk, chunks):
+            r2_all.extend(r2)
+            rl_all.extend(rl)
+    return np.asarray(r2_all, dtype=np.float64), np.asarray(rl_all, dtype=np.float64)
+
+
+def check_parity(refs: Sequence[str], hyps: Sequence[str], use_stemmer: bool = False,
+                 tokenizer: str = "rouge", lower: bool = False,
+                 limit: int = 200, atol: float = 1e-9) -> int:
+    """
+    Compare against rouge-score on the first `limit` pairs, with the same
+    tokenizer and lowercasing as the scored run. rouge-score has no Unicode
+    tokenizer, so for "vi" it is given ours and only the scoring is compared.
+    Returns the number of mismatching rows.
+    """
+    from rouge_score import rouge_scorer, tokenizers
+
+    class _Tokenizer(tokenizers.Tokenizer):
+        tokenize = staticmethod(_make_tokenize(tokenizer, use_stemmer))
+
+    reference = None if tokenizer == "rouge" else _Tokenizer()
+    scorer = rouge_scorer.RougeScorer(["rouge2", "rougeL"], use_stemmer=use_stemmer, tokenizer=reference)
+    refs, hyps = list(refs[:limit]), list(hyps[:limit])
+    if lower:
+        refs = [r.lower() for r in refs]
+        hyps = [h.lower() for h in hyps]
+    r2, rl = batch_rouge(refs, hyps, use_stemmer=use_stemmer, tokenizer=tokenizer, workers=1)
+    bad = 0
+    for i, (ref, hyp) in enumerate(zip(refs, hyps)):
+        s = scorer.score(ref, hyp)
+        if abs(s["rouge2"].fmeasure - r2[i]) > atol or abs(s["rougeL"].fmeasure - rl[i]) > atol:
+            bad += 1
+    return bad
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Sequence packing and length bucketing for SFT.
+
+Title samples are a few hundred tokens while lead samples carry the whole article,
+so padding every batch to its longest sample wastes most of the batch. Two fixes:
+- bucket: batches of similar length (the megabatch scheme of HF's
+  LengthGroupedSampler / group_by_length; LengthGroupedSampler here takes the
+  lengths precomputed instead of reading every row);
+- pack:   best-fit-decreasing bins of at most max_len tokens; each bin is one
+  training row whose samples restart position_ids at 0 and whose first label of
+  every sample is ignored, so no token is trained to predict across a boundary.
+  Attention stays inside each sample either through flash-attention's varlen path
+  (no attention_mask, boundaries taken from position_ids, as HF padding-free /
+  DataCollatorWithFlattening do) or, for eager / sdpa attention, with the explicit
+  block-diagonal causal mask of PackedCollator(block_mask=True). A 2D padding mask
+  on packed rows would let samples attend to each other, so PackedCollator refuses
+  packed rows without a block mask unless the model runs flash-attention.
+
+padding_stats() reports padded slots and waste for shuffled, bucketed and packed
+batches from the token lengths alone (no model or GPU needed).
+
+Usage:
+    bins = pack_sequences(lengths, max_len=2048)
+    rows = build_packed_examples(input_ids, labels, bins, max_len=2048)
+    collator = PackedCollator.for_model(model, pad_token_id=tokenizer.pad_token_id)
+"""
+
+import bisect
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+IGNORE_INDEX = -100
+# Batches per megabatch in length-grouped sampling (HF uses 50)
+MEGABATCH_MULT = 50
+
+
+def pack_sequences(lengths: Sequence[int], max_len: int) -> List[List[int]]:
+    """
+    Best-fit-decreasing bin packing. Returns bins of sample indices whose total
+    length (each sample capped at max_len) fits in max_len.
+    """
+    lengths = np.minimum(np.asarray(lengths, dtype=np.int64), max_len)
+    bins: List[List[int]] = []
+    space: List[tuple] = []    # sorted (remaining capacity, bin id) of bins that still have room
+    for i in np.argsort(-lengths, kind="stable").tolist():
+        need = int(lengths[i])
+        k = bisect.bisect_left(space, (need, -1))
+        if k < len(space):
+            remaining, b = space.pop(k)
+        else:
+            remaining, b = max_len, len(bins)
+            bins.append([])
+        bins[b].append(i)
+        remaining -= need
+        if remaining > 0:
+            bisect.insort(space, (remaining, b))
+    return bins
+
+
+def build_packed_examples(input_ids: Sequence[Sequence[int]], labels: Optional[Sequence[Sequence[int]]],
+                          bins: List[List[int]], max_len: int) -> List[Dict[str, List[int]]]:
+    """
+    One row per bin: concatenated input_ids / labels plus per-sample position_ids.
+    labels defaults to input_ids (loss on every token, like DataCollatorForLanguageModeling).
+    """
+    rows = []
+    for b in bins:
+        ids: List[int] = []
+        labs: List[int] = []
+        pos: List[int] = []
+        for i in b:
+            seq = list(input_ids[i][:max_len])
+            lab = list(labels[i][:max_len]) if labels is not None else list(seq)
+            # The previous sample's last token must not be trained to predict this one's first
+            lab[0] = IGNORE_INDEX
+            ids.extend(seq)
+            labs.extend(lab)
+            pos.extend(range(len(seq)))
+        rows.append({"input_ids": ids, "labels": labs, "position_ids": pos})
+    return rows
+
+
+class PackedDataset:
+    """
+    Lazy packed view of a map-style dataset of {"input_ids", "labels"} rows:
+    row r is build_packed_examples over bins[r], assembled when it is read.
+    """
+
+    def __init__(self, dataset, bins: List[List[int]], max_len: int):
+        self.dataset = dataset
+        self.bins = bins
+        self.max_len = max_len
+
+    def __len__(self) -> int:
+        return len(self.bins)
+
+    def __getitem__(self, r: int) -> Dict[str, List[int]]:
+        rows = [self.dataset[i] for i in self.bins[r]]
+        return build_packed_examples([x["input_ids"] for x in rows], [x["labels"] for x in rows],
+                                     [list(range(len(rows)))], self.max_len)[0]
+
+
+def length_grouped_batches(lengths: Sequence[int], batch_size: int,
+                           megabatch_mult: int = MEGABATCH_MULT, seed: int = 0) -> List[List[int]]:
+    """
+    Shuffle, cut into megabatches of megabatch_mult * batch_size samples, sort each
+    by length (longest first) and split into batches.
+    """
+    lengths = np.asarray(lengths)
+    order = np.random.default_rng(seed).permutation(len(lengths))
+    mega = megabatch_mult * batch_size
+    batches = []
+    for start in range(0, len(order), mega):
+        chunk = order[start:start + mega]
+        chunk = chunk[np.argsort(-lengths[chunk], kind="stable")]
+        batches.extend(chunk[i:i + batch_size].tolist() for i in range(0, len(chunk), batch_size))
+    return batches
+
+
+class LengthGroupedSampler:
+    """
+    Sampler over precomputed lengths (e.g. TokenStore.lengths) yielding the
+    length_grouped_batches order, reshuffled every epoch. HF's own
+    LengthGroupedSampler would read len(input_ids) of every row to get them.
+    """
+
+    def __init__(self, lengths: Sequence[int], batch_size: int,
+                 megabatch_mult: int = MEGABATCH_MULT, seed: int = 0):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.megabatch_mult = megabatch_mult
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def __iter__(self):
+        for batch in length_grouped_batches(self.lengths, self.batch_size, self.megabatch_mult,
+                                            seed=self.seed + self.epoch):
+            yield from batch
+
+
+def _waste(batch_lengths: List[np.ndarray]) -> Dict[str, float]:
+    real = sum(int(b.sum()) for b in batch_lengths)
+    slots = sum(int(b.max()) * len(b) for b in batch_lengths if len(b))
+    return {"batches": len(batch_lengths), "tokens": real, "slots": slots,
+            "pad": slots - real, "waste": (slots - real) / slots if slots else 0.0}
+
+
+def padding_stats(lengths: Sequence[int], batch_size: int, max_len: int, seed: int = 0) -> Dict[str, Dict[str, float]]:
+    """
+    Padded slots per strategy when every batch is padded to its longest row.
+    """
+    lengths = np.minimum(np.asarray(lengths, dtype=np.int64), max_len)
+    order = np.random.default_rng(seed).permutation(len(lengths))
+    shuffled = [lengths[order[i:i + batch_size]] for i in range(0, len(order), batch_size)]
+    bucketed = [lengths[b] for b in length_grouped_batches(lengths, batch_size, seed=seed)]
+    packs = np.array([lengths[b].sum() for b in pack_sequences(lengths, max_len)], dtype=np.int64)
+    packs = packs[np.random.default_rng(seed).permutation(len(packs))]
+    packed = [packs[i:i + batch_size] for i in range(0, len(packs), batch_size)]
+    return {"shuffled": _waste(shuffled), "bucketed": _waste(bucketed), "packed": _waste(packed)}
+
+
+def print_padding_stats(stats: Dict[str, Dict[str, float]]) -> None:
+    print(f"  {'strategy':<9} {'batches':>8} {'tokens':>12} {'padded slots':>13} {'waste':>7}")
+    for name, s in stats.items():
+        print(f"  {name:<9} {s['batches']:>8} {s['tokens']:>12} {s['slots']:>13} {s['waste']:>7.1%}")
+
+
+def block_causal_mask(position_ids, dtype=None):
+    """
+    Additive [batch, 1, seq, seq] mask that is causal inside each packed sample and
+    blocks attention across samples (a sample starts wherever position_ids == 0).
+    """
+    import torch
+
+    dtype = dtype or torch.float32
+    starts = (position_ids == 0).long()
+    seq_id = torch.cumsum(starts, dim=-1)                           # [b, s]
+    same = seq_id[:, :, None] == seq_id[:, None, :]
+    n = position_ids.shape[-1]
+    causal = torch.ones(n, n, dtype=torch.bool, device=position_ids.device).tril()
+    allowed = same & causal[None]
+    mask = torch.zeros(allowed.shape, dtype=dtype, device=position_ids.device)
+    mask.masked_fill_(~allowed, torch.finfo(dtype).min)
+    return mask[:, None]
+
+
+def is_flash_attention(attn_implementation: Optional[str]) -> bool:
+    return bool(attn_implementation) and "flash" in attn_implementation
+
+
+class PackedCollator:
+    """
+    Pads rows (input_ids / labels / position_ids) to the longest row in the batch.
+
+    Packed rows (with per-sample position_ids):
+      block_mask=False: no attention_mask; flash-attention (attn_implementation
+                        "flash_attention_2" / "flash_attention_3") splits the
+                        samples from position_ids. Refused for other attention.
+      block_mask=True:  4D block-diagonal causal mask for eager / sdpa attention.
+    Unpacked rows get the usual 2D padding mask.
+    """
+
+    def __init__(self, pad_token_id: int, block_mask: bool = False, pad_to_multiple_of: Optional[int] = None,
+                 attn_implementation: Optional[str] = "flash_attention_2"):
+        self.pad_token_id = pad_token_id
+        self.block_mask = block_mask
+        self.pad_to_multiple_of = pad_to_multiple_of
+        self.attn_implementation = attn_implementation
+
+    @classmethod
+    def for_model(cls, model, pad_token_id: int, pad_to_multiple_of: Optional[int] = None) -> "PackedCollator":
+        """Collator matching the model's attention implementation."""
+        attn = getattr(getattr(model, "config", None), "_attn_implementation", None)
+        return cls(pad_token_id, block_mask=not is_flash_attention(attn),
+                   pad_to_multiple_of=pad_to_multiple_of, attn_implementation=attn)
+
+    def __call__(self, features: List[Dict[str, Any]]) -> Dict[str, Any]:
+        import torch
+
+        packed = any("position_ids" in f for f in features)
+        if packed and not self.block_mask and not is_flash_attention(self.attn_implementation):
+            raise ValueError(f"Packed rows with attn_implementation={self.attn_implementation!r} need "
+                             f"block_mask=True; otherwise samples attend across boundaries")
+        n = max(len(f["input_ids"]) for f in features)
+        if self.pad_to_multiple_of:
+            n = -(-n // self.pad_to_multiple_of) * self.pad_to_multiple_of
+        b = len(features)
+        input_ids = torch.full((b, n), self.pad_token_id, dtype=torch.long)
+        labels = torch.full((b, n), IGNORE_INDEX, dtype=torch.long)
+        # Padding continues the last sample's positions so it never looks like a new sample start
+        position_ids = torch.zeros((b, n), dtype=torch.long)
+        attention_mask = torch.zeros((b, n), dtype=torch.long)
+        for r, f in enumerate(features):
+            k = len(f["input_ids"])
+            input_ids[r, :k] = torch.as_tensor(f["input_ids"])
+            labels[r, :k] = torch.as_tensor(f.get("labels", f["input_ids"]))
+            pos = torch.as_tensor(f.get("position_ids", range(k)))
+            position_ids[r, :k] = pos
+            if k < n:
+                position_ids[r, k:] = torch.arange(int(pos[-1]) + 1, int(pos[-1]) + 1 + n - k)
+            attention_mask[r, :k] = 1
+        batch = {"input_ids": input_ids, "labels": labels, "position_ids": position_ids}
+        if not packed:
+            batch["attention_mask"] = attention_mask
+        elif self.block_mask:
+            batch["attention_mask"] = block_causal_mask(position_ids)
+        # Packed + flash-attention: no mask, so the varlen path follows position_ids
+        return batch
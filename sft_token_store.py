@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pre-tokenized, memory-mapped SFT dataset.
+
+finetune_qwen_unsloth.py used to re-read the jsonl, render the chat template row
+by row and let the trainer tokenize again on every launch. build_token_store()
+does that once and writes flat arrays:
+
+    <cache_dir>/<key>/input_ids.bin   int32, all samples back to back
+    <cache_dir>/<key>/loss_mask.bin   uint8, 1 on assistant tokens (the only ones trained on)
+    <cache_dir>/<key>/offsets.npy     int64, sample i is [offsets[i], offsets[i+1])
+    <cache_dir>/<key>/assistant.npy   int32, trained-on tokens per sample
+    <cache_dir>/<key>/raw_lengths.npy int32, token length per sample before max_seq_len truncation
+    <cache_dir>/<key>/meta.json
+
+The key hashes the tokenizer, the chat template, the data file, the format
+version and the source of the record -> chat rendering (render_id, e.g.
+source_id(build_chat, format_example)), so any change builds a new store. TokenStore opens the arrays with
+np.memmap: startup is instant and dataloader workers share the page cache instead
+of holding copies (a TokenStore pickles as its path).
+
+Usage:
+    store = load_or_build(train_jsonl, tokenizer, render=chat_text, cache_dir=".sft_cache")
+    row = store[0]    # {"input_ids": [...], "labels": [...] with -100 outside assistant turns}
+
+Loss masks are built per batch (assistant_masks): assistant spans are located in
+the rendered text with str.find, each span's first and last character is mapped
+to a token with the fast tokenizer's char_to_token (a Python loop over spans, i.e.
+over assistant turns, not over tokens), and the masks of the whole batch are then
+filled with a single cumsum over span boundaries. assistant_masks_offsets does
+the span mapping without a Python loop (offset_mapping + np.searchsorted) but is
+slower end to end, because the offsets have to be returned by the tokenizer and
+copied out of Python lists; benchmark_masking compares both. assistant_mask_scan
+(token-id marker search) is the per-sample reference; build_token_store
+cross-checks it against the first batch.
+
+Benchmark / self-check on CPU:
+  python sft_token_store.py --tokenizer Qwen/Qwen3-8B --jsonl train.jsonl --benchmark 2000
+"""
+
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import time
+from itertools import chain
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from excel_cache import file_sha256
+from token_length_cache import tokenizer_id
+
+SFT_CACHE_DIR = "./.sft_cache"
+STORE_VERSION = 3
+IGNORE_INDEX = -100
+# Qwen chat template markers around every assistant turn
+ASSISTANT_START = "<|im_start|>assistant\n"
+ASSISTANT_END = "<|im_end|>"
+BUILD_BATCH_SIZE = 512
+# Samples of the first build batch cross-checked against the token-id scan
+MASK_CHECK_SAMPLES = 64
+
+
+def iter_jsonl_records(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def source_id(*fns: Callable) -> str:
+    """
+    Hash of the source of the functions that turn a record into chat text, so
+    an edited prompt / message filter builds a new store instead of reusing one.
+    """
+    h = hashlib.sha256()
+    for fn in fns:
+        try:
+            h.update(inspect.getsource(fn).encode("utf-8"))
+        except (OSError, TypeError):    # no source available (builtins, REPL)
+            h.update(getattr(fn, "__qualname__", repr(fn)).encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def store_key(jsonl_path: str, tokenizer, max_seq_len: Optional[int] = None, render_id: str = "") -> str:
+    blob = json.dumps([
+        STORE_VERSION,
+        tokenizer_id(tokenizer),
+        getattr(tokenizer, "chat_template", None) or "",
+        file_sha256(jsonl_path),
+        max_seq_len,
+        render_id,
+    ])
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()[:20]
+
+
+def _find(seq: List[int], pattern: List[int], start: int) -> int:
+    n, m = len(seq), len(pattern)
+    first = pattern[0]
+    i = start
+    while i <= n - m:
+        try:
+            i = seq.index(first, i, n - m + 1)
+        except ValueError:
+            return -1
+        if seq[i:i + m] == pattern:
+            return i
+        i += 1
+    return -1
+
+
+def assistant_mask_scan(ids: List[int], start_ids: List[int], end_ids: List[int]) -> np.ndarray:
+    """
+    1 for tokens after each `start_ids` marker up to and including the next `end_ids` marker.
+    """
+    mask = np.zeros(len(ids), dtype=np.uint8)
+    pos = 0
+    while True:
+        s = _find(ids, start_ids, pos)
+        if s < 0:
+            break
+        body = s + len(start_ids)
+        e = _find(ids, end_ids, body)
+        stop = len(ids) if e < 0 else e + len(end_ids)
+        mask[body:stop] = 1
+        pos = stop
+    return mask
+
+
+def assistant_spans(text: str) -> List[Tuple[int, int]]:
+    """
+    Character spans [start, end) of every assistant answer, including its <|im_end|>.
+    """
+    spans = []
+    pos = text.find(ASSISTANT_START)
+    while pos >= 0:
+        body = pos + len(ASSISTANT_START)
+        end = text.find(ASSISTANT_END, body)
+        stop = len(text) if end < 0 else end + len(ASSISTANT_END)
+        spans.append((body, stop))
+        pos = text.find(ASSISTANT_START, stop)
+    return spans
+
+
+def _span_tokens(enc, i: int, start: int, stop: int) -> Optional[Tuple[int, int]]:
+    """
+    Token range [first, last + 1) covering characters [start, stop) of sample i,
+    or None when no token falls inside the span.
+    """
+    first = last = None
+    for c in range(start, stop):
+        first = enc.char_to_token(i, c)
+        if first is not None:
+            break
+    for c in range(stop - 1, start - 1, -1):
+        last = enc.char_to_token(i, c)
+        if last is not None:
+            break
+    if first is None or last is None:
+        return None
+    return first, last + 1
+
+
+def assistant_masks(texts: Sequence[str], enc) -> List[np.ndarray]:
+    """
+    Assistant-only loss masks for a batch encoded by a fast tokenizer.
+    Assistant spans are located in the rendered text and mapped to token ranges
+    with char_to_token (one lookup per span boundary, looped in Python); only the
+    fill is vectorized: one +1/-1 boundary array and a cumsum over the flattened
+    tokens of the whole batch. assistant_masks_offsets maps the spans with
+    searchsorted instead but is slower (see benchmark_masking): copying the
+    offsets out of the tokenizer costs more than the per-span lookups.
+    """
+    first = _token_starts(enc["input_ids"])
+    opens: List[int] = []
+    closes: List[int] = []
+    for i, text in enumerate(texts):
+        for start, stop in assistant_spans(text):
+            span = _span_tokens(enc, i, start, stop)
+            if span is not None:
+                opens.append(first[i] + span[0])
+                closes.append(first[i] + span[1])
+    return _fill_masks(first, np.asarray(opens, dtype=np.int64), np.asarray(closes, dtype=np.int64))
+
+
+def assistant_masks_offsets(texts: Sequence[str], enc) -> List[np.ndarray]:
+    """
+    Same masks as assistant_masks, with no Python loop over spans: the batch's
+    offset_mapping (encode with return_offsets_mapping=True) is flattened onto
+    one character axis and every span boundary is mapped with np.searchsorted.
+    """
+    first = _token_starts(enc["input_ids"])
+    base = np.zeros(len(texts) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter(map(len, texts), dtype=np.int64, count=len(texts)), out=base[1:])
+    offsets = np.fromiter(chain.from_iterable(chain.from_iterable(enc["offset_mapping"])),
+                          dtype=np.int64, count=2 * int(first[-1])).reshape(-1, 2)
+    # Token offsets shifted by the start of their text are non-decreasing over the batch
+    offsets += np.repeat(base[:-1], np.diff(first))[:, None]
+    spans = np.asarray([(base[i] + a, base[i] + b) for i, text in enumerate(texts)
+                        for a, b in assistant_spans(text)], dtype=np.int64).reshape(-1, 2)
+    # First token ending after the span start, one past the last token starting before its end
+    opens = np.searchsorted(offsets[:, 1], spans[:, 0], side="right")
+    closes = np.searchsorted(offsets[:, 0], spans[:, 1], side="left")
+    keep = closes > opens
+    return _fill_masks(first, opens[keep], closes[keep])
+
+
+def _token_starts(input_ids: Sequence[Sequence[int]]) -> np.ndarray:
+    """Position of each sample's first token in the flattened batch (+ total at the end)."""
+    first = np.zeros(len(input_ids) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter(map(len, input_ids), dtype=np.int64, count=len(input_ids)), out=first[1:])
+    return first
+
+
+def _fill_masks(first: np.ndarray, opens: np.ndarray, closes: np.ndarray) -> List[np.ndarray]:
+    # Spans never overlap, so the running sum is 0/1 and is the mask itself
+    delta = np.zeros(int(first[-1]) + 1, dtype=np.int8)
+    np.add.at(delta, opens, 1)
+    np.add.at(delta, closes, -1)
+    inside = np.cumsum(delta[:-1], dtype=np.int8).view(np.uint8)
+    return np.split(inside, first[1:-1])
+
+
+class TokenStore:
+    """
+    Map-style dataset over a built store (works with torch DataLoader / HF Trainer).
+    """
+
+    def __init__(self, path: str, indices: Optional[np.ndarray] = None):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        self._assistant = np.load(os.path.join(path, "assistant.npy"), mmap_mode="r")
+        self._raw_lengths = np.load(os.path.join(path, "raw_lengths.npy"), mmap_mode="r")
+        n_tokens = int(self.offsets[-1])
+        # np.memmap cannot map an empty file
+        if n_tokens:
+            self.input_ids = np.memmap(os.path.join(path, "input_ids.bin"), dtype=np.int32, mode="r", shape=(n_tokens,))
+            self.loss_mask = np.memmap(os.path.join(path, "loss_mask.bin"), dtype=np.uint8, mode="r", shape=(n_tokens,))
+        else:
+            self.input_ids = np.zeros(0, dtype=np.int32)
+            self.loss_mask = np.zeros(0, dtype=np.uint8)
+        self.indices = np.arange(len(self.offsets) - 1) if indices is None else np.asarray(indices)
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(np.asarray(self.offsets))[self.indices]
+
+    @property
+    def raw_lengths(self) -> np.ndarray:
+        """Token length per sample before max_seq_len truncation."""
+        return np.asarray(self._raw_lengths)[self.indices]
+
+    @property
+    def assistant_counts(self) -> np.ndarray:
+        """Trained-on tokens per sample (0 when max_seq_len cut the whole assistant turn)."""
+        return np.asarray(self._assistant)[self.indices]
+
+    def select(self, positions: Sequence[int]) -> "TokenStore":
+        return TokenStore(self.path, self.indices[np.asarray(positions, dtype=np.int64)])
+
+    def tokens(self, i: int) -> Tuple[np.ndarray, np.ndarray]:
+        j = int(self.indices[i])
+        a, b = int(self.offsets[j]), int(self.offsets[j + 1])
+        return self.input_ids[a:b], self.loss_mask[a:b]
+
+    def __getitem__(self, i: int) -> Dict[str, List[int]]:
+        ids, mask = self.tokens(i)
+        ids = np.asarray(ids, dtype=np.int64)
+        labels = np.where(np.asarray(mask, dtype=bool), ids, IGNORE_INDEX)
+        return {"input_ids": ids.tolist(), "labels": labels.tolist()}
+
+    def split(self, eval_fraction: float, seed: int = 42) -> Tuple["TokenStore", Optional["TokenStore"]]:
+        if not eval_fraction or eval_fraction <= 0:
+            return self, None
+        order = np.random.default_rng(seed).permutation(self.indices)
+        n_eval = max(1, int(round(eval_fraction * len(order))))
+        return TokenStore(self.path, np.sort(order[n_eval:])), TokenStore(self.path, np.sort(order[:n_eval]))
+
+    def __getstate__(self):
+        # Workers re-open the memmaps instead of receiving copies of the arrays
+        return {"path": self.path, "indices": self.indices}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], state["indices"])
+
+
+def build_token_store(jsonl_path: str, tokenizer, out_dir: str,
+                      render: Callable[[Dict[str, Any]], str],
+                      max_seq_len: Optional[int] = None,
+                      batch_size: int = BUILD_BATCH_SIZE) -> TokenStore:
+    """
+    Render + tokenize every record once and write the store to `out_dir`
+    (built in a temp dir and renamed, so a crash never leaves a half store).
+    """
+    tmp = out_dir + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    start_ids = tokenizer.encode(ASSISTANT_START, add_special_tokens=False)
+    end_ids = tokenizer.encode(ASSISTANT_END, add_special_tokens=False)
+
+    offsets = [0]
+    counts: List[int] = []
+    raw_lengths: List[int] = []
+    with open(os.path.join(tmp, "input_ids.bin"), "wb") as f_ids, \
+         open(os.path.join(tmp, "loss_mask.bin"), "wb") as f_mask:
+
+        def flush(texts: List[str]) -> None:
+            enc = tokenizer(texts, add_special_tokens=False, return_attention_mask=False)
+            masks = assistant_masks(texts, enc)
+            if len(offsets) == 1:
+                n_bad = check_masks(enc["input_ids"][:MASK_CHECK_SAMPLES], masks[:MASK_CHECK_SAMPLES],
+                                    start_ids, end_ids)
+                if n_bad:
+                    print(f"⚠️ Assistant masks differ from the chat-template marker scan on "
+                          f"{n_bad}/{min(len(masks), MASK_CHECK_SAMPLES)} samples")
+            for ids, mask in zip(enc["input_ids"], masks):
+                raw_lengths.append(len(ids))
+                if max_seq_len:
+                    ids = ids[:max_seq_len]
+                    mask = mask[:max_seq_len]
+                np.asarray(ids, dtype=np.int32).tofile(f_ids)
+                mask.tofile(f_mask)
+                offsets.append(offsets[-1] + len(ids))
+                counts.append(int(mask.sum()))
+
+        batch: List[str] = []
+        for record in iter_jsonl_records(jsonl_path):
+            batch.append(render(record))
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+
+    np.save(os.path.join(tmp, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+    np.save(os.path.join(tmp, "assistant.npy"), np.asarray(counts, dtype=np.int32))
+    np.save(os.path.join(tmp, "raw_lengths.npy"), np.asarray(raw_lengths, dtype=np.int32))
+    with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "version": STORE_VERSION,
+            "source": os.path.abspath(jsonl_path),
+            "tokenizer": tokenizer_id(tokenizer),
+            "max_seq_len": max_seq_len,
+            "samples": len(offsets) - 1,
+            "tokens": offsets[-1],
+            "assistant_tokens": int(sum(counts)),
+            "truncated": int(sum(n > max_seq_len for n in raw_lengths)) if max_seq_len else 0,
+        }, f, ensure_ascii=False, indent=2)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp, out_dir)
+    return TokenStore(out_dir)
+
+
+def check_masks(input_ids: Sequence[Sequence[int]], masks: Sequence[np.ndarray],
+                start_ids: List[int], end_ids: List[int]) -> int:
+    """
+    Number of samples whose mask differs from the token-id marker scan.
+    """
+    return sum(1 for ids, m in zip(input_ids, masks)
+               if not np.array_equal(m, assistant_mask_scan(list(ids), start_ids, end_ids)))
+
+
+def benchmark_masking(texts: List[str], tokenizer, batch_size: int = BUILD_BATCH_SIZE) -> Dict[str, float]:
+    """
+    Samples/s of mask computation only (tokenization excluded): per-sample token
+    scan, char_to_token spans (used for builds) and offset_mapping + searchsorted
+    (the extra tokenizer time for returning offsets is reported separately).
+    Also reports samples that differ from the scan.
+    """
+    start_ids = tokenizer.encode(ASSISTANT_START, add_special_tokens=False)
+    end_ids = tokenizer.encode(ASSISTANT_END, add_special_tokens=False)
+    batches = []
+    t_enc = t_enc_offsets = 0.0
+    for i in range(0, len(texts), batch_size):
+        chunk = texts[i:i + batch_size]
+        t0 = time.perf_counter()
+        enc = tokenizer(chunk, add_special_tokens=False, return_attention_mask=False)
+        t1 = time.perf_counter()
+        enc_offsets = tokenizer(chunk, add_special_tokens=False, return_attention_mask=False,
+                                return_offsets_mapping=True)
+        t_enc += t1 - t0
+        t_enc_offsets += time.perf_counter() - t1
+        batches.append((chunk, enc, enc_offsets))
+
+    t0 = time.perf_counter()
+    scanned = [assistant_mask_scan(ids, start_ids, end_ids) for _, enc, _ in batches for ids in enc["input_ids"]]
+    t_scan = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    vectorized = [m for chunk, enc, _ in batches for m in assistant_masks(chunk, enc)]
+    t_vec = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    searched = [m for chunk, _, enc in batches for m in assistant_masks_offsets(chunk, enc)]
+    t_search = time.perf_counter() - t0
+
+    n_bad = sum(1 for a, b in zip(scanned, vectorized) if not np.array_equal(a, b))
+    n_bad_search = sum(1 for a, b in zip(scanned, searched) if not np.array_equal(a, b))
+    n_tokens = sum(len(m) for m in vectorized)
+    n = len(texts)
+    print(f"Masking {n} samples ({n_tokens} tokens, {sum(int(m.sum()) for m in vectorized)} trained on):")
+    print(f"  token scan               {n / t_scan:10.1f} samples/s")
+    print(f"  char_to_token spans      {n / t_vec:10.1f} samples/s")
+    print(f"  offsets + searchsorted   {n / t_search:10.1f} samples/s "
+          f"(+{t_enc_offsets - t_enc:.2f}s tokenizer time for the offsets, {t_enc:.2f}s without)")
+    print(f"  mismatching samples: {n_bad} (char_to_token), {n_bad_search} (searchsorted)")
+    return {"scan": n / t_scan, "vectorized": n / t_vec, "searchsorted": n / t_search,
+            "offsets_overhead_s": t_enc_offsets - t_enc, "mismatches": n_bad, "mismatches_searchsorted": n_bad_search}
+
+
+def load_or_build(jsonl_path: str, tokenizer, render: Callable[[Dict[str, Any]], str],
+                  cache_dir: str = SFT_CACHE_DIR, max_seq_len: Optional[int] = None,
+                  render_id: Optional[str] = None) -> TokenStore:
+    """
+    render_id: identifies the rendering logic (default: source_id(render)); pass
+    source_id() of every helper `render` calls, since a lambda's source does not
+    include them.
+    """
+    if render_id is None:
+        render_id = source_id(render)
+    out_dir = os.path.join(cache_dir, store_key(jsonl_path, tokenizer, max_seq_len, render_id))
+    if os.path.exists(os.path.join(out_dir, "meta.json")):
+        store = TokenStore(out_dir)
+        print(f"Token store: reusing {out_dir} ({store.meta['samples']} samples, {store.meta['tokens']} tokens)")
+        return store
+    os.makedirs(cache_dir, exist_ok=True)
+    store = build_token_store(jsonl_path, tokenizer, out_dir, render, max_seq_len=max_seq_len)
+    m = store.meta
+    print(f"Token store: built {out_dir} ({m['samples']} samples, {m['tokens']} tokens, "
+          f"{m['assistant_tokens'] / max(m['tokens'], 1):.1%} trained on)")
+    return store
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokenizer", required=True, help="Tokenizer with a Qwen-style chat template")
+    parser.add_argument("--jsonl", required=True, help="ShareGPT jsonl ({'conversations': [...]})")
+    parser.add_argument("--benchmark", type=int, default=2000, help="Samples to benchmark")
+    args = parser.parse_args()
+
+    from transformers import AutoTokenizer
+    tok = AutoTokenizer.from_pretrained(args.tokenizer, trust_remote_code=True)
+
+    # Same chat rendering as finetune_qwen_unsloth.format_example
+    def chat_text(record: Dict[str, Any]) -> str:
+        messages = [{"role": m["role"], "content": (m.get("content") or "").strip()}
+                    for m in record.get("conversations", []) if (m.get("content") or "").strip()]
+        return tok.apply_chat_template(messages, tokenize=False, add_generation_prompt=False)
+
+    texts = []
+    for record in iter_jsonl_records(args.jsonl):
+        texts.append(chat_text(record))
+        if len(texts) >= args.benchmark:
+            break
+    result = benchmark_masking(texts, tok)
+    if result["mismatches"]:
+        raise SystemExit(1)
@@ -0,0 +1,124 @@
+import csv
+import gzip
+import json
+import os
+
+import pytest
+
+from batch_io import CheckpointWriter, DatasetWriter, jsonl_to_csv
+
+
+def _read_csv(path):
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def test_errored_rows_are_not_completed_and_are_retried(tmp_path):
+    path = str(tmp_path / "ckpt.jsonl")
+    with CheckpointWriter(path, id_field="id") as ckpt:
+        ckpt.write({"id": 1, "out": "ok", "error": False})
+        ckpt.write({"id": 2, "out": "[ERROR generating lead: timeout]", "error": True})
+        assert ckpt.is_done(1) and not ckpt.is_done(2)
+
+    with CheckpointWriter(path, id_field="id") as ckpt:
+        assert ckpt.completed_ids == {"1"}
+        ckpt.write({"id": 2, "out": "retried", "error": False})
+
+    with CheckpointWriter(path, id_field="id") as ckpt:
+        assert ckpt.completed_ids == {"1", "2"}
+
+    out = str(tmp_path / "out.csv")
+    assert jsonl_to_csv(path, out, id_field="id") == 2
+    assert [r["out"] for r in _read_csv(out)] == ["ok", "retried"]
+
+
+def test_jsonl_to_csv_restores_input_order(tmp_path):
+    path = tmp_path / "ckpt.jsonl"
+    # completion order differs from input order; an old line lacks the order field
+    lines = [{"id": "c", "_row": 2}, {"id": "a", "_row": 0}, {"id": "x"}, {"id": "b", "_row": 1, "extra": 1.5}]
+    path.write_text("".join(json.dumps(r) + "\n" for r in lines) + '{"id": "half', encoding="utf-8")
+
+    out = str(tmp_path / "out.csv")
+    assert jsonl_to_csv(str(path), out, id_field="id", order_field="_row") == 4
+    rows = _read_csv(out)
+    assert [r["id"] for r in rows] == ["a", "b", "c", "x"]
+    assert list(rows[0]) == ["id", "extra"]
+
+
+def test_jsonl_to_csv_without_options_keeps_file_order(tmp_path):
+    path = tmp_path / "ckpt.jsonl"
+    path.write_text('{"id": 2, "v": NaN}\n{"id": 1, "v": 3}\n', encoding="utf-8")
+    out = str(tmp_path / "out.csv")
+    assert jsonl_to_csv(str(path), out) == 2
+    assert _read_csv(out) == [{"id": "2", "v": ""}, {"id": "1", "v": "3"}]
+
+
+def _read_jsonl(path):
+    if path.endswith(".gz"):
+        with gzip.open(path, "rb") as f:
+            data = f.read()
+    elif path.endswith(".zst"):
+        zstandard = pytest.importorskip("zstandard")
+        with open(path, "rb") as f:
+            data = zstandard.ZstdDecompressor().stream_reader(f).read()
+    else:
+        with open(path, "rb") as f:
+            data = f.read()
+    return [json.loads(line) for line in data.decode("utf-8").splitlines()]
+
+
+def test_dataset_writer_renames_on_close_and_keeps_old_output_on_error(tmp_path):
+    path = str(tmp_path / "train.jsonl")
+    with DatasetWriter(path) as w:
+        w.write({"i": 0, "text": "Hà Nội"})
+        assert os.path.exists(path + ".tmp") and not os.path.exists(path)
+    assert w.paths == [path] and _read_jsonl(path) == [{"i": 0, "text": "Hà Nội"}]
+    assert os.listdir(tmp_path) == ["train.jsonl"]
+
+    with pytest.raises(RuntimeError):
+        with DatasetWriter(path) as w:
+            w.write({"i": 1})
+            raise RuntimeError("crash")
+    assert _read_jsonl(path) == [{"i": 0, "text": "Hà Nội"}]
+    assert os.listdir(tmp_path) == ["train.jsonl"]
+
+
+def test_dataset_writer_double_close_keeps_output(tmp_path):
+    path = str(tmp_path / "train.jsonl")
+    w = DatasetWriter(path)
+    w.write({"i": 0})
+    w.close()
+    w.close()
+    with w:
+        pass
+    assert w.paths == [path] and _read_jsonl(path) == [{"i": 0}]
+
+
+def test_dataset_writer_shard_rollover_removes_stale_shards(tmp_path):
+    path = str(tmp_path / "train.jsonl")
+    with DatasetWriter(path, shard_size=2) as w:
+        for i in range(7):
+            w.write({"i": i})
+    assert [os.path.basename(p) for p in w.paths] == [f"train-{k:05d}.jsonl" for k in range(4)]
+    assert [r["i"] for p in w.paths for r in _read_jsonl(p)] == list(range(7))
+
+    # A smaller rebuild must not leave shards 2 and 3 of the old build behind
+    (tmp_path / "other-00009.jsonl").write_text("keep\n")
+    with DatasetWriter(path, shard_size=2) as w:
+        for i in range(3):
+            w.write({"i": 10 + i})
+    assert sorted(os.listdir(tmp_path)) == ["other-00009.jsonl", "train-00000.jsonl", "train-00001.jsonl"]
+    assert [r["i"] for p in w.paths for r in _read_jsonl(p)] == [10, 11, 12]
+
+
+@pytest.mark.parametrize("compression, suffix", [("gzip", ".gz"), ("zstd", ".zst")])
+def test_dataset_writer_compressed_round_trip(tmp_path, compression, suffix):
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    records = [{"i": i, "text": "tin tức " * i} for i in range(50)]
+    path = str(tmp_path / "train.jsonl")
+    with DatasetWriter(path, compression=compression, shard_size=20) as w:
+        for r in records:
+            w.write(r)
+    assert all(p.endswith(".jsonl" + suffix) for p in w.paths) and len(w.paths) == 3
+    assert [r for p in w.paths for r in _read_jsonl(p)] == records
@@ -0,0 +1,45 @@
+import threading
+
+import pandas as pd
+import pytest
+
+import batch_ollama_from_csv as batch
+
+
+@pytest.fixture
+def paths(tmp_path, monkeypatch):
+    src = tmp_path / "articles.csv"
+    pd.DataFrame({
+        "id": [11, 12, 13, 14, 15],
+        "type": ["thể thao", "kinh doanh", None, "du lịch", "sức khỏe"],
+        "content": [f"Nội dung bài {i}, có dấu phẩy\nvà xuống dòng" for i in range(5)],
+    }).to_csv(src, index=False)
+    out = tmp_path / "outputs.csv"
+    monkeypatch.setattr(batch, "INPUT_CSV", str(src))
+    monkeypatch.setattr(batch, "OUTPUT_CSV", str(out))
+    monkeypatch.setattr(batch, "OUTPUT_JSONL", str(tmp_path / "outputs.jsonl"))
+    monkeypatch.setattr(batch, "CHUNK_SIZE", 2)
+    monkeypatch.setattr(batch.EndpointPool, "start_health_checks", lambda self, interval=10.0: None)
+    return out
+
+
+def test_main_returns_the_output_frame_in_input_order(paths, monkeypatch):
+    lock = threading.Lock()
+    calls = []
+
+    def fake_post_chat(url, model, system_prompt, user_prompt, temperature, *args, **kwargs):
+        with lock:
+            calls.append(temperature)
+        task = "title" if temperature == batch.TEMPERATURE_TITLE else "lead"
+        article = user_prompt.split("Nội dung bài ")[1][0]
+        return {"choices": [{"message": {"content": f"{task} {article}"}}]}
+
+    monkeypatch.setattr(batch, "post_chat", fake_post_chat)
+    out = batch.main(concurrency=3, use_cache=False)
+
+    assert isinstance(out, pd.DataFrame)
+    assert out["id"].tolist() == [11, 12, 13, 14, 15]
+    assert out["output_lead"].tolist() == [f"lead {i}" for i in range(5)]
+    assert out["output_title"].tolist() == [f"title {i}" for i in range(5)]
+    assert not out["error"].any() and len(calls) == 10
+    pd.testing.assert_frame_equal(out, pd.read_csv(paths, encoding="utf-8-sig"))
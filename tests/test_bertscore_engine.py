@@ -0,0 +1,87 @@
+import os
+
+import numpy as np
+import pytest
+
+from bertscore_engine import BertScoreEngine
+
+# Any local BERT-family checkpoint; the test is skipped when it is not available offline
+MODEL = os.environ.get("BERTSCORE_TEST_MODEL", "bert-base-multilingual-cased")
+
+REFS = ["Hà Nội mưa lớn, nhiều tuyến phố ngập sâu", "", "giá vàng tăng mạnh", "  ", "bão số 3", "", "x"]
+HYPS = ["Mưa lớn khiến Hà Nội ngập", "có chữ", "", "vàng", "   ", "", "y z"]
+NON_EMPTY = [i for i, (r, h) in enumerate(zip(REFS, HYPS)) if r.strip() and h.strip()]
+
+
+def test_empty_side_scores_zero():
+    empty = (np.zeros((0, 0), dtype=np.float32), np.zeros(0, dtype=np.float32))
+    special_only = (np.eye(2, 4, dtype=np.float32), np.zeros(2, dtype=np.float32))
+    text = (np.eye(4, dtype=np.float32), np.array([0, 1, 1, 0], dtype=np.float32))
+    for ref, hyp in [(empty, text), (text, empty), (empty, empty), (special_only, text)]:
+        assert BertScoreEngine._greedy(ref, hyp) == (0.0, 0.0, 0.0)
+    assert BertScoreEngine._greedy(text, text) == pytest.approx((1.0, 1.0, 1.0))
+
+
+@pytest.fixture(scope="module")
+def model():
+    pytest.importorskip("torch")
+    bert_score = pytest.importorskip("bert_score")
+    from transformers import AutoConfig
+
+    try:
+        config = AutoConfig.from_pretrained(MODEL, local_files_only=True)
+    except (OSError, ValueError):
+        pytest.skip(f"BERTScore model {MODEL} not available locally")
+    num_layers = bert_score.utils.model2layers.get(MODEL, config.num_hidden_layers)
+    return MODEL, num_layers
+
+
+def _engine(model, **kwargs):
+    model_type, num_layers = model
+    kwargs.setdefault("rescale_with_baseline", False)
+    kwargs.setdefault("cache_dir", None)
+    return BertScoreEngine(model_type=model_type, num_layers=num_layers, device="cpu", **kwargs)
+
+
+def _reference(model, idx, **kwargs):
+    import bert_score
+
+    model_type, num_layers = model
+    P, R, F = bert_score.score([HYPS[i] for i in idx], [REFS[i] for i in idx], model_type=model_type,
+                               num_layers=num_layers, device="cpu", **kwargs)
+    return P.numpy(), R.numpy(), F.numpy()
+
+
+def test_matches_bert_score(model):
+    P, R, F = _engine(model).score(REFS, HYPS)
+    for got, want in zip((P, R, F), _reference(model, NON_EMPTY)):
+        np.testing.assert_allclose(got[NON_EMPTY], want, atol=1e-5)
+    # Empty reference or hypothesis: bert_score's zero mask gives raw 0 on every field
+    empty = [i for i in range(len(REFS)) if i not in NON_EMPTY]
+    for got in (P, R, F):
+        assert (got[empty] == 0).all()
+
+
+def test_rescaled_with_baseline(model, tmp_path):
+    baseline = tmp_path / "baseline.tsv"
+    rows = [f"{layer},{0.5 + layer / 100},{0.4 + layer / 100},{0.45 + layer / 100}" for layer in range(model[1] + 1)]
+    baseline.write_text("LAYER,P,R,F\n" + "\n".join(rows) + "\n")
+
+    engine = _engine(model, rescale_with_baseline=True, baseline_path=str(baseline))
+    P, R, F = engine.score(REFS, HYPS)
+    want = _reference(model, NON_EMPTY, lang="vi", rescale_with_baseline=True, baseline_path=str(baseline))
+    for got, w in zip((P, R, F), want):
+        np.testing.assert_allclose(got[NON_EMPTY], w, atol=1e-5)
+    base = engine.scorer.baseline_vals.numpy()
+    np.testing.assert_allclose(F[1], (0 - base[2]) / (1 - base[2]), atol=1e-6)
+
+
+def test_reference_cache_skips_empty_texts(model, tmp_path):
+    engine = _engine(model, cache_dir=str(tmp_path / "cache"))
+    first = engine.score(REFS, HYPS)
+    # 4 distinct non-empty references; empty ones are neither encoded nor cached
+    assert (engine.cache_hits, engine.cache_misses) == (0, 4)
+    second = engine.score(REFS, HYPS)
+    assert (engine.cache_hits, engine.cache_misses) == (4, 4)
+    for a, b in zip(first, second):
+        np.testing.assert_allclose(a, b, atol=1e-6)
@@ -0,0 +1,53 @@
+import pytest
+
+from preprocess_data import CLEANERS, check_clean_parity, clean_content, resolve_backend
+
+FAST_BACKENDS = ["lxml", "selectolax"]
+
+# (html, clean_content output) -- bs4 / html.parser is the reference
+CASES = [
+    ("<title>Tiêu đề</title><p>Nội dung</p>", "Tiêu đề\nNội dung"),
+    ("<html><head><title>T</title></head><body><p>b</p></body></html>", "T\nb"),
+    ("a<style>.c{}</style>b", "a\nb"),
+    ("a<script>x()</script>b", "a\nb"),
+    ("a<figure><img><figcaption>ảnh</figcaption></figure>b", "a\nb"),
+    ("<p>x</p><div>y<div>z</div></div>w", "x\nw"),
+    ("<noscript>ns</noscript>x", "ns\nx"),
+    ("<template>tt</template>x", "x"),
+    ("<p>a<!-- c -->b</p>", "a\nb"),
+    ("<b>Hà Nội</b> mưa lớn<br>ngập", "Hà Nội\nmưa lớn\nngập"),
+    ("&amp; &lt;3", "& <3"),
+    ("<!DOCTYPE html><p>x</p>", "x"),
+    ("", ""),
+    ("   ", ""),
+]
+
+
+@pytest.mark.parametrize("html, expected", CASES)
+def test_bs4_reference(html, expected):
+    assert clean_content(html) == expected
+
+
+@pytest.mark.parametrize("backend", FAST_BACKENDS)
+@pytest.mark.parametrize("html, expected", CASES)
+def test_fast_backends_match_bs4(backend, html, expected):
+    pytest.importorskip(backend)
+    assert CLEANERS[backend](html) == expected
+
+
+@pytest.mark.parametrize("backend", FAST_BACKENDS)
+def test_cdata_is_a_documented_difference(backend):
+    pytest.importorskip(backend)
+    html = "<p>a<![CDATA[cd]]>b</p>"
+    assert clean_content(html) == "a\ncd\nb"
+    assert CLEANERS[backend](html) == "a\nb"
+
+
+@pytest.mark.parametrize("backend", FAST_BACKENDS)
+def test_parity_check_samples_beyond_the_first_rows(backend):
+    pytest.importorskip(backend)
+    contents = ["<p>ok</p>"] * 900 + ["<p>a<![CDATA[cd]]>b</p>"] * 100
+    assert check_clean_parity(contents, backend, limit=200) > 0
+    assert check_clean_parity(contents, backend, limit=200) == check_clean_parity(contents, backend, limit=200)
+    assert resolve_backend(contents, backend) == "bs4"
+    assert resolve_backend(contents[:900], backend) == backend
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+from compare_runs import METRICS, compare, leaderboard, load_runs, run_names
+
+
+def _report(path, ids, shift, seed):
+    rng = np.random.default_rng(seed)
+    base = np.random.default_rng(0).uniform(0.2, 0.6, size=(100, len(METRICS)))[ids]
+    df = pd.DataFrame(base + shift + rng.normal(0, 0.01, size=base.shape), columns=METRICS)
+    df.insert(0, "id", ids)
+    df.insert(1, "type", ["du lịch" if i % 2 else "đời sống" for i in ids])
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Rows in a different order per file: alignment must go through the id
+    df.sample(frac=1, random_state=seed).to_csv(path, index=False)
+    return path
+
+
+def test_runs_align_by_id_and_ci_covers_the_shift(tmp_path):
+    a = _report(tmp_path / "a" / "metrics_report.csv", np.arange(0, 90), 0.0, 1)
+    b = _report(tmp_path / "b" / "metrics_report.csv", np.arange(10, 100), 0.05, 2)
+    names, values, types, metrics = load_runs([str(a), str(b)])
+
+    assert names == ["a/metrics_report", "b/metrics_report"]
+    assert values.shape == (2, len(METRICS), 80) and metrics == METRICS
+    assert types.tolist() == ["du lịch" if i % 2 else "đời sống" for i in range(10, 90)]
+    assert np.allclose(values[1] - values[0], 0.05, atol=0.06)
+
+    report = compare(names, values, metrics, baseline=0, n_boot=2000, alpha=0.05, seed=0)
+    other = report[report["run"] == names[1]]
+    assert ((other["ci_low"] < 0.05) & (other["ci_high"] > 0.05)).all()
+    assert (other["ci_low"] > 0).all() and (other["p_value"] < 0.01).all()
+    assert (report[report["run"] == names[0]]["p_value"] == 1.0).all()
+    # Duplicate file names must not collapse in the pivot
+    assert leaderboard(report, "mean").index.tolist() == [names[1], names[0]]
+
+
+def test_p_value_is_large_without_a_difference(tmp_path):
+    a = _report(tmp_path / "x" / "metrics_report_0.5.csv", np.arange(100), 0.0, 1)
+    b = _report(tmp_path / "y" / "metrics_report_0.5.csv", np.arange(100), 0.0, 2)
+    names, values, _, metrics = load_runs([str(a), str(b)])
+    report = compare(names, values, metrics, baseline=0, n_boot=2000, alpha=0.05, seed=0)
+    # Under the null the p-values are spread out, not pinned near 0 or 1
+    assert report[report["run"] == names[1]]["p_value"].min() > 0.01
+
+
+def test_run_names_are_unique():
+    assert run_names(["r/metrics_report_0.5.csv", "r/metrics_report_0.6.csv"]) == ["0.5", "0.6"]
+    assert run_names(["exp1/out/metrics_report_0.5.csv", "exp2/out/metrics_report_0.5.csv", "x/metrics_report_0.6.csv"]) \
+        == ["exp1/out/0.5", "exp2/out/0.5", "0.6"]
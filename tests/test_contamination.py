@@ -0,0 +1,86 @@
+import json
+import os
+import random
+
+import pandas as pd
+import pytest
+
+import contamination
+from contamination import ContaminationIndex, load_or_build
+from preprocess_data import multitask_instruction_prompt
+
+
+def _articles(n, words=200, seed=0):
+    rng = random.Random(seed)
+    vocab = [f"từ{i}" for i in range(5000)]
+    return [" ".join(rng.choice(vocab) for _ in range(words)) for _ in range(n)]
+
+
+def _write_train(path, articles):
+    with open(path, "w", encoding="utf-8") as f:
+        for i, content in enumerate(articles):
+            payload = multitask_instruction_prompt(f"Lead bài {i}", content, f"Tiêu đề bài {i}", "vne")
+            for task in ("title", "lead"):
+                f.write(json.dumps(payload[task], ensure_ascii=False) + "\n")
+
+
+@pytest.fixture
+def train_path(tmp_path):
+    path = str(tmp_path / "train.jsonl")
+    _write_train(path, _articles(5))
+    return path
+
+
+def test_verbatim_article_is_flagged_and_unrelated_is_not(tmp_path, train_path):
+    train = _articles(5)
+    edited = train[3].split()
+    edited[7] = "khác"
+    unrelated = _articles(2, seed=99)
+    df = pd.DataFrame({
+        "content": [train[1], " ".join(edited), unrelated[0], unrelated[1]],
+        "title": ["Tiêu đề mới", "Tiêu đề khác", "Tiêu đề khác nữa", "Tiêu đề bài 4"],
+        "lead": ["", None, "Lead mới", "Lead khác"],
+    })
+    flags = load_or_build(str(tmp_path / "index.npz"), train_path).query_frame(df)
+
+    assert flags["contaminated"].tolist() == [True, True, False, True]
+    # Verbatim: exact match on the first training line of article 1 (lines 2 and 3 are its samples)
+    assert flags.loc[0, "contamination_sim"] == 1.0 and flags.loc[0, "contamination_match"] == "2"
+    assert flags.loc[1, "contamination_match"] == "6" and 0.5 <= flags.loc[1, "contamination_sim"] < 1.0
+    assert pd.isna(flags.loc[2, "contamination_match"]) and flags.loc[2, "contamination_sim"] == 0.0
+    # Unrelated content, but the reference title is a training answer
+    assert pd.isna(flags.loc[3, "contamination_match"]) and flags.loc[3, "title_in_train"]
+    assert not flags["lead_in_train"].any()
+
+
+def test_index_is_saved_reused_and_refreshed(tmp_path, train_path, monkeypatch):
+    index_path = str(tmp_path / "index.npz")
+    with pytest.raises(FileNotFoundError):
+        load_or_build(index_path)
+    built = load_or_build(index_path, train_path)
+
+    builds = []
+    real_build = ContaminationIndex.build
+    monkeypatch.setattr(ContaminationIndex, "build", lambda self, *a, **k: builds.append(a) or real_build(self, *a, **k))
+
+    loaded = load_or_build(index_path, threshold=0.8)
+    assert builds == [] and loaded.lsh.threshold == 0.8
+    assert len(loaded.lsh) == len(built.lsh) == 5 and loaded.answers == built.answers
+    verbatim = pd.DataFrame({"content": [_articles(5)[0]]})
+    assert loaded.query_frame(verbatim)["contaminated"].tolist() == [True]
+
+    # A training file newer than the index triggers a rebuild
+    new_article = _articles(1, seed=7)[0]
+    _write_train(train_path, _articles(5) + [new_article])
+    later = os.path.getmtime(index_path) + 10
+    os.utime(train_path, (later, later))
+    refreshed = load_or_build(index_path, train_path)
+    assert len(builds) == 1 and len(refreshed.lsh) == 6
+    assert refreshed.query_frame(pd.DataFrame({"content": [new_article]}))["contaminated"].all()
+
+
+def test_query_frame_needs_content(train_path):
+    index = ContaminationIndex().build(train_path)
+    with pytest.raises(ValueError):
+        index.query_frame(pd.DataFrame({"title": ["x"]}))
+    assert contamination.split_sample({"conversations": []}) == ("", "")
@@ -0,0 +1,97 @@
+import io
+import os
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+
+import excel_cache
+from excel_cache import ExcelCache, read_excel_cached
+
+
+@pytest.fixture
+def parses(monkeypatch):
+    """Stand-in for pd.read_excel (no openpyxl needed): the 'workbook' is CSV text."""
+    calls = []
+
+    def fake_read_excel(path):
+        calls.append(path)
+        with open(path, "rb") as f:
+            return pd.read_csv(io.BytesIO(f.read()))
+
+    monkeypatch.setattr(excel_cache.pd, "read_excel", fake_read_excel)
+    return calls
+
+
+def _write(path, text, mtime_ns=None):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_hit_and_column_selection(tmp_path, parses):
+    src = str(tmp_path / "du lich.xlsx")
+    _write(src, "title,lead,content\nĐà Lạt,mát,rừng thông\nHuế,cổ kính,1802\n")
+    cache = ExcelCache(str(tmp_path / "cache"))
+
+    df = cache.read(src)
+    assert (cache.hits, cache.misses, len(parses)) == (0, 1, 1)
+    assert df["content"].tolist() == ["rừng thông", "1802"]    # mixed column read as strings
+
+    df = cache.read(src, columns=["title", "lead"])
+    assert (cache.hits, cache.misses, len(parses)) == (1, 1, 1)
+    assert list(df.columns) == ["title", "lead"] and df["title"].tolist() == ["Đà Lạt", "Huế"]
+
+
+def test_touch_without_change_is_still_a_hit(tmp_path, parses, monkeypatch):
+    src = str(tmp_path / "kinh doanh.xlsx")
+    _write(src, "title\nGiá vàng\n", mtime_ns=1_600_000_000_000_000_000)
+    cache = ExcelCache(str(tmp_path / "cache"))
+    cache.read(src)
+
+    os.utime(src, ns=(1_700_000_000_000_000_000,) * 2)
+    assert cache.read(src)["title"].tolist() == ["Giá vàng"]
+    assert (cache.hits, cache.misses, len(parses)) == (1, 1, 1)
+    # The new mtime is recorded, so the next read skips hashing too
+    hashed = []
+    real_sha = excel_cache.file_sha256
+    monkeypatch.setattr(excel_cache, "file_sha256", lambda p: hashed.append(p) or real_sha(p))
+    cache.read(src)
+    assert hashed == [] and cache.hits == 2
+
+
+def test_rebuilt_when_mtime_or_size_changes(tmp_path, parses):
+    src = str(tmp_path / "the thao.xlsx")
+    cache_dir = str(tmp_path / "cache")
+    _write(src, "title\nAAAA\n", mtime_ns=1_600_000_000_000_000_000)
+    assert read_excel_cached(src, cache_dir=cache_dir)["title"].tolist() == ["AAAA"]
+
+    # Same size, new content and mtime
+    _write(src, "title\nBBBB\n", mtime_ns=1_600_000_001_000_000_000)
+    cache = ExcelCache(cache_dir)
+    assert cache.read(src)["title"].tolist() == ["BBBB"]
+    assert cache.misses == 1 and len(parses) == 2
+
+    # Size changes, mtime forced back to the recorded one
+    _write(src, "title\nBBBB\nCCCCC\n", mtime_ns=1_600_000_001_000_000_000)
+    assert cache.read(src)["title"].tolist() == ["BBBB", "CCCCC"]
+    assert cache.misses == 2 and len(parses) == 3
+
+    assert cache.read(src)["title"].tolist() == ["BBBB", "CCCCC"]
+    assert cache.hits == 1 and len(parses) == 3
+
+
+def test_version_bump_and_disabled_cache(tmp_path, parses, monkeypatch):
+    src = str(tmp_path / "suc khoe.xlsx")
+    _write(src, "title\nVắc xin\n")
+    cache_dir = str(tmp_path / "cache")
+    read_excel_cached(src, cache_dir=cache_dir)
+    monkeypatch.setattr(excel_cache, "CACHE_VERSION", excel_cache.CACHE_VERSION + 1)
+    cache = ExcelCache(cache_dir)
+    cache.read(src)
+    assert cache.misses == 1 and len(parses) == 2
+
+    assert read_excel_cached(src, columns=["title"], cache_dir=None)["title"].tolist() == ["Vắc xin"]
+    assert len(parses) == 3
@@ -0,0 +1,52 @@
+from metric_store import MetricStore, metric_key
+
+CFG = {"metric": "rouge", "tokenizer": "rouge", "stem": False, "lower": False}
+
+
+class _Scorer:
+    """Records every pair it is asked to score; value = (len(ref), len(hyp))."""
+
+    def __init__(self):
+        self.seen = []
+
+    def __call__(self, refs, hyps):
+        self.seen.append(list(zip(refs, hyps)))
+        return [float(len(r)) for r in refs], [float(len(h)) for h in hyps]
+
+
+def test_only_unseen_pairs_are_scored(tmp_path):
+    path = str(tmp_path / "metrics.sqlite")
+    refs = ["mưa lớn", "bão số 3", "giá vàng", "mưa lớn"]
+    hyps = ["mưa to", "bão", "vàng tăng", "mưa to"]
+    fn = _Scorer()
+
+    store = MetricStore(path)
+    (first, second), n_new = store.compute_missing(CFG, refs, hyps, fn, n_fields=2)
+    # The duplicated row is scored once
+    assert n_new == 3 and len(fn.seen) == 1 and len(fn.seen[0]) == 3
+    assert first == [7.0, 8.0, 8.0, 7.0] and second == [6.0, 3.0, 9.0, 6.0]
+    store.close()
+
+    # A later run (new connection) with two known rows, reordered, and one new row
+    store = MetricStore(path)
+    refs2 = ["giá vàng", "tỷ giá", "mưa lớn"]
+    hyps2 = ["vàng tăng", "USD giảm", "mưa to"]
+    (first, second), n_new = store.compute_missing(CFG, refs2, hyps2, fn, n_fields=2)
+    assert n_new == 1 and fn.seen[1] == [("tỷ giá", "USD giảm")]
+    # Stored and fresh values come back aligned with the input order
+    assert first == [8.0, 6.0, 7.0] and second == [9.0, 8.0, 6.0]
+
+    # Everything known: fn is not called at all
+    _, n_new = store.compute_missing(CFG, refs2[::-1], hyps2[::-1], fn, n_fields=2)
+    assert n_new == 0 and len(fn.seen) == 2
+    store.close()
+
+
+def test_config_is_part_of_the_key(tmp_path):
+    store = MetricStore(str(tmp_path / "metrics.sqlite"))
+    fn = _Scorer()
+    store.compute_missing(CFG, ["a"], ["b"], fn, n_fields=2)
+    _, n_new = store.compute_missing({**CFG, "stem": True}, ["a"], ["b"], fn, n_fields=2)
+    assert n_new == 1 and len(fn.seen) == 2
+    assert metric_key(CFG, "ab", "c") != metric_key(CFG, "a", "bc")
+    store.close()
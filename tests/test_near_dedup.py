@@ -0,0 +1,126 @@
+import random
+
+from near_dedup import Deduplicator, MinHashLSH, content_hash
+
+
+def _articles(n, words=200, seed=0):
+    rng = random.Random(seed)
+    vocab = [f"từ{i}" for i in range(5000)]
+    return [" ".join(rng.choice(vocab) for _ in range(words)) for _ in range(n)]
+
+
+def _build(index_path, contents):
+    index = MinHashLSH.load(index_path) if index_path.exists() else MinHashLSH()
+    dedup = Deduplicator(index)
+    keep = dedup.dedup([content_hash(c) for c in contents], contents)
+    index.save(str(index_path))
+    return keep, dedup
+
+
+def test_rebuild_after_prepending_rows_keeps_indexed_articles(tmp_path):
+    path = tmp_path / "index.npz"
+    old = _articles(3)
+    assert _build(path, old)[0] == [True, True, True]
+
+    new = _articles(1, seed=1) + old
+    keep, dedup = _build(path, new)
+    assert keep == [True, True, True, True]
+    assert dedup.dropped == []
+
+
+def test_rebuild_after_reordering_rows_keeps_indexed_articles(tmp_path):
+    path = tmp_path / "index.npz"
+    old = _articles(4)
+    _build(path, old)
+    keep, _ = _build(path, old[::-1])
+    assert keep == [True, True, True, True]
+
+
+def test_duplicates_within_a_build_are_still_dropped_after_reload(tmp_path):
+    path = tmp_path / "index.npz"
+    a, b = _articles(2)
+    _build(path, [a, b])
+
+    near = a.split()
+    near[10] = "khác"
+    keep, dedup = _build(path, [b, a, a, " ".join(near)])
+    assert keep == [True, True, False, False]
+    assert [r["reason"] for r in dedup.dropped] == ["exact", "near"]
+    assert all(r["cluster"] == content_hash(a) for r in dedup.dropped)
+
+
+def test_edited_article_replaces_its_stale_version(tmp_path):
+    path = tmp_path / "index.npz"
+    a, = _articles(1)
+    _build(path, [a])
+
+    edited = a.split()
+    edited[5] = "mới"
+    edited = " ".join(edited)
+    # The previous version is no longer in the export: the new one must not be dropped
+    assert _build(path, [edited])[0] == [True]
+    # Both versions in one export: the second one is a near-duplicate of the first
+    assert _build(path, [edited, a])[0] == [True, False]
+
+
+class _Writer:
+    def __init__(self):
+        self.records = []
+
+    def write(self, record):
+        self.records.append(record)
+
+
+def _export(contents):
+    import pandas as pd
+    return pd.DataFrame({"title": [f"t{i}" for i in range(len(contents))],
+                         "lead": ["lead"] * len(contents),
+                         "content": [f"<p>{c}</p>" for c in contents]})
+
+
+def test_handle_categories_rebuild_with_prepended_row(tmp_path, monkeypatch):
+    import preprocess_data
+
+    path = tmp_path / "index.npz"
+    old = _articles(3)
+    for contents in (old, _articles(1, seed=1) + old, old[::-1]):
+        monkeypatch.setattr(preprocess_data, "read_excel_cached", lambda *a, df=_export(contents), **k: df)
+        index = MinHashLSH.load(str(path)) if path.exists() else MinHashLSH()
+        dedup = Deduplicator(index)
+        writer = _Writer()
+        preprocess_data.handle_categories("doi song.xlsx", "đời sống", writer, dedup, backend="bs4", workers=1)
+        index.save(str(path))
+        # one title + one lead sample per article, none dropped
+        assert len(writer.records) == 2 * len(contents)
+        assert dedup.dropped == []
+
+
+def test_precomputed_hashes_are_not_recomputed(monkeypatch):
+    import near_dedup
+
+    contents = _articles(3)
+    hashes = [content_hash(c) for c in contents]
+    calls = []
+    monkeypatch.setattr(near_dedup, "content_hash", lambda t: calls.append(t) or "x")
+    keep = Deduplicator().dedup(hashes, contents, exact=hashes)
+    assert keep == [True, True, True] and calls == []
+
+
+def test_compact_keeps_articles_of_this_run_and_newest_others(tmp_path):
+    path = tmp_path / "index.npz"
+    old = _articles(6, seed=2)
+    _build(path, old)
+
+    current = old[:2] + _articles(1, seed=3)
+    index = MinHashLSH.load(str(path))
+    dedup = Deduplicator(index)
+    hashes = [content_hash(c) for c in current]
+    dedup.dedup(hashes, current, exact=hashes)
+    assert dedup.compact(None) is index and dedup.compact(100) is index
+
+    small = dedup.compact(max_docs=5)
+    # 3 seen in this run + the 2 most recently added of the 4 others
+    assert small.ids == [content_hash(c) for c in old[:2] + old[4:]] + [hashes[2]]
+    small.save(str(path))
+    keep, _ = _build(path, current + [current[0]])
+    assert keep == [True, True, True, False]
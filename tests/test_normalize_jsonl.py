@@ -0,0 +1,92 @@
+import ast
+import json
+
+import pytest
+
+from normalize_jsonl import normalize_jsonl, parse_line, validate
+
+pytest.importorskip("tokenizers")
+transformers = pytest.importorskip("transformers")
+
+MIN_LEN, MAX_LEN = 20, 200
+
+
+@pytest.fixture(scope="module")
+def engine():
+    from tokenizers import Tokenizer, models, pre_tokenizers, trainers
+    from tokenize_norm import TokenLengthEngine
+
+    tok = Tokenizer(models.BPE())
+    tok.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    trainer = trainers.BpeTrainer(vocab_size=300, initial_alphabet=pre_tokenizers.ByteLevel.alphabet())
+    tok.train_from_iterator(["system user assistant: Bạn là biên tập viên. Mưa lớn gây ngập nhiều tuyến phố."] * 20,
+                            trainer)
+    return TokenLengthEngine(tokenizer=transformers.PreTrainedTokenizerFast(tokenizer_object=tok), processes=1)
+
+
+def _records():
+    def conv(*turns):
+        return {"conversations": [{"role": r, "content": c} for r, c in turns]}
+    return [
+        conv(("system", "Bạn là biên tập viên."), ("user", "Viết tiêu đề."), ("assistant", "Mưa lớn gây ngập")),
+        conv(("user", "Hi"), ("assistant", "ok")),                                   # too short
+        conv(("user", "Viết tiêu đề " * 30), ("assistant", "Mưa lớn")),              # too long
+        conv(("system", "Bạn là biên tập viên."), ("user", "Viết lead cho bài."), ("assistant", "")),
+        conv(("user", "Mưa lớn gây ngập nhiều tuyến phố, viết tiêu đề"), ("assistant", "Phố ngập sau mưa")),
+    ]
+
+
+def _old_chain(lines, tokenizer):
+    """tokenize_norm.py + fix_jsonl.py as they were before normalize_jsonl.py."""
+    kept = []
+    for item in lines:
+        item_dict = ast.literal_eval(item)
+        text = "".join(c["role"] + ": " + c["content"] + "\n" for c in item_dict["conversations"])
+        if len(tokenizer.encode(text, add_special_tokens=False)) in range(MIN_LEN, MAX_LEN + 1):
+            kept.append(json.dumps(item, ensure_ascii=False))
+    out = []
+    for line in kept:
+        obj = json.loads(line)
+        if isinstance(obj, str):
+            obj = json.loads(obj)
+        out.append(obj)
+    return out
+
+
+def test_matches_the_old_two_step_chain(engine, tmp_path):
+    src = tmp_path / "train.jsonl"
+    lines = [json.dumps(r, ensure_ascii=False) + "\n" for r in _records()]
+    src.write_text("".join(lines), encoding="utf-8")
+    out = tmp_path / "fixed.jsonl"
+
+    result = normalize_jsonl(str(src), str(out), engine, MIN_LEN, MAX_LEN, cache_path=None)
+
+    expected = _old_chain(lines, engine.tokenizer)
+    got = [json.loads(line) for line in out.read_text(encoding="utf-8").splitlines()]
+    assert got == expected
+    assert len(got) == 3 and _records()[3] in got     # empty answers are kept, as before
+    assert result["dropped"] == {"too short": 1, "too long": 1} and result["lines"] == 5
+
+
+def test_require_answer_and_legacy_lines(engine, tmp_path):
+    records = _records()
+    src = tmp_path / "train.jsonl"
+    with open(src, "w", encoding="utf-8") as f:
+        f.write(json.dumps(records[0], ensure_ascii=False) + "\n")
+        f.write(json.dumps(json.dumps(records[4], ensure_ascii=False)) + "\n")   # old _norm double encoding
+        f.write(repr(records[3]) + "\n")                                       # Python repr
+        f.write("{not json\n")
+    out = tmp_path / "fixed.jsonl"
+    result = normalize_jsonl(str(src), str(out), engine, MIN_LEN, MAX_LEN, cache_path=None, require_answer=True)
+    got = [json.loads(line) for line in out.read_text(encoding="utf-8").splitlines()]
+    assert got == [records[0], records[4]]
+    assert result["dropped"] == {"no assistant answer": 1, "unparseable": 1}
+
+
+def test_validate():
+    assert validate({"conversations": [{"role": "tool", "content": "x"}]}) is None
+    assert validate({"conversations": []}) == "no conversations"
+    assert validate({"conversations": [{"role": "user", "content": None}]}) == "bad turn"
+    assert validate({"conversations": [{"role": "assistant", "content": " "}]}, require_answer=True) \
+        == "no assistant answer"
+    assert parse_line(b"[1, 2]") is None
@@ -0,0 +1,236 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import ollama_client
+from ollama_client import AdaptiveLimiter, CircuitOpenError, ClientPolicy, EndpointPool, TokenBucket, stream_chat
+
+CHUNK_DELAY = 0.1
+N_CHUNKS = 5
+
+
+class _SSEHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.startswith("/fail"):
+            body = b'{"error": "bad request"}'
+            self.send_response(400)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for i in range(N_CHUNKS):
+            if i == 2:
+                # Let the test observe the counters while the stream is still open
+                self.server.mid_stream.wait(2)
+            event = {"choices": [{"delta": {"content": f"w{i} "}}]}
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+            self.wfile.flush()
+            time.sleep(CHUNK_DELAY)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+
+@pytest.fixture
+def server():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _SSEHandler)
+    srv.mid_stream = threading.Event()
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield srv
+    srv.shutdown()
+
+
+def test_stream_holds_backend_and_limiter_until_body_is_consumed(server):
+    url = f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+    pool = EndpointPool([url])
+    policy = ClientPolicy(rate=None, max_concurrency=4)
+    seen = {}
+
+    def watch():
+        time.sleep(2 * CHUNK_DELAY)
+        seen["outstanding"] = pool.backends[0].outstanding
+        seen["in_flight"] = policy.limiter.in_flight
+        server.mid_stream.set()
+
+    watcher = threading.Thread(target=watch)
+    watcher.start()
+    out = stream_chat(pool, {"model": "m", "messages": []}, timeout=10, policy=policy)
+    watcher.join()
+
+    assert out["choices"][0]["message"]["content"] == "".join(f"w{i} " for i in range(N_CHUNKS))
+    assert seen == {"outstanding": 1, "in_flight": 1}
+    backend = pool.backends[0]
+    assert backend.outstanding == 0 and policy.limiter.in_flight == 0
+    # Latency covers the whole generation, not just the time to the first byte
+    assert backend.ewma_latency >= N_CHUNKS * CHUNK_DELAY * 0.9
+    assert out["metrics"]["latency_s"] >= backend.ewma_latency
+
+
+def test_stream_released_on_http_error(server):
+    url = f"http://127.0.0.1:{server.server_port}/fail"
+    pool = EndpointPool([url])
+    policy = ClientPolicy(rate=None, max_concurrency=4)
+    with pytest.raises(ollama_client.requests.HTTPError):
+        stream_chat(pool, {"model": "m", "messages": []}, timeout=10, policy=policy)
+    assert pool.backends[0].outstanding == 0
+    assert policy.limiter.in_flight == 0
+
+
+def test_early_stop_releases_slots(server):
+    url = f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+    server.mid_stream.set()
+    pool = EndpointPool([url])
+    policy = ClientPolicy(rate=None, max_concurrency=4)
+    out = stream_chat(pool, {"model": "m", "messages": []}, timeout=10, policy=policy, max_words=1)
+    assert out["metrics"]["early_stop"]
+    assert pool.backends[0].outstanding == 0 and policy.limiter.in_flight == 0
+
+
+def _response(status, retry_after=None):
+    resp = ollama_client.requests.Response()
+    resp.status_code = status
+    resp.url = "http://backend/v1/chat/completions"
+    resp.reason = "test"
+    resp._content = b"{}"
+    resp._content_consumed = True
+    if retry_after is not None:
+        resp.headers["Retry-After"] = str(retry_after)
+    return resp
+
+
+class _FakeSend:
+    """Returns / raises the scripted outcomes in order, one per attempt."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def __call__(self):
+        outcome = self.outcomes[min(self.calls, len(self.outcomes) - 1)]
+        self.calls += 1
+        if isinstance(outcome, Exception):
+            raise outcome
+        return _response(*outcome) if isinstance(outcome, tuple) else _response(outcome)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(ollama_client.time, "sleep", delays.append)
+    return delays
+
+
+def test_retries_429_and_5xx_then_succeeds(sleeps):
+    policy = ClientPolicy(rate=None, max_retries=4, backoff_base=0.5, backoff_cap=30)
+    send = _FakeSend((429, 7), 503, ollama_client.requests.ConnectionError("reset"), 200)
+    assert policy.call(send).status_code == 200
+    assert send.calls == 4 and policy.retries == 3
+    # Retry-After wins over the backoff; the others are jittered exponential delays
+    assert sleeps[0] == 7.0
+    assert 0 <= sleeps[1] <= 0.5 * 2 and 0 <= sleeps[2] <= 0.5 * 4
+    assert policy.limiter.in_flight == 0
+
+
+def test_gives_up_after_max_retries(sleeps):
+    policy = ClientPolicy(rate=None, max_retries=2)
+    send = _FakeSend(502)
+    with pytest.raises(ollama_client.requests.HTTPError):
+        policy.call(send)
+    assert send.calls == 3 and policy.retries == 2 and len(sleeps) == 2
+    assert policy.limiter.in_flight == 0
+
+
+@pytest.mark.parametrize("status", [400, 401, 404, 422])
+def test_client_errors_are_not_retried(status, sleeps):
+    policy = ClientPolicy(rate=None, max_retries=4)
+    send = _FakeSend(status)
+    assert policy.call(send).status_code == status
+    assert send.calls == 1 and policy.retries == 0 and sleeps == []
+
+
+def test_limiter_aimd():
+    limiter = AdaptiveLimiter(max_concurrency=8, target_latency=1.0, failures=100)
+    assert limiter.limit == 8
+    for latency, ok, expected in [(0.1, False, 4), (5.0, True, 2), (0.1, True, 3), (0.1, True, 4), (None, False, 2)]:
+        limiter.acquire()
+        limiter.release(latency, ok=ok)
+        assert limiter.limit == expected
+    # Never below the floor, never above the ceiling
+    for _ in range(5):
+        limiter.acquire()
+        limiter.release(0.1, ok=False)
+    assert limiter.limit == 1
+    for _ in range(20):
+        limiter.acquire()
+        limiter.release(0.1, ok=True)
+    assert limiter.limit == 8
+
+
+def test_limiter_caps_in_flight():
+    limiter = AdaptiveLimiter(max_concurrency=2)
+    limiter.acquire()
+    limiter.acquire()
+    with pytest.raises(CircuitOpenError):
+        limiter.acquire(timeout=0.05)
+    limiter.release(0.1, ok=True)
+    limiter.acquire(timeout=0.05)
+
+
+def test_circuit_breaker_opens_probes_and_closes():
+    limiter = AdaptiveLimiter(max_concurrency=4, failures=3, cooldown=0.2)
+    for _ in range(3):
+        limiter.acquire()
+        limiter.release(0.1, ok=False)
+    assert limiter.state == "open"
+    with pytest.raises(CircuitOpenError):
+        limiter.acquire(timeout=0.05)
+
+    time.sleep(0.2)
+    assert limiter.state == "half-open"
+    limiter.acquire(timeout=0.05)          # the single probe
+    with pytest.raises(CircuitOpenError):
+        limiter.acquire(timeout=0.05)
+    limiter.release(0.1, ok=False)         # failed probe re-opens the circuit
+    assert limiter.state == "open"
+
+    time.sleep(0.2)
+    limiter.acquire(timeout=0.05)
+    limiter.release(0.1, ok=True)          # successful probe closes it at the floor
+    assert limiter.state == "closed" and limiter.limit == limiter.min_concurrency
+
+
+def test_breaker_trips_through_the_policy(sleeps):
+    policy = ClientPolicy(rate=None, max_retries=10, breaker_failures=3, breaker_cooldown=0.2)
+    send = _FakeSend(503, 503, 503, 200)
+    t0 = time.monotonic()
+    assert policy.call(send).status_code == 200
+    # The 4th attempt waits out the cooldown and goes through as the half-open probe
+    assert time.monotonic() - t0 >= 0.2
+    assert send.calls == 4 and policy.retries == 3
+    assert policy.limiter.state == "closed" and policy.limiter.limit == policy.limiter.min_concurrency
+
+
+def test_token_bucket_rate():
+    bucket = TokenBucket(rate=50, burst=2)
+    t0 = time.monotonic()
+    for _ in range(2):
+        bucket.acquire()
+    assert time.monotonic() - t0 < 0.01
+    for _ in range(5):
+        bucket.acquire()
+    # 5 more tokens at 50/s take ~0.1s
+    assert 0.08 <= time.monotonic() - t0 < 0.5
+    TokenBucket(rate=None).acquire()
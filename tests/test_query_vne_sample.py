@@ -0,0 +1,115 @@
+import csv
+import json
+import threading
+import urllib.parse
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import query_vne_sample
+from query_vne_sample import ArticleFetcher, construct_test_file
+
+MISSING_ID = "404"
+FLAKY_ID = "503"
+
+
+class _GetFullHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        article_id = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)["article_id"][0]
+        with self.server.lock:
+            self.server.hits[article_id] += 1
+            n = self.server.hits[article_id]
+        if article_id == MISSING_ID:
+            status, body = 404, {"error": "not found"}
+        elif article_id == FLAKY_ID and n == 1:
+            status, body = 503, {"error": "busy"}
+        else:
+            status, body = 200, {"data": {"article_id": int(article_id), "title": f"Tiêu đề {article_id}",
+                                          "lead": f"Lead \"{article_id}\"", "content": f"<p>Bài {article_id}</p>"}}
+        data = json.dumps(body, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def server():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _GetFullHandler)
+    srv.hits = Counter()
+    srv.lock = threading.Lock()
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    srv.url = f"http://127.0.0.1:{srv.server_port}/ar/get_full"
+    yield srv
+    srv.shutdown()
+
+
+def _fetcher(server, cache_path):
+    fetcher = ArticleFetcher(workers=4, base_url=server.url, cache_path=cache_path, rate=None, timeout=5)
+    fetcher.policy.backoff_base = 0.01
+    return fetcher
+
+
+def test_fetch_retries_caches_and_skips_failures(server, tmp_path):
+    ids = {"đời sống": ["1", MISSING_ID, "2"], "khcn": [FLAKY_ID, "3"]}
+    cache = str(tmp_path / "cache.sqlite")
+    out = tmp_path / "a.csv"
+
+    with _fetcher(server, cache) as fetcher:
+        assert construct_test_file(ids, str(out), fetcher) == 4
+        assert (fetcher.fetched, fetcher.failed, fetcher.cache.hits) == (4, 1, 0)
+        assert fetcher.policy.retries == 1
+    assert server.hits[FLAKY_ID] == 2
+    with open(out, encoding="utf-8", newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert [(r["no"], r["type"], r["id"]) for r in rows] == [
+        ("1", "đời sống", "1"), ("2", "đời sống", "2"), ("3", "khcn", FLAKY_ID), ("4", "khcn", "3")]
+    assert rows[0]["title"] == "Tiêu đề 1" and rows[0]["lead"] == 'Lead "1"'
+
+    # Second run: every article comes from the cache, only the failed id is requested again
+    before = Counter(server.hits)
+    with _fetcher(server, cache) as fetcher:
+        assert construct_test_file(ids, str(tmp_path / "b.csv"), fetcher) == 4
+        assert (fetcher.fetched, fetcher.failed, fetcher.cache.hits) == (0, 1, 4)
+    assert server.hits - before == Counter({MISSING_ID: 1})
+    assert (tmp_path / "b.csv").read_bytes() == out.read_bytes()
+
+
+def test_construct_test_file_closes_its_own_fetcher(server, tmp_path, monkeypatch):
+    created = []
+
+    class Tracking(ArticleFetcher):
+        def __init__(self):
+            super().__init__(workers=2, base_url=server.url, cache_path=None, rate=None, timeout=5)
+            self.closed = False
+            created.append(self)
+
+        def close(self):
+            self.closed = True
+            super().close()
+
+    monkeypatch.setattr(query_vne_sample, "ArticleFetcher", Tracking)
+    assert construct_test_file({"du lịch": ["7"]}, str(tmp_path / "c.csv")) == 1
+    assert created[-1].closed
+
+    def boom(self, article_ids):
+        raise RuntimeError("interrupted")
+
+    monkeypatch.setattr(Tracking, "get_many", boom)
+    with pytest.raises(RuntimeError):
+        construct_test_file({"du lịch": ["8"]}, str(tmp_path / "d.csv"))
+    assert created[-1].closed
+
+
+def test_caller_fetcher_stays_open(server, tmp_path):
+    with _fetcher(server, str(tmp_path / "cache.sqlite")) as fetcher:
+        construct_test_file({"khcn": ["9"]}, str(tmp_path / "e.csv"), fetcher)
+        # The cache connection is still usable after construct_test_file returns
+        assert fetcher.get("9") is not None and fetcher.cache.hits == 1
@@ -0,0 +1,80 @@
+import json
+import os
+import zlib
+
+import response_cache
+from response_cache import ResponseCache, cache_key
+
+
+class _Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+def _key(prompt, temperature=0.5):
+    return cache_key("qwen3:8b", "system", prompt, temperature, 0.9, 256, seed=7)
+
+
+def test_hit_miss_and_persistence(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    resp = {"choices": [{"message": {"content": "Mưa lớn gây ngập"}}]}
+    with ResponseCache(path) as cache:
+        assert cache.get(_key("a")) is None
+        cache.put(_key("a"), resp)
+        assert cache.get(_key("a")) == resp
+        # Any generation parameter is part of the key
+        assert cache.get(_key("a", temperature=0.6)) is None
+        assert (cache.hits, cache.misses) == (1, 2)
+    with ResponseCache(path) as cache:
+        assert cache.get(_key("a")) == resp
+
+
+def test_ttl_is_enforced_during_a_run(tmp_path, monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(response_cache.time, "time", clock.time)
+    with ResponseCache(str(tmp_path / "cache.sqlite"), max_age_days=1) as cache:
+        cache.put(_key("old"), {"v": 1})
+        clock.now += 0.5 * 86400
+        cache.put(_key("new"), {"v": 2})
+        assert cache.get(_key("old")) == {"v": 1}
+        clock.now += 0.6 * 86400
+        # Same open cache: the expired entry is a miss and is removed
+        assert cache.get(_key("old")) is None
+        assert cache.get(_key("new")) == {"v": 2}
+        assert cache._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] == 1
+
+
+def test_size_limit_is_enforced_on_put(tmp_path, monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(response_cache.time, "time", clock.time)
+    blob = os.urandom(3000).hex()
+    entry = len(zlib.compress(json.dumps({"v": blob}).encode("utf-8")))
+    limit = int(3.5 * entry)
+    with ResponseCache(str(tmp_path / "cache.sqlite"), max_bytes=limit) as cache:
+        for i in range(3):
+            clock.now += 1
+            cache.put(_key(str(i)), {"v": blob})
+        clock.now += 1
+        assert cache.get(_key("0")) is not None     # 0 is now the most recently used
+        stored = []
+        for i in range(3, 6):
+            clock.now += 1
+            cache.put(_key(str(i)), {"v": blob})
+            assert cache._total <= limit
+            stored.append({k for (k,) in cache._conn.execute("SELECT key FROM responses")})
+    # Least recently used first: 1, 2, then 0 (read after 2 was written)
+    assert stored[0] == {_key("2"), _key("0"), _key("3")}
+    assert stored[1] == {_key("0"), _key("3"), _key("4")}
+    assert stored[2] == {_key("3"), _key("4"), _key("5")}
+
+
+def test_disabled_cache_is_a_bypass(tmp_path):
+    path = tmp_path / "cache.sqlite"
+    with ResponseCache(str(path), enabled=False) as cache:
+        cache.put(_key("a"), {"v": 1})
+        assert cache.get(_key("a")) is None
+        assert cache.evict() == 0 and (cache.hits, cache.misses) == (0, 0)
+    assert not path.exists()
@@ -0,0 +1,24 @@
+import pytest
+
+from rouge_batch import batch_rouge, check_parity
+
+pytest.importorskip("rouge_score")
+
+REFS = ["Mưa lớn gây ngập nhiều tuyến phố Hà Nội", "Giá xăng giảm lần thứ ba liên tiếp",
+        "Running dogs ran across the Park", "Đà Nẵng đón 2 triệu khách du lịch"]
+HYPS = ["Hà Nội ngập nặng sau mưa lớn", "Giá xăng tiếp tục giảm",
+        "the dog runs across a park", "Đà Nẵng đón hai triệu lượt khách"]
+
+
+@pytest.mark.parametrize("tokenizer", ["rouge", "vi"])
+@pytest.mark.parametrize("lower", [False, True])
+@pytest.mark.parametrize("use_stemmer", [False, True])
+def test_parity_with_run_settings(tokenizer, lower, use_stemmer):
+    assert check_parity(REFS, HYPS, use_stemmer=use_stemmer, tokenizer=tokenizer, lower=lower) == 0
+
+
+def test_vi_tokenizer_scores_differ_from_rouge_tokenizer():
+    # Parity must be checked with the tokenizer the run uses: the scores are not interchangeable
+    r2_rouge, _ = batch_rouge(REFS[:1], HYPS[:1], tokenizer="rouge")
+    r2_vi, _ = batch_rouge(REFS[:1], HYPS[:1], tokenizer="vi")
+    assert r2_rouge[0] != r2_vi[0]
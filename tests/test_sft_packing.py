@@ -0,0 +1,83 @@
+import pytest
+import torch
+
+import numpy as np
+
+from sft_packing import (IGNORE_INDEX, LengthGroupedSampler, PackedCollator, build_packed_examples,
+                         length_grouped_batches, pack_sequences)
+
+transformers = pytest.importorskip("transformers")
+
+
+def _tiny_qwen(attn_implementation):
+    config = transformers.Qwen2Config(vocab_size=97, hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+                                      num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=128)
+    torch.manual_seed(0)
+    model = transformers.Qwen2ForCausalLM._from_config(config, attn_implementation=attn_implementation)
+    return model.eval()
+
+
+def _samples():
+    g = torch.Generator().manual_seed(1)
+    lengths = [9, 5, 13, 7, 3, 11]
+    return [torch.randint(1, 97, (n,), generator=g).tolist() for n in lengths]
+
+
+@pytest.mark.parametrize("attn_implementation", ["eager", "sdpa"])
+def test_packed_logits_match_separate_samples(attn_implementation):
+    model = _tiny_qwen(attn_implementation)
+    samples = _samples()
+    max_len = 20
+    bins = pack_sequences([len(s) for s in samples], max_len)
+    rows = build_packed_examples(samples, None, bins, max_len)
+    # Same construction as finetune_qwen_unsloth.py --packing pack
+    collator = PackedCollator.for_model(model, pad_token_id=0, pad_to_multiple_of=8)
+    batch = collator(rows)
+    assert batch["attention_mask"].dim() == 4
+
+    with torch.no_grad():
+        packed = model(input_ids=batch["input_ids"], attention_mask=batch["attention_mask"],
+                       position_ids=batch["position_ids"]).logits
+        for r, b in enumerate(bins):
+            start = 0
+            for i in b:
+                n = len(samples[i])
+                alone = model(input_ids=torch.tensor([samples[i]])).logits[0]
+                torch.testing.assert_close(packed[r, start:start + n], alone, atol=1e-5, rtol=1e-4)
+                start += n
+
+
+def test_packed_rows_need_block_mask_without_flash_attention():
+    rows = build_packed_examples(_samples(), None, [[0, 1], [2]], 20)
+    with pytest.raises(ValueError):
+        PackedCollator(0, attn_implementation="sdpa")(rows)
+
+
+def test_flash_attention_packed_rows_have_no_attention_mask():
+    rows = build_packed_examples(_samples(), None, [[0, 1], [2]], 20)
+    batch = PackedCollator(0, pad_to_multiple_of=8, attn_implementation="flash_attention_2")(rows)
+    assert "attention_mask" not in batch
+    # every sample restarts at position 0; padding continues the last sample
+    assert batch["position_ids"][0, :14].tolist() == list(range(9)) + list(range(5))
+    assert batch["position_ids"][1].tolist() == list(range(16))
+    assert batch["labels"][0, 0] == IGNORE_INDEX and batch["labels"][0, 9] == IGNORE_INDEX
+
+
+def test_unpacked_rows_keep_padding_mask():
+    rows = [{"input_ids": [5, 6, 7], "labels": [5, 6, 7]}, {"input_ids": [8], "labels": [8]}]
+    batch = PackedCollator(0, attn_implementation="sdpa")(rows)
+    assert batch["attention_mask"].tolist() == [[1, 1, 1], [1, 0, 0]]
+
+
+def test_length_grouped_sampler_uses_given_lengths():
+    lengths = np.random.default_rng(0).integers(10, 2000, size=1000)
+    sampler = LengthGroupedSampler(lengths, batch_size=4, megabatch_mult=10, seed=3)
+    order = list(sampler)
+    assert len(order) == len(sampler) == 1000 and sorted(order) == list(range(1000))
+    assert order == [i for b in length_grouped_batches(lengths, 4, 10, seed=3) for i in b]
+    # every megabatch is sorted longest first
+    for start in range(0, 1000, 40):
+        chunk = lengths[order[start:start + 40]]
+        assert (np.diff(chunk) <= 0).all()
+    sampler.set_epoch(1)
+    assert list(sampler) != order
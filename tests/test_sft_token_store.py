@@ -0,0 +1,184 @@
+import json
+
+import numpy as np
+import pytest
+
+from sft_token_store import (ASSISTANT_END, ASSISTANT_START, IGNORE_INDEX, TokenStore, assistant_mask_scan,
+                             assistant_masks, assistant_masks_offsets, build_token_store)
+
+tokenizers = pytest.importorskip("tokenizers")
+transformers = pytest.importorskip("transformers")
+
+# Qwen2.5 / Qwen3 ChatML layout
+QWEN_TEMPLATE = (
+    "{%- for message in messages %}"
+    "{{- '<|im_start|>' + message['role'] + '\\n' + message['content'] + '<|im_end|>' + '\\n' }}"
+    "{%- endfor %}"
+    "{%- if add_generation_prompt %}{{- '<|im_start|>assistant\\n' }}{%- endif %}"
+)
+
+CORPUS = [
+    "Bạn là tổng biên tập báo chí dày dạn kinh nghiệm.",
+    "Hãy viết MỘT LEAD duy nhất dựa trên CONTENT sau: mưa lớn gây ngập nhiều tuyến phố.",
+    "Mất điện, nước vì trận lụt, nhiều gia đình phải lên xuống 23 tầng bằng thang bộ.",
+    "assistant user system think Okay the user wants a short title.",
+]
+
+
+@pytest.fixture(scope="module")
+def tokenizer():
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+
+    tok = Tokenizer(models.BPE())
+    tok.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tok.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(vocab_size=400, special_tokens=["<|endoftext|>", "<|im_start|>", "<|im_end|>"],
+                                  initial_alphabet=pre_tokenizers.ByteLevel.alphabet())
+    tok.train_from_iterator(CORPUS * 20, trainer)
+    fast = transformers.PreTrainedTokenizerFast(tokenizer_object=tok, eos_token="<|im_end|>",
+                                                pad_token="<|endoftext|>")
+    # Qwen3 keeps <think> / </think> as added (non-special) tokens
+    fast.add_tokens(["<think>", "</think>"])
+    fast.chat_template = QWEN_TEMPLATE
+    return fast
+
+
+CONVERSATIONS = {
+    "system + single turn": [
+        {"role": "system", "content": "Bạn là tổng biên tập báo chí."},
+        {"role": "user", "content": "Hãy viết MỘT LEAD duy nhất dựa trên CONTENT sau: mưa lớn."},
+        {"role": "assistant", "content": "Mưa lớn gây ngập nhiều tuyến phố."},
+    ],
+    "multi-turn with system": [
+        {"role": "system", "content": "Bạn là tổng biên tập báo chí."},
+        {"role": "user", "content": "Viết LEAD: mất điện."},
+        {"role": "assistant", "content": "Nhiều gia đình mất điện, nước vì trận lụt."},
+        {"role": "user", "content": "Giờ viết tiêu đề."},
+        {"role": "assistant", "content": "Lên xuống 23 tầng bằng thang bộ"},
+    ],
+    "think block": [
+        {"role": "system", "content": "Bạn là tổng biên tập báo chí."},
+        {"role": "user", "content": "Viết tiêu đề."},
+        {"role": "assistant", "content": "<think>\nOkay the user wants a short title.\n</think>\n\nMưa lớn gây ngập"},
+    ],
+    "no system prompt": [
+        {"role": "user", "content": "Viết tiêu đề."},
+        {"role": "assistant", "content": "Ngập nhiều tuyến phố"},
+    ],
+}
+
+
+def _runs(mask):
+    """[start, stop) of every run of 1s."""
+    padded = np.concatenate([[0], mask.astype(np.int8), [0]])
+    edges = np.flatnonzero(np.diff(padded))
+    return list(zip(edges[::2], edges[1::2]))
+
+
+def _render(tokenizer, messages):
+    return tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=False)
+
+
+def test_template_markers_match_constants(tokenizer):
+    text = _render(tokenizer, CONVERSATIONS["no system prompt"])
+    assert ASSISTANT_START in text and text.rstrip("\n").endswith(ASSISTANT_END)
+
+
+@pytest.mark.parametrize("name", list(CONVERSATIONS))
+def test_mask_covers_exactly_the_assistant_turns(tokenizer, name):
+    messages = CONVERSATIONS[name]
+    text = _render(tokenizer, messages)
+    enc = tokenizer([text], add_special_tokens=False, return_attention_mask=False)
+    ids = enc["input_ids"][0]
+    mask = assistant_masks([text], enc)[0]
+    enc_offsets = tokenizer([text], add_special_tokens=False, return_offsets_mapping=True)
+    assert np.array_equal(assistant_masks_offsets([text], enc_offsets)[0], mask)
+
+    expected = [m["content"] + "<|im_end|>" for m in messages if m["role"] == "assistant"]
+    runs = _runs(mask)
+    assert [tokenizer.decode(ids[a:b]) for a, b in runs] == expected
+    # every trained span starts right after "<|im_start|>assistant\n"
+    for a, _ in runs:
+        assert tokenizer.decode(ids[:a]).endswith("<|im_start|>assistant\n")
+    # the per-sample reference scan over token ids agrees
+    start_ids = tokenizer.encode(ASSISTANT_START, add_special_tokens=False)
+    end_ids = tokenizer.encode(ASSISTANT_END, add_special_tokens=False)
+    assert np.array_equal(mask, assistant_mask_scan(ids, start_ids, end_ids))
+
+
+def test_batch_with_truncated_and_answerless_samples(tokenizer):
+    full = _render(tokenizer, CONVERSATIONS["multi-turn with system"])
+    cut = full[:full.rindex("23 tầng")]
+    no_answer = _render(tokenizer, CONVERSATIONS["no system prompt"][:1])
+    texts = [full, cut, no_answer, ""]
+    enc = tokenizer(texts, add_special_tokens=False, return_attention_mask=False)
+    masks = assistant_masks(texts, enc)
+    enc_offsets = tokenizer(texts, add_special_tokens=False, return_attention_mask=False,
+                            return_offsets_mapping=True)
+    for a, b in zip(masks, assistant_masks_offsets(texts, enc_offsets)):
+        assert np.array_equal(a, b)
+
+    assert [len(m) for m in masks] == [len(x) for x in enc["input_ids"]]
+    decoded = [[tokenizer.decode(np.asarray(ids)[a:b].tolist()) for a, b in _runs(m)]
+               for ids, m in zip(enc["input_ids"], masks)]
+    assert decoded[0] == ["Nhiều gia đình mất điện, nước vì trận lụt.<|im_end|>",
+                          "Lên xuống 23 tầng bằng thang bộ<|im_end|>"]
+    # an answer cut off before <|im_end|> is trained on up to the cut
+    assert decoded[1] == ["Nhiều gia đình mất điện, nước vì trận lụt.<|im_end|>", "Lên xuống "]
+    assert decoded[2] == [] and decoded[3] == []
+
+
+def test_token_store_labels(tokenizer, tmp_path):
+    path = tmp_path / "train.jsonl"
+    with open(path, "w", encoding="utf-8") as f:
+        for messages in CONVERSATIONS.values():
+            f.write(json.dumps({"conversations": messages}, ensure_ascii=False) + "\n")
+    store = build_token_store(str(path), tokenizer, str(tmp_path / "store"),
+                              render=lambda r: _render(tokenizer, r["conversations"]), batch_size=3)
+    row = store[1]
+    trained = [t for t, lab in zip(row["input_ids"], row["labels"]) if lab != IGNORE_INDEX]
+    assert tokenizer.decode(trained) == ("Nhiều gia đình mất điện, nước vì trận lụt.<|im_end|>"
+                                         "Lên xuống 23 tầng bằng thang bộ<|im_end|>")
+    assert isinstance(TokenStore(store.path), TokenStore) and len(store) == len(CONVERSATIONS)
+
+
+def test_token_store_records_lengths_before_truncation(tokenizer, tmp_path):
+    path = tmp_path / "train.jsonl"
+    with open(path, "w", encoding="utf-8") as f:
+        for messages in CONVERSATIONS.values():
+            f.write(json.dumps({"conversations": messages}, ensure_ascii=False) + "\n")
+    render = lambda r: _render(tokenizer, r["conversations"])
+    full = [len(tokenizer(render({"conversations": m}), add_special_tokens=False)["input_ids"])
+            for m in CONVERSATIONS.values()]
+    max_seq_len = sorted(full)[1]
+    store = build_token_store(str(path), tokenizer, str(tmp_path / "store"), render=render,
+                              max_seq_len=max_seq_len)
+    assert store.raw_lengths.tolist() == full
+    assert store.lengths.tolist() == [min(n, max_seq_len) for n in full]
+    assert store.meta["truncated"] == sum(n > max_seq_len for n in full) == 2
+    assert store.select([3, 0]).raw_lengths.tolist() == [full[3], full[0]]
+
+
+def test_store_key_follows_the_render_logic(tokenizer, tmp_path):
+    from sft_token_store import load_or_build, source_id
+
+    path = tmp_path / "train.jsonl"
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"conversations": CONVERSATIONS["no system prompt"]}, ensure_ascii=False) + "\n")
+
+    def render_plain(r):
+        return _render(tokenizer, r["conversations"])
+
+    def render_with_system(r):
+        return _render(tokenizer, [{"role": "system", "content": "Bạn là biên tập viên."}] + r["conversations"])
+
+    cache = str(tmp_path / "cache")
+    a = load_or_build(str(path), tokenizer, render_plain, cache_dir=cache)
+    assert load_or_build(str(path), tokenizer, render_plain, cache_dir=cache).path == a.path
+    b = load_or_build(str(path), tokenizer, render_with_system, cache_dir=cache)
+    assert b.path != a.path and len(b.tokens(0)[0]) > len(a.tokens(0)[0])
+    # Helpers called through a lambda are covered by an explicit render_id
+    c = load_or_build(str(path), tokenizer, lambda r: render_plain(r), cache_dir=cache,
+                      render_id=source_id(render_with_system))
+    assert c.path != a.path
+    assert source_id(render_plain) == source_id(render_plain) != source_id(render_plain, render_with_system)
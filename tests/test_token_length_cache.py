@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+
+from token_length_cache import LengthIndex, TokenLengthCache, tokenizer_id
+
+pytest.importorskip("tokenizers")
+transformers = pytest.importorskip("transformers")
+
+TEXTS = ["Mưa lớn gây ngập nhiều tuyến phố.", "Bạn là biên tập viên.", "Giá vàng tăng mạnh.",
+         "Mưa lớn gây ngập nhiều tuyến phố."]
+
+
+def _tokenizer(corpus, vocab_size=300):
+    from tokenizers import Tokenizer, models, pre_tokenizers, trainers
+
+    tok = Tokenizer(models.BPE())
+    tok.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    trainer = trainers.BpeTrainer(vocab_size=vocab_size, initial_alphabet=pre_tokenizers.ByteLevel.alphabet())
+    tok.train_from_iterator([corpus] * 20, trainer)
+    fast = transformers.PreTrainedTokenizerFast(tokenizer_object=tok)
+    fast.name_or_path = "tiny-bpe"
+    return fast
+
+
+@pytest.fixture(scope="module")
+def tokenizer():
+    return _tokenizer(" ".join(TEXTS))
+
+
+class _Counter:
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return [len(self.tokenizer.encode(t, add_special_tokens=False)) for t in texts]
+
+
+def test_lengths_are_reused_across_runs(tmp_path, tokenizer):
+    path = str(tmp_path / "lengths.sqlite")
+    count = _Counter(tokenizer)
+    expected = count(TEXTS)
+    count.calls.clear()
+
+    with TokenLengthCache(path, tokenizer_id(tokenizer)) as cache:
+        assert cache.lengths(TEXTS, count).tolist() == expected
+        # The duplicated text is tokenized once (and is not a cache hit)
+        assert count.calls == [TEXTS[:3]] and (cache.hits, cache.misses) == (0, 3)
+
+    with TokenLengthCache(path, tokenizer_id(tokenizer)) as cache:
+        texts = TEXTS[::-1] + ["Tỷ giá USD giảm."]
+        out = cache.lengths(texts, count)
+        assert out.dtype == np.int32 and out.tolist()[:4] == expected[::-1]
+        assert count.calls[1:] == [["Tỷ giá USD giảm."]] and (cache.hits, cache.misses) == (4, 1)
+
+
+def test_changed_tokenizer_is_not_served_stale_lengths(tmp_path, tokenizer):
+    path = str(tmp_path / "lengths.sqlite")
+    # Same name, different merges: the id must differ
+    retrained = _tokenizer("một kho ngữ liệu hoàn toàn khác", vocab_size=270)
+    assert tokenizer.name_or_path == retrained.name_or_path
+    assert tokenizer_id(tokenizer) != tokenizer_id(retrained)
+    assert tokenizer_id(tokenizer) == tokenizer_id(_tokenizer(" ".join(TEXTS)))
+
+    with TokenLengthCache(path, tokenizer_id(tokenizer)) as cache:
+        old = cache.lengths(TEXTS, _Counter(tokenizer)).tolist()
+    count = _Counter(retrained)
+    with TokenLengthCache(path, tokenizer_id(retrained)) as cache:
+        new = cache.lengths(TEXTS, count).tolist()
+        assert cache.misses == 3 and len(count.calls) == 1
+    assert new == count(TEXTS) and new != old
+
+
+def test_engine_cached_lengths_and_explicit_multi(tmp_path, tokenizer, monkeypatch):
+    import tokenize_norm
+    from tokenize_norm import TokenLengthEngine
+
+    def no_pool(*args, **kwargs):
+        raise AssertionError("multi-process pool started without mode='multi'")
+
+    monkeypatch.setattr(tokenize_norm.mp, "Pool", no_pool)
+    engine = TokenLengthEngine(tokenizer=tokenizer, processes=8)
+    texts = TEXTS * 300
+    expected = np.array(_Counter(tokenizer)(texts), dtype=np.int32)
+    # auto never goes multi-process, whatever the corpus size or process count
+    assert np.array_equal(engine.lengths(texts), expected)
+    assert np.array_equal(engine.lengths(texts, mode="single"), expected)
+    with pytest.raises(AssertionError, match="pool started"):
+        engine.lengths(texts, mode="multi")
+    with pytest.raises(ValueError):
+        engine.lengths(texts, mode="threads")
+
+    path = str(tmp_path / "lengths.sqlite")
+    assert np.array_equal(engine.cached_lengths(texts, path), expected)
+    calls = []
+    monkeypatch.setattr(engine, "lengths", lambda missing, *a: calls.append(missing) or expected[:0])
+    assert np.array_equal(engine.cached_lengths(texts, path), expected)
+    assert calls == []
+    # add_special_tokens is part of the cache id
+    with TokenLengthCache(path, tokenizer_id(tokenizer) + "+special") as cache:
+        assert cache.get_many(["x"]) == {}
+
+
+def test_length_index_queries():
+    index = LengthIndex([10, 300, 50, 4000, 120])
+    assert index.count_between(50, 300) == 3
+    assert index.mask(50, 300).tolist() == [False, True, True, False, True]
+    assert index.suggest_max_seq_len(0.8) == 320
+    assert LengthIndex([]).summary() == {"samples": 0}
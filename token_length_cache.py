@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent token-length sidecar for the training corpus.
+
+Lengths are stored in SQLite keyed by (tokenizer id, sha1 of the sample text), so a
+sample is tokenized once per tokenizer; re-running the length filter with other
+thresholds, picking finetune's max_seq_len or planning packed batches only reads
+the stored lengths. LengthIndex answers percentile / histogram / range queries on
+the resulting array.
+
+Usage:
+    cache = TokenLengthCache(".token_lengths.sqlite", tokenizer_id(tokenizer))
+    lengths = cache.lengths(texts, lambda missing: batch_token_lengths(tokenizer, missing))
+    index = LengthIndex(lengths)
+    keep = index.mask(200, 4096)
+    print(index.percentile([50, 95, 99]), index.suggest_max_seq_len(0.99))
+"""
+
+import hashlib
+import sqlite3
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+LENGTH_CACHE_PATH = "./.token_lengths.sqlite"
+
+
+def tokenizer_id(tokenizer) -> str:
+    """
+    Name plus a hash of the tokenizer definition, so a re-trained or edited tokenizer
+    under the same name does not reuse stale lengths.
+    """
+    name = getattr(tokenizer, "name_or_path", "") or type(tokenizer).__name__
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        spec = backend.to_str()
+    else:
+        spec = repr(sorted(tokenizer.get_vocab().items()))
+    return f"{name}@{hashlib.sha256(spec.encode('utf-8')).hexdigest()[:12]}"
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class TokenLengthCache:
+    def __init__(self, path: str = LENGTH_CACHE_PATH, tokenizer: str = ""):
+        self.path = path
+        self.tokenizer = tokenizer
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS lengths ("
+            " tokenizer TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " length INTEGER NOT NULL,"
+            " PRIMARY KEY (tokenizer, key))"
+        )
+        self.conn.commit()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, int]:
+        keys = list(dict.fromkeys(keys))
+        found: Dict[str, int] = {}
+        # Stay under SQLite's bound-parameter limit
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            q = f"SELECT key, length FROM lengths WHERE tokenizer = ? AND key IN ({','.join('?' * len(batch))})"
+            for key, length in self.conn.execute(q, [self.tokenizer] + batch):
+                found[key] = length
+        return found
+
+    def put_many(self, items: Iterable[Tuple[str, int]]) -> None:
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO lengths (tokenizer, key, length) VALUES (?, ?, ?)",
+            ((self.tokenizer, key, int(length)) for key, length in items),
+        )
+        self.conn.commit()
+
+    def lengths(self, texts: Sequence[str], count_fn: Callable[[List[str]], Sequence[int]]) -> np.ndarray:
+        """
+        Token length of every text (int32, aligned with `texts`); only texts missing
+        from the cache are passed to `count_fn(texts) -> lengths`.
+        """
+        keys = [text_key(t) for t in texts]
+        found = self.get_many(keys)
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        self.misses += len(missing)
+        self.hits += len(keys) - sum(1 for k in keys if k in missing)
+        if missing:
+            counts = count_fn(list(missing.values()))
+            fresh = dict(zip(missing.keys(), (int(c) for c in counts)))
+            self.put_many(fresh.items())
+            found.update(fresh)
+        return np.fromiter((found[k] for k in keys), dtype=np.int32, count=len(keys))
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class LengthIndex:
+    """
+    Read-only queries over a corpus' token lengths (kept sorted for O(log n) range counts).
+    """
+
+    def __init__(self, lengths: Sequence[int]):
+        self.lengths = np.asarray(lengths, dtype=np.int32)
+        self.sorted = np.sort(self.lengths)
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def percentile(self, q):
+        return np.percentile(self.sorted, q) if len(self.sorted) else np.zeros_like(np.asarray(q, dtype=float))
+
+    def count_between(self, lo: int, hi: int) -> int:
+        """Samples with lo <= length <= hi."""
+        return int(np.searchsorted(self.sorted, hi, side="right") - np.searchsorted(self.sorted, lo, side="left"))
+
+    def mask(self, lo: int, hi: int) -> np.ndarray:
+        """Boolean keep-mask (aligned with the corpus) for lo <= length <= hi."""
+        return (self.lengths >= lo) & (self.lengths <= hi)
+
+    def histogram(self, bins=32, range: Optional[Tuple[int, int]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        return np.histogram(self.lengths, bins=bins, range=range)
+
+    def suggest_max_seq_len(self, coverage: float = 0.99, multiple: int = 64) -> int:
+        """Smallest multiple of `multiple` that fits `coverage` of the samples untruncated."""
+        if not len(self.sorted):
+            return multiple
+        need = int(self.sorted[min(len(self.sorted) - 1, int(np.ceil(coverage * len(self.sorted))) - 1)])
+        return max(multiple, -(-need // multiple) * multiple)
+
+    def summary(self) -> Dict[str, float]:
+        if not len(self.sorted):
+            return {"samples": 0}
+        p50, p90, p95, p99 = self.percentile([50, 90, 95, 99])
+        return {
+            "samples": len(self.sorted),
+            "total": int(self.sorted.sum(dtype=np.int64)),
+            "min": int(self.sorted[0]),
+            "mean": float(self.sorted.mean()),
+            "p50": float(p50), "p90": float(p90), "p95": float(p95), "p99": float(p99),
+            "max": int(self.sorted[-1]),
+        }
+
+    def print_histogram(self, bins: int = 16, width: int = 40) -> None:
+        counts, edges = self.histogram(bins)
+        top = max(int(counts.max()), 1) if len(counts) else 1
+        for c, lo, hi in zip(counts, edges[:-1], edges[1:]):
+            print(f"  {int(lo):>6}-{int(hi):<6} {int(c):>8} {'#' * int(round(width * c / top))}")
@@ -1,16 +1,21 @@
 ﻿from __future__ import annotations
 
 import argparse
-import json
 import multiprocessing as mp
 
-from typing import Dict, Iterable, Iterator, List, Tuple
+import time
+from typing import Dict, List, Tuple
+import numpy as np
 from tqdm import tqdm
 from transformers import AutoTokenizer
 import os
+from token_length_cache import LENGTH_CACHE_PATH, TokenLengthCache, tokenizer_id
 DEFAULT_DATA_PATH = "./ecommerce_alpaca_pretty.json"
 DEFAULT_QWEN_MODEL = "Qwen/Qwen3-8B"
 
+# Texts per batch encode call
+TOKENIZE_BATCH_SIZE = 1024
+
 access_token = os.getenv("HF_TOKEN")
 
 
@@ -31,33 +36,125 @@ def count_qwen_tokens(context: str, model_id: str = DEFAULT_QWEN_MODEL, add_spec
     tokens = len(_tokenizer.encode(context, add_special_tokens=add_special_tokens))
     return tokens
 
-import ast
+
+def batch_token_lengths(tokenizer, texts: List[str], add_special_tokens: bool = False,
+                        batch_size: int = TOKENIZE_BATCH_SIZE) -> np.ndarray:
+    out = np.empty(len(texts), dtype=np.int32)
+    for i in range(0, len(texts), batch_size):
+        enc = tokenizer(texts[i:i + batch_size], add_special_tokens=add_special_tokens,
+                        return_attention_mask=False, return_token_type_ids=False, return_length=True)
+        out[i:i + batch_size] = enc["length"]
+    return out
+
+
+def _init_worker(model_id: str, hf_token: str) -> None:
+    # Workers already give one process per core; keep each tokenizer single-threaded
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    _init_tokenizer(model_id, hf_token)
+
+
+def _worker_lengths(args: Tuple[List[str], bool, int]) -> np.ndarray:
+    texts, add_special_tokens, batch_size = args
+    return batch_token_lengths(_tokenizer, texts, add_special_tokens, batch_size)
+
+
+class TokenLengthEngine:
+    """
+    Token counts for many texts with one batch-encode call per TOKENIZE_BATCH_SIZE texts.
+
+    mode: "auto" / "single" encode in this process (the fast tokenizer already batches
+    natively); "multi" spreads the batches over `processes` workers and is only used
+    when asked for explicitly (e.g. the benchmark), never picked automatically.
+    """
+
+    def __init__(self, model_id: str = DEFAULT_QWEN_MODEL, hf_token: str | None = access_token,
+                 batch_size: int = TOKENIZE_BATCH_SIZE, processes: int | None = None, tokenizer=None):
+        self.model_id = model_id
+        self.hf_token = hf_token
+        self.batch_size = batch_size
+        self.processes = processes or os.cpu_count() or 1
+        self.tokenizer = tokenizer or AutoTokenizer.from_pretrained(model_id, trust_remote_code=True, token=hf_token)
+
+    def lengths(self, texts: List[str], add_special_tokens: bool = False, mode: str = "auto") -> np.ndarray:
+        """Token length of every text as an int32 array aligned with `texts`."""
+        texts = list(texts)
+        if mode not in ("auto", "single", "multi"):
+            raise ValueError(f"Unknown mode: {mode!r} (expected auto, single or multi)")
+        if mode != "multi" or len(texts) < 2:
+            return batch_token_lengths(self.tokenizer, texts, add_special_tokens, self.batch_size)
+
+        # Small inputs are split so every process gets a share
+        step = max(1, min(self.batch_size, -(-len(texts) // self.processes)))
+        chunks = [(texts[i:i + step], add_special_tokens, step) for i in range(0, len(texts), step)]
+        with mp.Pool(processes=self.processes, initializer=_init_worker,
+                     initargs=(self.model_id, self.hf_token)) as pool:
+            parts = list(tqdm(pool.imap(_worker_lengths, chunks), total=len(chunks)))
+        return np.concatenate(parts)
+
+    def cached_lengths(self, texts: List[str], cache_path: str = LENGTH_CACHE_PATH,
+                       add_special_tokens: bool = False, mode: str = "auto") -> np.ndarray:
+        """Like lengths(), but only texts missing from the token-length sidecar are tokenized."""
+        tok_id = tokenizer_id(self.tokenizer) + ("+special" if add_special_tokens else "")
+        with TokenLengthCache(cache_path, tok_id) as cache:
+            out = cache.lengths(texts, lambda missing: self.lengths(missing, add_special_tokens, mode))
+            print(f"Token-length cache: {cache.hits} hits, {cache.misses} tokenized ({cache_path})")
+        return out
+
+
+def benchmark(texts: List[str], model_id: str = DEFAULT_QWEN_MODEL, processes: int | None = None) -> Dict[str, float]:
+    """
+    Texts/s of the old per-sample imap path and of the batched single / multi-process modes.
+    """
+    engine = TokenLengthEngine(model_id, processes=processes)
+    results: Dict[str, float] = {}
+
+    t0 = time.perf_counter()
+    with mp.Pool(processes=engine.processes, initializer=_init_tokenizer, initargs=(model_id, access_token)) as pool:
+        ref = np.array(pool.map(count_qwen_tokens, texts), dtype=np.int32)
+    results["per-sample imap"] = len(texts) / (time.perf_counter() - t0)
+
+    for mode in ("single", "multi"):
+        t0 = time.perf_counter()
+        got = engine.lengths(texts, mode=mode)
+        results[f"batched {mode}"] = len(texts) / (time.perf_counter() - t0)
+        if not np.array_equal(got, ref):
+            raise AssertionError(f"{mode} lengths differ from per-sample encode")
+
+    print(f"Tokenizer benchmark: {len(texts)} texts, {engine.processes} processes for multi "
+          f"(auto mode = single)")
+    for name, rate in results.items():
+        print(f"  {name:<16} {rate:10.1f} texts/s")
+    return results
+
+
 if __name__ == "__main__":
-    # with open(DEFAULT_DATA_PATH, "r", encoding="utf8") as f:
-    #     data = json.load(f)
-    instructions = []
-    with open("./train_data_16_10_2025.jsonl", "r", encoding="utf-8") as f:
-        data = f.readlines()
-    for item in data:
-        item_dict = ast.literal_eval(item)
-        all_sample = ""
-        for contents in item_dict["conversations"]:
-            all_sample += contents["role"] + ": " + contents["content"] + "\n"
-        instructions.append(all_sample)
-    
-    with mp.Pool(processes=14, initializer=_init_tokenizer, initargs=(DEFAULT_QWEN_MODEL, access_token)) as pool:
-        token_length_list = list(
-            tqdm(pool.imap(count_qwen_tokens, instructions), total=len(instructions))
-        )
-    # print(token_length_list)
-    print(f"Total Tokens: {sum(token_length_list)}")
-    avg_token_length = int(sum(token_length_list) / len(token_length_list))
-    print(f"Average token length: {avg_token_length}")
-    print(f"Max token length: {max(token_length_list)}")
-    print(f"Min token length: {min(token_length_list)}")
-    with open("./train_data_16_10_2025_norm.jsonl", "w", encoding="utf-8") as f:
-        for sample, length in zip(data, token_length_list):
-            if length in range(200, 4097):
-                f.write(json.dumps(sample, ensure_ascii=False) + "\n")
-            
+    # Parsing, validation, length filtering and output live in normalize_jsonl.py
+    # (one streaming pass; replaces the old literal_eval + fix_jsonl.py chain)
+    from itertools import islice
+
+    from normalize_jsonl import INPUT_JSONL, OUTPUT_JSONL, iter_records, normalize_jsonl, print_report, sample_text
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", default=INPUT_JSONL, help="Training jsonl from preprocess_data.py")
+    parser.add_argument("--output", default=OUTPUT_JSONL, help="Normalised jsonl for finetuning")
+    parser.add_argument("--model", default=DEFAULT_QWEN_MODEL, help="Tokenizer to count tokens with")
+    parser.add_argument("--processes", type=int, default=14, help="Worker processes for the benchmark's multi mode")
+    parser.add_argument("--min-len", type=int, default=200, help="Keep samples with at least this many tokens")
+    parser.add_argument("--max-len", type=int, default=4096, help="Keep samples with at most this many tokens")
+    parser.add_argument("--length-cache", default=LENGTH_CACHE_PATH,
+                        help="Token-length sidecar ('' re-tokenizes everything)")
+    parser.add_argument("--hist", action="store_true", help="Print a token-length histogram")
+    parser.add_argument("--benchmark", type=int, default=0,
+                        help="Only benchmark per-sample vs batched modes on the first N samples")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        texts = [sample_text(r) for r in islice(iter_records(args.input), args.benchmark)]
+        benchmark(texts, model_id=args.model, processes=args.processes)
+        raise SystemExit(0)
 
+    engine = TokenLengthEngine(args.model, processes=args.processes)
+    result = normalize_jsonl(args.input, args.output, engine, args.min_len, args.max_len,
+                             cache_path=args.length_cache or None)
+    print_report(result, args.min_len, args.max_len, hist=args.hist)
+    print(f"✅ Normalised dataset written to {', '.join(result['paths'])}")